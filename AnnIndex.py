@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import numpy as np
+from calculate_similarity import rank_similarity, rerank, gather_rows
+
+
+class IVFIndex:
+    def __init__(self, store, projection_dim=256, seed=0):
+        self.store = store
+        self.projection_dim = projection_dim
+        self.seed = seed
+        self.centroids_path = os.path.join(store.directory, "ivf_centroids.npy")
+        self.assignments_path = os.path.join(store.directory, "ivf_assignments.i32")
+        self.meta_path = os.path.join(store.directory, "ivf_meta.json")
+        self.projection = np.random.default_rng(seed).standard_normal(
+            (store.row_size, projection_dim), dtype=np.float32) / np.sqrt(projection_dim)
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self.generation = None
+        self._assignments_file = None
+        # Queries train the index while the indexer adds new rows
+        self.lock = threading.RLock()
+        self.load()
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def load(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        if meta.get("generation") != self.store.generation or not os.path.exists(self.centroids_path):
+            self.reset()
+            return
+        self.centroids = np.load(self.centroids_path)
+        self.trained_rows = meta.get("trained_rows", 0)
+        self.generation = self.store.generation
+        assignments = np.fromfile(self.assignments_path, dtype=np.int32) if os.path.exists(self.assignments_path) else []
+        self.assignments = np.full(self.store.row_count, -1, dtype=np.int32)
+        count = min(len(assignments), self.store.row_count)
+        self.assignments[:count] = assignments[:count]
+
+    def reset(self):
+        self.close()
+        for path in (self.centroids_path, self.assignments_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self.generation = self.store.generation
+
+    def close(self):
+        if self._assignments_file:
+            self._assignments_file.close()
+            self._assignments_file = None
+
+    def sync(self):
+        # The store was cleared or rebuilt, so the rows this index points at are gone
+        if self.generation != self.store.generation:
+            self.reset()
+
+    def needs_training(self, min_rows):
+        live_rows = len(self.store)
+        return live_rows >= min_rows and (not self.trained or live_rows > 4 * self.trained_rows)
+
+    def project(self, vectors):
+        return np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1) @ self.projection
+
+    def nearest_centroids(self, projected, count=1):
+        distances = (np.einsum("ij,ij->i", self.centroids, self.centroids)[None, :]
+                     - 2 * projected @ self.centroids.T)
+        if count >= len(self.centroids):
+            return np.argsort(distances, axis=1)
+        nearest = np.argpartition(distances, count - 1, axis=1)[:, :count]
+        return np.take_along_axis(nearest, np.argsort(np.take_along_axis(distances, nearest, 1), axis=1), 1)
+
+    def train(self, n_lists=None, iterations=10, sample_size=None, chunk_size=1024):
+        with self.lock:
+            self.sync()
+            rows = np.sort(np.fromiter((entry["row"] for entry in self.store.entries.values()), dtype=np.int64))
+            if len(rows) == 0:
+                return
+            if n_lists is None:
+                n_lists = int(np.clip(np.sqrt(len(rows)), 16, 4096))
+            n_lists = min(n_lists, len(rows))
+            rng = np.random.default_rng(self.seed)
+            sample_size = sample_size or min(len(rows), 40 * n_lists)
+            sample_rows = np.sort(rng.choice(rows, size=min(sample_size, len(rows)), replace=False))
+            matrix = self.store.matrix
+            sample = np.concatenate([self.project(gather_rows(matrix, sample_rows[start:start + chunk_size]))
+                                     for start in range(0, len(sample_rows), chunk_size)])
+
+            centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+            for _ in range(iterations):
+                self.centroids = centroids
+                labels = self.nearest_centroids(sample)[:, 0]
+                counts = np.bincount(labels, minlength=n_lists)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+                # Re-seed empty lists from random samples so every list stays useful
+                empty = np.flatnonzero(~filled)
+                if len(empty):
+                    centroids[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+            self.centroids = centroids
+
+            self.close()
+            self.assignments = np.full(self.store.row_count, -1, dtype=np.int32)
+            for start in range(0, len(rows), chunk_size):
+                chunk_rows = rows[start:start + chunk_size]
+                projected = self.project(gather_rows(matrix, chunk_rows))
+                self.assignments[chunk_rows] = self.nearest_centroids(projected)[:, 0]
+            np.save(self.centroids_path, self.centroids)
+            self.assignments.tofile(self.assignments_path)
+            self.trained_rows = len(rows)
+            with open(self.meta_path, "w") as meta_file:
+                json.dump({"generation": self.generation, "trained_rows": self.trained_rows}, meta_file)
+
+    def add(self, row, features):
+        with self.lock:
+            self.sync()
+            if not self.trained:
+                return
+            label = self.nearest_centroids(self.project(np.asarray(features)[None]))[0, 0]
+            if row >= len(self.assignments):
+                grown = np.full(max(row + 1, 2 * len(self.assignments)), -1, dtype=np.int32)
+                grown[:len(self.assignments)] = self.assignments
+                self.assignments = grown
+            self.assignments[row] = label
+            if self._assignments_file is None:
+                self._assignments_file = open(self.assignments_path, "r+b")
+            size = self._assignments_file.seek(0, os.SEEK_END)
+            if size < row * 4:
+                # Rows the index never saw stay unassigned rather than reading back as list 0
+                self._assignments_file.write(np.full(row - size // 4, -1, dtype=np.int32).tobytes())
+            self._assignments_file.seek(row * 4)
+            self._assignments_file.write(np.int32(label).tobytes())
+            self._assignments_file.flush()
+
+    def search(self, ref_mfcc, rows, top_k=None, n_probe=8):
+        # Every row in the n_probe lists closest to the reference is a candidate
+        rows = np.asarray(rows, dtype=np.int64)
+        with self.lock:
+            self.sync()
+            candidates = self.probe(ref_mfcc, rows, n_probe) if self.trained else None
+        if candidates is None:
+            return rank_similarity(ref_mfcc, self.store.matrix, rows, top_k, squared_norms=self.store.squared_norms)
+        return rerank(ref_mfcc, self.store, rows, candidates, top_k)
+
+    def probe(self, ref_mfcc, rows, n_probe):
+        probes = self.nearest_centroids(self.project(np.asarray(ref_mfcc)[None]), n_probe)[0]
+        assignments = np.full(len(rows), -1, dtype=np.int32)
+        known = rows < len(self.assignments)
+        assignments[known] = self.assignments[rows[known]]
+        # Rows added before training reached them are always candidates
+        return np.flatnonzero(np.isin(assignments, probes) | (assignments < 0))
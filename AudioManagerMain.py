@@ -1,21 +1,32 @@
+import time
+STARTED_AT = time.perf_counter()  # Startup is measured from here to the first shown window
 import json
 import shutil
 import sys
 import os
-import pygame
-import librosa
 import numpy as np
-from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QFileDialog, QTableWidget, \
-    QTableWidgetItem, QHeaderView, QAbstractItemView, QLabel, QProgressBar, QHBoxLayout, QSlider, QMenuBar, QMenu, \
-    QAction, QStyle, QMessageBox
-from PyQt5.QtCore import Qt, QTimer, QThread, QMimeData, QUrl
-from PyQt5.QtGui import QDragEnterEvent, QDropEvent, QFont, QMouseEvent, QDrag
-
-from DraggableTableWidget import DraggableTableWidget
-from extract_features import extract_features
-from calculate_similarity import calculate_similarity
+from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QFileDialog, QHeaderView, \
+    QAbstractItemView, QLabel, QProgressBar, QHBoxLayout, QSlider, QMenuBar, QMenu, QAction, QStyle, QMessageBox, \
+    QInputDialog
+from PyQt5.QtCore import Qt, QTimer, QThread
+from PyQt5.QtGui import QDragEnterEvent, QDropEvent, QFont, QMouseEvent
+
+from DraggableTableView import DraggableTableView
+from ResultsTableModel import ResultsTableModel
+from PlayButtonDelegate import PlayButtonDelegate
+from extract_features import extract_features, extract_frames, extract_landmarks, audio_metadata, feature_params, SAMPLE_RATE
 from SettingsDialog import SettingsDialog
 from AudioProcessor import AudioProcessor
+from LibraryWatcher import LibraryWatcher
+from LibraryScanner import AUDIO_EXTENSIONS
+from LibraryShards import LibraryShards, combine_reports
+from TaskWorker import TaskWorker
+from PreviewPlayer import PreviewPlayer
+from DebugPanel import DebugPanel
+from DuplicateFinder import DuplicateFinder
+from DuplicatesDialog import DuplicatesDialog
+from QueryServer import QueryClient
+from Instrumentation import instrumentation
 
 class AudioManager(QMainWindow):
     def __init__(self):
@@ -44,6 +55,26 @@ class AudioManager(QMainWindow):
         self.reload_action.triggered.connect(self.reload_audio_library_data)
         self.settings_menu.addAction(self.reload_action)
 
+        self.update_index_action = QAction("更新音频库索引", self)
+        self.update_index_action.triggered.connect(self.update_audio_library_index)
+        self.settings_menu.addAction(self.update_index_action)
+
+        self.agreement_action = QAction("评估压缩索引准确度", self)
+        self.agreement_action.triggered.connect(self.measure_compact_agreement)
+        self.settings_menu.addAction(self.agreement_action)
+
+        self.coarse_recall_action = QAction("评估两阶段搜索召回率", self)
+        self.coarse_recall_action.triggered.connect(self.measure_coarse_recall)
+        self.settings_menu.addAction(self.coarse_recall_action)
+
+        self.duplicates_action = QAction("查找重复文件", self)
+        self.duplicates_action.triggered.connect(self.find_duplicates)
+        self.settings_menu.addAction(self.duplicates_action)
+
+        self.debug_action = QAction("性能统计", self)
+        self.debug_action.triggered.connect(self.open_debug_panel)
+        self.settings_menu.addAction(self.debug_action)
+
         self.reference_control_layout = QHBoxLayout()
         self.reference_label = QLabel("参考音频: 无")
         self.reference_control_layout.addWidget(self.reference_label)
@@ -69,14 +100,25 @@ class AudioManager(QMainWindow):
         self.close_log_button.clicked.connect(self.close_log)
         self.close_log_button.setVisible(False)
         self.log_layout.addWidget(self.close_log_button)
+
+        self.cancel_button = QPushButton("取消扫描")
+        self.cancel_button.clicked.connect(self.cancel_worker)
+        self.cancel_button.setVisible(False)
+        self.log_layout.addWidget(self.cancel_button)
         self.layout.addLayout(self.log_layout)
 
-        self.table_widget = DraggableTableWidget()
-        self.table_widget.setColumnCount(4)
-        self.table_widget.setHorizontalHeaderLabels(["文件", "路径", "相似度", "播放"])
+        self.results_model = ResultsTableModel(self, metadata_lookup=self.lookup_metadata)
+        self.table_widget = DraggableTableView()
+        self.table_widget.setModel(self.results_model)
+        self.play_button_delegate = PlayButtonDelegate(self.table_widget)
+        self.play_button_delegate.clicked.connect(self.on_play_row_clicked)
+        self.table_widget.setItemDelegateForColumn(ResultsTableModel.PLAY_COLUMN, self.play_button_delegate)
         self.table_widget.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.table_widget.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
         self.table_widget.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.table_widget.setEditTriggers(QAbstractItemView.NoEditTriggers)  # Make the table read-only
+        self.table_widget.setSortingEnabled(True)
+        self.table_widget.sortByColumn(2, Qt.AscendingOrder)
         self.layout.addWidget(self.table_widget)
         self.table_widget.setContextMenuPolicy(Qt.CustomContextMenu)
         self.table_widget.customContextMenuRequested.connect(self.show_context_menu)
@@ -95,16 +137,31 @@ class AudioManager(QMainWindow):
         self.overlay.setVisible(False)
         self.overlay.setGeometry(0, 0, self.width(), self.height())
 
-        pygame.mixer.init()
         self.currently_playing = None
         self.timer = QTimer(self)
         self.timer.setInterval(500)
         self.timer.timeout.connect(self.update_progress)
         self.similar_files = []
+        self.file_metadata = {}
+        self.debug_panel = None
+        self.worker = None
+        self.pending_worker = None
         self.new_time = 0
 
         self.load_settings()
-        self.audio_library_cache = self.load_audio_library_cache()  # Initialize the cache
+        self.preview_player = PreviewPlayer(cache_bytes=self.preview_cache_mb * 1024 * 1024)
+        # The cache loads in the background, anything that needs it waits in library_ready_callbacks
+        self.library = None
+        self.ref_frames = None
+        self.ref_landmarks = None
+        self.library_ready_callbacks = []
+        self.cache_thread = None
+        self.query_client = None
+
+        self.indexing_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.indexing_status_label)
+        self.library_watcher = None
+        self.configure_query_server()
 
         self.setAcceptDrops(True)
         self.is_setting_position = False
@@ -112,70 +169,406 @@ class AudioManager(QMainWindow):
         self.table_widget.setDragEnabled(True)
         self.table_widget.setDragDropMode(QAbstractItemView.DragOnly)
 
-        self.table_widget.setContextMenuPolicy(Qt.CustomContextMenu)
-        self.table_widget.customContextMenuRequested.connect(self.show_context_menu)
-
     def load_settings(self):
-        self.audio_library_paths = []
-        self.refresh_rate = 500
+        config = {}
         if os.path.exists("config.json"):
             with open("config.json", "r") as file:
                 config = json.load(file)
-                self.audio_library_paths = config.get("audio_library_paths", [])
-                self.refresh_rate = config.get("refresh_rate", 500)
+        self.apply_config(config)
+
+    def apply_config(self, config):
+        self.audio_library_paths = config.get("audio_library_paths", [])
+        self.refresh_rate = config.get("refresh_rate", 500)
+        self.verify_content_hash = config.get("verify_content_hash", False)
+        self.extraction_workers = config.get("extraction_workers", os.cpu_count() or 1)
+        self.max_results = config.get("max_results", 1000)
+        self.ann_enabled = config.get("ann_enabled", False)
+        self.ann_nprobe = config.get("ann_nprobe", 8)
+        self.background_indexing = config.get("background_indexing", True)
+        self.watch_poll_interval = config.get("watch_poll_interval", 60)
+        self.embedding_mode = config.get("embedding_mode", "full")
+        self.embedding_dims = config.get("embedding_dims", 256)
+        self.coarse_search = config.get("coarse_search", False)
+        self.signature_segments = config.get("signature_segments", 4)
+        self.coarse_candidates = config.get("coarse_candidates", 200)
+        self.preview_cache_mb = config.get("preview_cache_mb", 256)
+        self.preview_preload_count = config.get("preview_preload_count", 10)
+        self.audio_extensions = config.get("audio_extensions", list(AUDIO_EXTENSIONS))
+        self.search_mode = config.get("search_mode", "whole")
+        self.feature_sample_rate = config.get("feature_sample_rate", SAMPLE_RATE)
+        self.normalize_audio = config.get("normalize_audio", True)
+        self.extraction_batch_size = config.get("extraction_batch_size", 16)
+        self.duplicate_threshold = config.get("duplicate_threshold", 50.0)
+        self.query_server_url = config.get("query_server_url", "")
         self.timer.setInterval(self.refresh_rate)
 
-    def save_settings(self):
-        config = {
+    def get_config(self):
+        return {
             "audio_library_paths": self.audio_library_paths,
-            "refresh_rate": self.refresh_rate
+            "refresh_rate": self.refresh_rate,
+            "verify_content_hash": self.verify_content_hash,
+            "extraction_workers": self.extraction_workers,
+            "max_results": self.max_results,
+            "ann_enabled": self.ann_enabled,
+            "ann_nprobe": self.ann_nprobe,
+            "background_indexing": self.background_indexing,
+            "watch_poll_interval": self.watch_poll_interval,
+            "embedding_mode": self.embedding_mode,
+            "embedding_dims": self.embedding_dims,
+            "coarse_search": self.coarse_search,
+            "signature_segments": self.signature_segments,
+            "coarse_candidates": self.coarse_candidates,
+            "preview_cache_mb": self.preview_cache_mb,
+            "preview_preload_count": self.preview_preload_count,
+            "audio_extensions": self.audio_extensions,
+            "search_mode": self.search_mode,
+            "feature_sample_rate": self.feature_sample_rate,
+            "normalize_audio": self.normalize_audio,
+            "extraction_batch_size": self.extraction_batch_size,
+            "duplicate_threshold": self.duplicate_threshold,
+            "query_server_url": self.query_server_url
         }
+
+    def extraction_params(self):
+        return feature_params(self.get_config())
+
+    def save_settings(self):
         with open("config.json", "w") as file:
-            json.dump(config, file, indent=4)
+            json.dump(self.get_config(), file, indent=4)
 
     def import_settings(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "导入设置", "", "配置文件 (*.json)")
         if file_path:
             with open(file_path, "r") as file:
                 config = json.load(file)
-                self.audio_library_paths = config.get("audio_library_paths", [])
-                self.refresh_rate = config.get("refresh_rate", 500)
+            self.apply_config(config)
             self.save_settings()
-            self.timer.setInterval(self.refresh_rate)
+            self.apply_library_settings()
+            self.configure_query_server()
+            self.start_library_watcher()
 
     def export_settings(self):
         file_path, _ = QFileDialog.getSaveFileName(self, "导出设置", "", "配置文件 (*.json)")
         if file_path:
-            config = {
-                "audio_library_paths": self.audio_library_paths,
-                "refresh_rate": self.refresh_rate
-            }
             with open(file_path, "w") as file:
-                json.dump(config, file, indent=4)
+                json.dump(self.get_config(), file, indent=4)
 
     def open_settings(self):
         dialog = SettingsDialog(self)
         if dialog.exec_():
             self.audio_library_paths = [dialog.audio_library_paths_list.item(i).text() for i in range(dialog.audio_library_paths_list.count())]
             self.refresh_rate = dialog.get_selected_refresh_rate()
+            self.verify_content_hash = dialog.verify_hash_checkbox.isChecked()
+            self.extraction_workers = dialog.workers_spinbox.value()
+            self.max_results = dialog.max_results_spinbox.value()
+            self.ann_enabled = dialog.ann_checkbox.isChecked()
+            self.ann_nprobe = dialog.nprobe_spinbox.value()
+            self.background_indexing = dialog.background_indexing_checkbox.isChecked()
+            self.embedding_mode = dialog.embedding_mode_combo.currentData()
+            self.coarse_search = dialog.coarse_checkbox.isChecked()
+            self.signature_segments = dialog.signature_segments_combo.currentData()
+            self.coarse_candidates = dialog.coarse_candidates_spinbox.value()
+            self.audio_extensions = dialog.get_audio_extensions()
+            self.search_mode = dialog.search_mode_combo.currentData()
+            self.feature_sample_rate = dialog.sample_rate_combo.currentData()
+            self.normalize_audio = dialog.normalize_checkbox.isChecked()
+            self.extraction_batch_size = dialog.batch_size_spinbox.value()
+            self.query_server_url = dialog.query_server_edit.text().strip()
             self.save_settings()
+            self.apply_library_settings(dialog.rebuild_paths)
+            self.configure_query_server()
+            self.start_library_watcher()
             self.timer.setInterval(self.refresh_rate)
 
+    def start_library_watcher(self):
+        self.stop_library_watcher()
+        if self.library is None or self.query_client is not None:
+            return
+        if not self.background_indexing or not self.audio_library_paths:
+            self.indexing_status_label.setText("后台索引: 已关闭")
+            return
+        self.watcher_thread = QThread()
+        self.library_watcher = LibraryWatcher(self.library, verify_hash=self.verify_content_hash,
+                                              poll_interval=self.watch_poll_interval,
+                                              extensions=self.audio_extensions,
+                                              batch_size=self.extraction_batch_size)
+        self.library_watcher.moveToThread(self.watcher_thread)
+        self.library_watcher.state_changed.connect(self.update_indexing_status)
+        self.library_watcher.queue_changed.connect(self.update_indexing_status)
+        self.library_watcher.error.connect(lambda message: self.statusBar().showMessage(message, 5000))
+        self.watcher_thread.started.connect(self.library_watcher.start)
+        self.watcher_thread.finished.connect(self.library_watcher.deleteLater)
+        self.update_indexing_status()
+        self.watcher_thread.start(QThread.LowestPriority)
+
+    def stop_library_watcher(self):
+        if self.library_watcher is not None:
+            self.library_watcher.stop()
+            self.watcher_thread.quit()
+            self.watcher_thread.wait()
+            self.library_watcher = None
+
+    def update_indexing_status(self, _=None):
+        if self.library_watcher is not None:
+            with self.library_watcher.queue_lock:
+                depth = len(self.library_watcher.queue)
+            self.indexing_status_label.setText(f"后台索引: {self.library_watcher.state} | 队列: {depth}")
+
+    def closeEvent(self, event):
+        if self.cache_thread is not None:
+            self.cache_thread.quit()
+            self.cache_thread.wait()
+        if self.worker is not None:
+            self.stop_worker()
+            self.library.checkpoint()
+        self.stop_library_watcher()
+        self.preview_player.shutdown()
+        super().closeEvent(event)
+
+    def stop_worker(self):
+        self.pending_worker = None
+        self.worker.cancel()
+        self.thread.quit()
+        self.thread.wait()
+
+    def library_options(self):
+        # Frame-level features and fingerprints of whole files are only kept while their search mode is in use
+        return {"ann": self.ann_enabled, "embedding_mode": self.embedding_mode,
+                "embedding_dims": self.embedding_dims, "segments": self.search_mode == "segment",
+                "fingerprints": self.search_mode == "fingerprint",
+                "coarse": self.coarse_search, "signature_segments": self.signature_segments,
+                "coarse_candidates": self.coarse_candidates}
+
+    def apply_library_settings(self, rebuild_paths=()):
+        # Only the shards of added roots are opened and only those of removed roots deleted
+        if self.library is None:
+            return
+        self.stop_library_watcher()
+        if self.worker is not None:
+            self.stop_worker()
+        # Features computed with other decode settings are not comparable, so the library is indexed again
+        params_changed = self.library.configure(self.extraction_params(), **self.library_options())
+        self.library.sync(self.audio_library_paths)
+        for root in rebuild_paths:
+            self.library.rebuild(root)
+        if (params_changed or rebuild_paths) and hasattr(self, 'reference_file_path'):
+            self.process_audio(self.reference_file_path)
+
+    def load_library_in_background(self):
+        self.indexing_status_label.setText("正在加载音频库索引...")
+        self.cache_thread = QThread()
+        self.cache_worker = TaskWorker(self.open_library)
+        self.cache_worker.moveToThread(self.cache_thread)
+        self.cache_worker.finished.connect(self.library_loaded)
+        self.cache_worker.error.connect(self.log_error)
+        self.cache_thread.started.connect(self.cache_worker.run)
+        self.cache_thread.start()
+
+    def open_library(self):
+        with instrumentation.stage("cache_load"):
+            library = LibraryShards("feature_cache", params=self.extraction_params(),
+                                    workers=self.extraction_workers, **self.library_options())
+            library.sync(self.audio_library_paths)
+            self.retire_json_cache()
+            return library
+
+    def library_loaded(self, library):
+        self.cache_thread.quit()
+        if library is None:
+            # The error is already shown, drop whatever was waiting for the cache
+            self.library_ready_callbacks = []
+            self.indexing_status_label.setText("音频库索引加载失败")
+            self.hide_busy()
+            return
+        self.library = library
+        self.start_library_watcher()
+        callbacks, self.library_ready_callbacks = self.library_ready_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def when_library_ready(self, callback):
+        if self.library is not None:
+            callback()
+        else:
+            self.log_label.setText("等待音频库索引加载...")
+            self.library_ready_callbacks.append(callback)
+
+    def report_startup_time(self):
+        elapsed = time.perf_counter() - STARTED_AT
+        instrumentation.record("time_to_first_window", elapsed, start=STARTED_AT)
+        if os.environ.get("AUDIOMANAGER_STARTUP_PROFILE"):
+            # Used by benchmark.py: report and exit once the library has loaded too
+            def report():
+                print(json.dumps({"time_to_first_window": elapsed,
+                                  "time_to_library_ready": time.perf_counter() - STARTED_AT}), flush=True)
+                QApplication.instance().quit()
+            self.when_library_ready(report)
+
+    def configure_query_server(self):
+        # A query server holds the one shared copy of the library, so this window then never loads its own
+        self.query_client = QueryClient(self.query_server_url) if self.query_server_url else None
+        if self.query_client is not None:
+            self.indexing_status_label.setText(f"查询服务: {self.query_server_url}")
+        elif self.cache_thread is None:
+            self.load_library_in_background()
+
+    def library_is_remote(self):
+        if self.query_client is not None:
+            QMessageBox.information(self, "提示", "已连接查询服务, 此功能需要在本窗口中加载音频库 (在设置中清空服务地址)")
+        return self.query_client is not None
+
+    def query_server(self, file_path):
+        # The reference is extracted the way the server extracted its library, whatever this window's settings
+        params = self.query_client.status()["params"]
+        with instrumentation.stage("reference_extract"):
+            ref_mfcc = extract_features(file_path, **params)
+        with instrumentation.stage("server_query"):
+            return self.query_client.query(ref_mfcc, self.max_results)
+
+    def server_results(self, results):
+        self.task_thread.quit()
+        if results is None:
+            self.hide_busy()
+            return
+        self.display_results(results)
+
+    def server_updated(self, status):
+        self.hide_busy()
+        self.task_thread.quit()
+        if status is not None:
+            self.statusBar().showMessage(f"查询服务正在更新音频库索引 (已索引 {status['files']} 个文件)", 5000)
+
+    def measure_compact_agreement(self):
+        if self.library_is_remote():
+            return
+        if self.library is None:
+            QMessageBox.information(self, "提示", "音频库索引正在加载, 请稍候")
+            return
+        if self.embedding_mode == "full":
+            QMessageBox.information(self, "提示", "请先在设置中启用压缩特征")
+            return
+        if not self.library.file_count():
+            QMessageBox.information(self, "提示", "音频库索引为空")
+            return
+        self.show_busy("评估压缩索引准确度...")
+        self.progress_bar.setMaximum(0)
+        self.run_task(self.compute_compact_agreement, self.show_compact_agreement)
+
+    def compute_compact_agreement(self):
+        reports = []
+        for shard in self.library:
+            if shard.compact_index is None or not len(shard.store):
+                continue
+            if shard.compact_index.needs_fitting(1):
+                shard.compact_index.fit()
+            rows = [entry["row"] for entry in shard.store.entries.values()]
+            reports.append(shard.compact_index.measure_agreement(rows))
+        return combine_reports(reports, ("compact_recall", "reranked_recall"))
+
+    def show_compact_agreement(self, report):
+        self.hide_busy()
+        self.task_thread.quit()
+        if report:
+            QMessageBox.information(self, "压缩索引准确度",
+                                    f"查询数: {report['queries']}, 前 {report['top_k']} 名召回率\n"
+                                    f"仅压缩特征: {report['compact_recall']:.1%}\n"
+                                    f"压缩特征 + 精确重排: {report['reranked_recall']:.1%}\n"
+                                    f"每条特征字节数: {report['bytes_per_row']} (完整: {report['full_bytes_per_row']})")
+
+    def measure_coarse_recall(self):
+        if self.library_is_remote():
+            return
+        if self.library is None:
+            QMessageBox.information(self, "提示", "音频库索引正在加载, 请稍候")
+            return
+        if not self.coarse_search:
+            QMessageBox.information(self, "提示", "请先在设置中启用两阶段搜索")
+            return
+        if not self.library.file_count():
+            QMessageBox.information(self, "提示", "音频库索引为空")
+            return
+        self.show_busy("评估两阶段搜索召回率...")
+        self.progress_bar.setMaximum(0)
+        self.run_task(self.compute_coarse_recall, self.show_coarse_recall)
+
+    def compute_coarse_recall(self):
+        reports = []
+        for shard in self.library:
+            if shard.signature_index is not None and len(shard.store):
+                rows = [entry["row"] for entry in shard.store.entries.values()]
+                reports.append(shard.signature_index.measure_recall(rows))
+        return combine_reports(reports, ("recall", "proven"))
+
+    def show_coarse_recall(self, report):
+        self.hide_busy()
+        self.task_thread.quit()
+        if report:
+            QMessageBox.information(self, "两阶段搜索召回率",
+                                    f"查询数: {report['queries']}, 前 {report['top_k']} 名召回率: {report['recall']:.1%}\n"
+                                    f"可证明与完整搜索一致的查询: {report['proven']:.1%}\n"
+                                    f"候选数: {report['candidates']}, 时间分辨率: {report['segments']} 段\n"
+                                    f"每条筛选特征字节数: {report['bytes_per_row']} (完整: {report['full_bytes_per_row']})")
+
+    def find_duplicates(self):
+        if self.library_is_remote():
+            return
+        if self.library is None:
+            QMessageBox.information(self, "提示", "音频库索引正在加载, 请稍候")
+            return
+        if not self.library.file_count():
+            QMessageBox.information(self, "提示", "音频库索引为空, 请先更新音频库索引")
+            return
+        threshold, accepted = QInputDialog.getDouble(self, "查找重复文件", "特征距离小于此值的文件视为重复:",
+                                                     self.duplicate_threshold, 0, 100000, 1)
+        if not accepted:
+            return
+        self.duplicate_threshold = threshold
+        self.save_settings()
+        self.show_busy("查找重复文件...")
+        self.run_task(self.compute_duplicates, self.show_duplicates)
+
+    def compute_duplicates(self):
+        # Only the cached features are compared, files changed since the last scan keep their old features.
+        # Copies are found across roots too, every shard's store takes part
+        finder = DuplicateFinder([shard.store for shard in self.library], self.duplicate_threshold,
+                                 workers=self.extraction_workers, on_progress=self.task_worker.progress.emit)
+        return finder.find()
+
+    def show_duplicates(self, clusters):
+        self.hide_busy()
+        self.task_thread.quit()
+        if clusters is not None:
+            DuplicatesDialog(clusters, self.duplicate_threshold, self).exec_()
+
+    def run_task(self, task, on_finished):
+        if self.library_watcher is not None:
+            self.library_watcher.pause()
+        self.task_thread = QThread()
+        self.task_worker = TaskWorker(task)
+        self.task_worker.moveToThread(self.task_thread)
+        self.task_worker.progress.connect(self.update_progress_bar)
+        self.task_worker.finished.connect(on_finished)
+        self.task_worker.finished.connect(self.resume_library_watcher)
+        self.task_worker.error.connect(self.log_error)
+        self.task_thread.started.connect(self.task_worker.run)
+        self.task_thread.start()
+
     def reload_audio_library_data(self):
-        self.audio_library_cache = {}
-        self.save_audio_library_cache(self.audio_library_cache)
+        if self.library_is_remote():
+            return
+        self.when_library_ready(self.clear_audio_library_data)
+
+    def clear_audio_library_data(self):
+        self.library.clear()
         if hasattr(self, 'reference_file_path'):
             self.process_audio(self.reference_file_path)
 
-    def save_audio_library_cache(self, audio_library_data):
-        with open("audio_library_cache.json", "w") as cache_file:
-            json.dump(audio_library_data, cache_file)
-
-    def load_audio_library_cache(self):
+    @staticmethod
+    def retire_json_cache():
+        # The old JSON cache has no file signatures and came from the un-normalized decode, its rows would be
+        # extracted again anyway, so it is set aside without reading it
         if os.path.exists("audio_library_cache.json"):
-            with open("audio_library_cache.json", "r") as cache_file:
-                return json.load(cache_file)
-        return {}
+            os.replace("audio_library_cache.json", "audio_library_cache.json.bak")
 
     def upload_reference_audio(self):
         if not self.audio_library_paths:
@@ -192,29 +585,120 @@ class AudioManager(QMainWindow):
 
     def process_audio(self, file_path):
         try:
-            self.progress_bar.setVisible(True)
-            self.log_label.setText("加载参考音频...")
-            self.log_label.setVisible(True)
-            self.close_log_button.setVisible(True)
-            self.overlay.setVisible(True)
-            self.set_elements_enabled(False)
-            self.table_widget.setRowCount(0)
-            self.ref_mfcc = extract_features(file_path)
+            self.show_busy("加载参考音频...")
+            self.results_model.set_results([])
             self.similar_files = []
-            self.thread = QThread()
-            self.worker = AudioProcessor(self.audio_library_paths, self.ref_mfcc, self.audio_library_cache)
-            self.worker.moveToThread(self.thread)
-            self.worker.progress.connect(self.update_progress_bar)
-            self.worker.finished.connect(self.display_results)
-            self.worker.error.connect(self.log_error)  # Connect the error signal to the log_error slot
-            self.thread.started.connect(self.worker.run)
-            self.thread.start()
+            if self.query_client is not None:
+                if self.search_mode != "whole":
+                    # Settings imported from elsewhere can combine a server with a mode it does not offer
+                    self.hide_busy()
+                    QMessageBox.information(self, "提示", "查询服务只能搜索整个文件, 请在设置中切换搜索模式或清空服务地址")
+                    return
+                self.run_task(lambda: self.query_server(file_path), self.server_results)
+                return
+            with instrumentation.stage("reference_extract"):
+                params = self.extraction_params()
+                self.ref_mfcc = extract_features(file_path, **params)
+                # Segment search matches the whole reference, not the fixed-length summary
+                self.ref_frames = extract_frames(file_path, **params) if self.search_mode == "segment" else None
+                self.ref_landmarks = extract_landmarks(file_path, **params) if self.search_mode == "fingerprint" else None
+            self.when_library_ready(lambda: self.start_worker(self.ref_mfcc, self.display_results))
         except Exception as e:
             self.log_label.setText(f"错误: {str(e)}")
             self.log_label.setStyleSheet("background-color: red; font-size: 16px;")
             self.log_label.setVisible(True)
             self.close_log_button.setVisible(True)
 
+    def update_audio_library_index(self):
+        if not self.audio_library_paths:
+            QMessageBox.warning(self, "警告", "音频库设置里不存在任何路径")
+            return
+        self.show_busy("更新音频库索引...")
+        if self.query_client is not None:
+            self.run_task(self.query_client.update, self.server_updated)
+            return
+        self.when_library_ready(lambda: self.start_worker(None, self.index_updated))
+
+    def show_busy(self, message):
+        self.progress_bar.setVisible(True)
+        self.log_label.setText(message)
+        self.log_label.setVisible(True)
+        self.close_log_button.setVisible(True)
+        self.overlay.setVisible(True)
+        self.set_elements_enabled(False)
+
+    def hide_busy(self):
+        self.progress_bar.setVisible(False)
+        self.log_label.setVisible(False)
+        self.close_log_button.setVisible(False)
+        self.overlay.setVisible(False)
+        self.set_elements_enabled(True)
+
+    def start_worker(self, ref_mfcc, on_finished):
+        if self.worker is not None:
+            # A new request pre-empts the running scan and starts as soon as that one has stopped
+            self.pending_worker = (ref_mfcc, on_finished)
+            self.worker.cancel()
+            return
+        if self.library_watcher is not None:
+            # The foreground scan indexes the same files, so let it have the disk
+            self.library_watcher.pause()
+        self.thread = QThread()
+        self.worker = AudioProcessor(self.library, ref_mfcc, verify_hash=self.verify_content_hash,
+                                     workers=self.extraction_workers, top_k=self.max_results,
+                                     n_probe=self.ann_nprobe, update_interval=self.refresh_rate,
+                                     extensions=self.audio_extensions,
+                                     ref_frames=self.ref_frames if self.search_mode == "segment" else None,
+                                     batch_size=self.extraction_batch_size,
+                                     ref_landmarks=self.ref_landmarks if self.search_mode == "fingerprint" else None)
+        self.worker.moveToThread(self.thread)
+        self.worker.progress.connect(self.update_progress_bar)
+        self.worker.partial_results.connect(self.show_partial_results)
+        self.worker.stats.connect(self.update_debug_panel)
+        self.worker_on_finished = on_finished
+        self.worker.finished.connect(self.worker_finished)
+        self.worker.error.connect(self.log_error)  # Connect the error signal to the log_error slot
+        self.thread.started.connect(self.worker.run)
+        self.thread.start()
+        self.cancel_button.setVisible(True)
+        self.cancel_button.raise_()  # Above the busy overlay, which swallows clicks
+
+    def index_updated(self, _):
+        self.hide_busy()
+        self.resume_library_watcher()
+
+    def worker_finished(self, results):
+        self.thread.quit()
+        self.thread.wait()
+        cancelled = self.worker.cancelled
+        failure = self.worker.failure
+        self.worker = None
+        self.cancel_button.setVisible(False)
+        self.library.flush()  # Save cache after processing
+        if self.pending_worker is not None:
+            ref_mfcc, on_finished = self.pending_worker
+            self.pending_worker = None
+            self.start_worker(ref_mfcc, on_finished)
+            return
+        if failure is not None:
+            self.hide_busy()
+            self.resume_library_watcher()
+            self.log_error(failure)
+            return
+        self.worker_on_finished(results)
+        if cancelled:
+            self.statusBar().showMessage("扫描已取消, 已提取的特征已保存, 下次扫描将从此继续", 5000)
+
+    def cancel_worker(self):
+        if self.worker is not None:
+            self.pending_worker = None
+            self.worker.cancel()
+            self.log_label.setText("正在取消扫描...")
+
+    def resume_library_watcher(self, _=None):
+        if self.library_watcher is not None:
+            self.library_watcher.resume()
+
     def log_error(self, message):
         self.log_label.setText(message)
         self.log_label.setStyleSheet("background-color: red; font-size: 16px;")
@@ -225,44 +709,38 @@ class AudioManager(QMainWindow):
         self.progress_bar.setMaximum(total)
         self.progress_bar.setValue(value)
 
+    def open_debug_panel(self):
+        if self.debug_panel is None:
+            self.debug_panel = DebugPanel(self)
+        self.debug_panel.show_stats(instrumentation.snapshot())
+        self.debug_panel.show()
+        self.debug_panel.raise_()
+
+    def update_debug_panel(self, stats):
+        if self.debug_panel is not None and self.debug_panel.isVisible():
+            self.debug_panel.show_stats(stats)
+
+    def show_partial_results(self, similar_files):
+        self.similar_files = similar_files
+        with instrumentation.stage("display_partial", rows=len(similar_files)):
+            self.results_model.set_results(similar_files)
+
     def display_results(self, similar_files):
         try:
             self.similar_files = similar_files
-            self.table_widget.setRowCount(0)
-            for idx, (file, path, similarity) in enumerate(self.similar_files):
-                self.table_widget.insertRow(idx)
-                self.table_widget.setItem(idx, 0, QTableWidgetItem(file))
-                self.table_widget.setItem(idx, 1, QTableWidgetItem(path))
-                self.table_widget.setItem(idx, 2, QTableWidgetItem(str(similarity)))
-                play_button = QPushButton("播放")
-                play_button.clicked.connect(lambda _, p=path, b=play_button: self.on_play_button_click(p, b))
-                self.table_widget.setCellWidget(idx, 3, play_button)
-                self.table_widget.setDragEnabled(True)
-                self.table_widget.setDragDropMode(QAbstractItemView.DragOnly)
-            self.progress_bar.setVisible(False)
-            self.log_label.setVisible(False)
-            self.close_log_button.setVisible(False)
-            self.overlay.setVisible(False)
-            self.set_elements_enabled(True)
-            self.thread.quit()
-            self.save_audio_library_cache(self.audio_library_cache)  # Save cache after processing
+            with instrumentation.stage("display", rows=len(similar_files)):
+                self.results_model.set_results(self.similar_files)
+                self.table_widget.horizontalHeader().setSortIndicator(2, Qt.AscendingOrder)
+            # The best matches are the ones most likely to be auditioned next
+            self.preview_player.preload([result[1] for result in similar_files[:self.preview_preload_count]])
+            self.hide_busy()
+            self.resume_library_watcher()
         except Exception as e:
             self.log_label.setText(f"错误: {str(e)}")
             self.log_label.setStyleSheet("background-color: red; font-size: 16px;")
             self.log_label.setVisible(True)
             self.close_log_button.setVisible(True)
 
-    def startDrag(self, supportedActions):
-        item = self.table_widget.currentItem()
-        if item:
-            mimeData = QMimeData()
-            file_path = self.table_widget.item(self.table_widget.currentRow(), 1).text()
-            url = QUrl.fromLocalFile(file_path)
-            mimeData.setUrls([url])
-            drag = QDrag(self)
-            drag.setMimeData(mimeData)
-            drag.exec_(Qt.CopyAction | Qt.MoveAction)
-
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Space:
             self.play_pause_reference()
@@ -271,17 +749,15 @@ class AudioManager(QMainWindow):
     def play_pause_reference(self):
         try:
             if self.currently_playing == self.reference_file_path:
-                pygame.mixer.music.stop()
+                self.preview_player.stop()
                 self.currently_playing = None
                 self.timer.stop()
                 self.play_pause_button.setText("播放")
             else:
-                pygame.mixer.music.load(self.reference_file_path)
-                pygame.mixer.music.play()
+                self.preview_player.play(self.reference_file_path)
                 self.currently_playing = self.reference_file_path
+                self.new_time = 0
                 self.timer.start()
-                pygame.mixer.music.set_endevent(pygame.USEREVENT)
-                self.installEventFilter(self)
                 self.play_pause_button.setText("暂停")
         except Exception as e:
             self.log_label.setText(f"错误: {str(e)}")
@@ -289,35 +765,32 @@ class AudioManager(QMainWindow):
             self.log_label.setVisible(True)
             self.close_log_button.setVisible(True)
 
-    def on_play_button_click(self, file_path, button):
+    def on_play_row_clicked(self, row):
+        self.on_play_button_click(self.results_model.path_at(row), self.results_model.offset_at(row))
+
+    def on_play_button_click(self, file_path, offset=0):
         try:
             if self.currently_playing == file_path:
-                pygame.mixer.music.stop()
+                self.preview_player.stop()
                 self.currently_playing = None
                 self.timer.stop()
-                button.setText("播放")
+                self.results_model.set_playing(None)
             else:
                 if self.currently_playing:
                     self.on_playback_complete()
-                pygame.mixer.music.load(file_path)
-                pygame.mixer.music.play()
+                self.preview_player.play(file_path, offset)
                 self.currently_playing = file_path
+                self.new_time = offset
                 self.timer.start()
-                pygame.mixer.music.set_endevent(pygame.USEREVENT)
-                self.installEventFilter(self)
-                button.setText("暂停")
+                self.results_model.set_playing(file_path)
         except Exception as e:
             self.log_label.setText(f"错误: {str(e)}")
             self.log_label.setStyleSheet("background-color: red; font-size: 16px;")
             self.log_label.setVisible(True)
             self.close_log_button.setVisible(True)
 
-    def eventFilter(self, source, event):
-        if event.type() == pygame.USEREVENT:
-            self.on_playback_complete()
-        return super().eventFilter(source, event)
-
     def on_playback_complete(self):
+        self.preview_player.stop()
         self.timer.stop()
         self.new_time = 0
         self.currently_playing = None
@@ -325,21 +798,33 @@ class AudioManager(QMainWindow):
         self.play_pause_button.setText("播放")
         # self.progress_label.setText(f"进度: {self.format_time(0)} / {self.format_time(0)}")
         self.slider.setValue(int(0))
-        for idx in range(self.table_widget.rowCount()):
-            play_button = self.table_widget.cellWidget(idx, 3)
-            if play_button:
-                play_button.setText("播放")
+        self.results_model.set_playing(None)
+
+    def get_metadata(self, file_path):
+        metadata = self.file_metadata.get(file_path)
+        if metadata is None and self.library is not None:
+            metadata = self.library.metadata(file_path)
+        if metadata is None:
+            # Reference files and entries cached before metadata existed are probed once
+            metadata = self.file_metadata[file_path] = audio_metadata(file_path)
+        return metadata
+
+    def lookup_metadata(self, file_path):
+        # Never touches the disk, the results table asks for it while painting
+        if self.library is None:
+            return None
+        return self.library.metadata(file_path)
+
+    def get_duration(self, file_path):
+        return self.get_metadata(file_path)["duration"]
 
     def set_position(self, position):
         try:
             if self.currently_playing:
                 self.is_setting_position = True  # Set the flag
-                total_time = librosa.get_duration(path=self.currently_playing)
+                total_time = self.get_duration(self.currently_playing)
                 self.new_time = (position / 100) * total_time
-                pygame.mixer.music.stop()
-                pygame.mixer.music.load(self.currently_playing)
-                pygame.mixer.music.play()
-                pygame.mixer.music.set_pos(self.new_time)
+                self.preview_player.seek(self.new_time)
                 self.slider.setValue(position)
                 self.progress_label.setText(f"进度: {self.format_time(self.new_time)} / {self.format_time(total_time)}")
                 self.is_setting_position = False  # Reset the flag
@@ -356,7 +841,7 @@ class AudioManager(QMainWindow):
     def force_sync_position(self):
         try:
             if self.currently_playing:
-                total_time = librosa.get_duration(path=self.currently_playing)
+                total_time = self.get_duration(self.currently_playing)
                 self.progress_label.setText(f"进度: {self.format_time(self.new_time)} / {self.format_time(total_time)}")
                 self.slider.setValue(int((self.new_time / total_time) * 100))
         except Exception as e:
@@ -368,16 +853,13 @@ class AudioManager(QMainWindow):
     def update_progress(self):
         try:
             if self.currently_playing and not self.is_setting_position:  # Check the flag
-                current_time = pygame.mixer.music.get_pos() / 1000
-                if current_time < 0:
-                    current_time = 0
-                total_time = librosa.get_duration(path=self.currently_playing)
-                actual_time = self.new_time + current_time
+                actual_time = self.preview_player.position()
+                total_time = self.get_duration(self.currently_playing)
 
                 self.progress_label.setText(f"进度: {self.format_time(actual_time)} / {self.format_time(total_time)}")
                 self.slider.setValue(int((actual_time / total_time) * 100))
 
-                if actual_time >= total_time or current_time == 0:
+                if not self.preview_player.is_playing():
                     self.on_playback_complete()
         except Exception as e:
             self.log_label.setText(f"错误: {str(e)}")
@@ -458,9 +940,9 @@ class AudioManager(QMainWindow):
         menu.exec_(self.table_widget.viewport().mapToGlobal(position))
 
     def copy_file_path(self):
-        item = self.table_widget.currentItem()
-        if item:
-            file_path = self.table_widget.item(self.table_widget.currentRow(), 1).text()
+        index = self.table_widget.currentIndex()
+        if index.isValid():
+            file_path = self.results_model.path_at(index.row())
             destination_path, _ = QFileDialog.getSaveFileName(self, "保存文件", file_path)
             if destination_path:
                 shutil.copy(file_path, destination_path)
@@ -474,4 +956,5 @@ if __name__ == "__main__":
 
     window = AudioManager()
     window.show()
+    QTimer.singleShot(0, window.report_startup_time)
     sys.exit(app.exec_())
\ No newline at end of file
@@ -1,40 +1,110 @@
 import os
-import numpy as np
+import time
 from PyQt5.QtCore import QObject, pyqtSignal
-from extract_features import extract_features
-from calculate_similarity import calculate_similarity
+from LibraryIndexer import RunningRanking
+from LibraryShards import ShardedIndexer, merge_results
+from LibraryScanner import AUDIO_EXTENSIONS
+from Instrumentation import instrumentation
 
 class AudioProcessor(QObject):
     progress = pyqtSignal(int, int)
+    partial_results = pyqtSignal(list)
     finished = pyqtSignal(list)
+    stats = pyqtSignal(dict)
     error = pyqtSignal(str)  # Add this line to define the error signal
 
-    def __init__(self, paths, ref_mfcc, cache):
+    def __init__(self, library, ref_mfcc, verify_hash=False, workers=1, top_k=None, n_probe=8,
+                 approx_min_rows=20000, update_interval=500, extensions=AUDIO_EXTENSIONS, ref_frames=None,
+                 batch_size=1, ref_landmarks=None):
         super().__init__()
-        self.paths = paths
+        self.library = library
         self.ref_mfcc = ref_mfcc
-        self.cache = cache
+        # With reference frames the whole of every file is searched for the reference instead
+        self.ref_frames = ref_frames
+        # With reference landmarks (hashes, times) only files that contain an exact copy of it are returned
+        self.ref_landmarks = ref_landmarks
+        self.failure = None
+        self.top_k = top_k
+        self.n_probe = n_probe
+        self.approx_min_rows = approx_min_rows
+        # Progress and partial results are coalesced so a large scan cannot flood the GUI thread
+        self.update_interval = max(update_interval, 50) / 1000
+        self.indexer = ShardedIndexer(library, verify_hash=verify_hash, workers=workers, extensions=extensions,
+                                      batch_size=batch_size, on_progress=self.report_progress,
+                                      on_error=self.error.emit)
 
     def run(self):
+        # Always finishes, a failed search reports itself through `failure` so the window leaves its busy state
+        try:
+            similar_files = self.search()
+        except Exception as e:
+            self.failure = f"Error processing search: {e}"
+            similar_files = []
+        self.stats.emit(instrumentation.snapshot())
+        self.finished.emit(similar_files)
+
+    def search(self):
+        self.last_update = time.monotonic()
+        self.ranked_counts = [0] * len(self.indexer.indexers)
+        self.ranking = None
+        whole_file = self.ref_mfcc is not None and self.ref_frames is None and self.ref_landmarks is None
+        # Partial results rank every file exactly, which only pays off when the final search is exact too
+        if whole_file and not self.indexer.uses_approximate_search(self.library.file_count(), self.approx_min_rows):
+            self.ranking = RunningRanking(None, self.ref_mfcc, self.top_k)
+        with instrumentation.stage("index"):
+            audio_paths = self.indexer.update()
+        self.progress.emit(self.indexer.processed_files, self.indexer.total_files)
         similar_files = []
-        total_files = sum(len(files) for path in self.paths for _, _, files in os.walk(path) if any(file.endswith(".wav") for file in files))
-        processed_files = 0
-        for path in self.paths:
-            for root, dirs, files in os.walk(path):
-                for file in files:
-                    if file.endswith(".wav"):
-                        audio_path = os.path.join(root, file)
-                        try:
-                            if audio_path in self.cache:
-                                lib_mfcc = np.array(self.cache[audio_path])
-                            else:
-                                lib_mfcc = extract_features(audio_path)
-                                self.cache[audio_path] = lib_mfcc.tolist()
-                            similarity = calculate_similarity(self.ref_mfcc, lib_mfcc)
-                            similar_files.append((file, audio_path, similarity))
-                        except Exception as e:
-                            self.error.emit(f"Error processing {audio_path}: {e}")  # Emit error signal
-                        processed_files += 1
-                        self.progress.emit(processed_files, total_files)
-        similar_files.sort(key=lambda x: x[2])
-        self.finished.emit(similar_files)
\ No newline at end of file
+        if self.ref_landmarks is not None:
+            hashes, times = self.ref_landmarks
+            with instrumentation.stage("fingerprint_match", files=len(audio_paths), hashes=len(hashes)):
+                matches = self.indexer.match_fingerprint(hashes, times, top_k=self.top_k)
+            # Shown as the share of the reference's landmarks that did not line up, 0 for a complete copy. A negative
+            # offset means the file is a piece of the reference, it plays from its start
+            similar_files = [(os.path.basename(path), path, max(0.0, 1 - votes / len(hashes)), max(0.0, offset))
+                             for path, votes, offset in matches]
+        elif self.ref_frames is not None:
+            with instrumentation.stage("segment_search", files=len(audio_paths)):
+                matches = self.indexer.search_segments(self.ref_frames, audio_paths, self.top_k)
+            similar_files = [(os.path.basename(path), path, distance, offset) for path, distance, offset in matches]
+        elif whole_file:
+            if self.indexer.uses_approximate_search(len(audio_paths), self.approx_min_rows):
+                similar_files = self.indexer.rank(self.ref_mfcc, audio_paths, self.top_k, self.n_probe,
+                                                   self.approx_min_rows)
+            else:
+                # Whatever the partial updates have not ranked yet is ranked in every shard side by side
+                remaining = [(indexer, indexer.indexed_paths[self.ranked_counts[position]:])
+                             for position, indexer in enumerate(self.indexer.indexers)]
+                ranked = ShardedIndexer.map(lambda indexer, paths: indexer.rank(
+                    self.ref_mfcc, paths, self.top_k, self.n_probe, self.approx_min_rows), remaining)
+                partial = self.ranking.results() if self.ranking is not None else []
+                similar_files = merge_results([partial] + ranked, self.top_k)
+        return similar_files
+
+    def cancel(self):
+        self.indexer.cancel()
+
+    @property
+    def cancelled(self):
+        return self.indexer.cancelled.is_set()
+
+    def report_progress(self, processed_files, total_files):
+        now = time.monotonic()
+        if now - self.last_update < self.update_interval:
+            return
+        self.last_update = now
+        self.progress.emit(processed_files, total_files)
+        if self.ranking is not None and self.indexer.uses_approximate_search(processed_files, self.approx_min_rows):
+            # The scan outgrew exact search, the files ranked so far are searched again approximately at the end
+            self.ranking = None
+            self.ranked_counts = [0] * len(self.indexer.indexers)
+        if self.ranking is not None:
+            self.update_ranking()
+            self.partial_results.emit(self.ranking.results())
+
+    def update_ranking(self):
+        # Every shard's files are ranked against its own store, the running top-k spans all of them
+        for position, indexer in enumerate(self.indexer.indexers):
+            indexed_paths = indexer.indexed_paths
+            self.ranking.push(indexed_paths[self.ranked_counts[position]:], indexer.cache)
+            self.ranked_counts[position] = len(indexed_paths)
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import numpy as np
+from calculate_similarity import rank_similarity, rerank, gather_rows, select_top_k
+
+
+class CompactIndex:
+    # PCA-projected, quantized copies of the store rows, small enough to keep the whole library in RAM
+    def __init__(self, store, dims=256, quantization="int8", seed=0):
+        self.store = store
+        self.dims = dims
+        self.quantization = quantization
+        self.code_dtype = np.dtype(np.int8 if quantization == "int8" else np.float16)
+        self.seed = seed
+        self.model_path = os.path.join(store.directory, "compact_model.npz")
+        self.codes_path = os.path.join(store.directory, "compact_codes.bin")
+        self.scales_path = os.path.join(store.directory, "compact_scales.f32")
+        self.meta_path = os.path.join(store.directory, "compact_meta.json")
+        self.mean = None
+        self.components = None
+        self.fitted_rows = 0
+        self.generation = None
+        self._codes_file = None
+        self._scales_file = None
+        # Queries fit the index and fill missing rows while the indexer adds new ones
+        self.lock = threading.RLock()
+        self.resize(0)
+        self.load()
+
+    @property
+    def fitted(self):
+        return self.components is not None
+
+    def load(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        if (meta.get("generation") != self.store.generation or meta.get("dims") != self.dims
+                or meta.get("quantization") != self.quantization or not os.path.exists(self.model_path)):
+            self.reset()
+            return
+        model = np.load(self.model_path)
+        self.mean, self.components = model["mean"], model["components"]
+        self.fitted_rows = meta.get("fitted_rows", 0)
+        self.generation = self.store.generation
+        self.resize(self.store.row_count)
+        if os.path.exists(self.codes_path) and os.path.exists(self.scales_path):
+            codes = np.fromfile(self.codes_path, dtype=self.code_dtype)
+            scales = np.fromfile(self.scales_path, dtype=np.float32)
+            count = min(len(scales), len(codes) // self.dims, len(self.scales))
+            self.codes[:count] = codes[:count * self.dims].reshape(count, self.dims)
+            self.scales[:count] = scales[:count]
+        self.update_norms(np.flatnonzero(self.scales >= 0))
+
+    def reset(self):
+        self.close()
+        for path in (self.model_path, self.codes_path, self.scales_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.mean = None
+        self.components = None
+        self.fitted_rows = 0
+        self.generation = self.store.generation
+        self.resize(0)
+
+    def close(self):
+        for name in ("_codes_file", "_scales_file"):
+            if getattr(self, name):
+                getattr(self, name).close()
+                setattr(self, name, None)
+
+    def sync(self):
+        if self.generation != self.store.generation:
+            self.reset()
+
+    def resize(self, row_count):
+        if row_count == 0:
+            self.codes = np.zeros((0, self.dims), dtype=self.code_dtype)
+            self.scales = np.zeros(0, dtype=np.float32)
+            self.norms = np.zeros(0, dtype=np.float32)
+            return
+        codes = np.zeros((row_count, self.dims), dtype=self.code_dtype)
+        scales = np.full(row_count, -1, dtype=np.float32)  # Negative scale marks a row with no code yet
+        norms = np.zeros(row_count, dtype=np.float32)
+        count = min(row_count, len(self.scales))
+        codes[:count], scales[:count], norms[:count] = self.codes[:count], self.scales[:count], self.norms[:count]
+        self.codes, self.scales, self.norms = codes, scales, norms
+
+    def needs_fitting(self, min_rows):
+        live_rows = len(self.store)
+        return live_rows >= min_rows and (not self.fitted or live_rows > 4 * self.fitted_rows)
+
+    def fit(self, sample_size=None, chunk_size=1024, power_iterations=2):
+        with self.lock:
+            self.sync()
+            rows = np.sort(np.fromiter((entry["row"] for entry in self.store.entries.values()), dtype=np.int64))
+            if len(rows) == 0:
+                return
+            rng = np.random.default_rng(self.seed)
+            sample_size = min(len(rows), sample_size or max(4 * self.dims, 4096))
+            sample_rows = np.sort(rng.choice(rows, size=sample_size, replace=False))
+            matrix = self.store.matrix
+            sample = np.concatenate([gather_rows(matrix, sample_rows[start:start + chunk_size])
+                                     for start in range(0, len(sample_rows), chunk_size)])
+            mean = sample.mean(axis=0)
+            sample -= mean
+            # Randomized PCA, a full SVD of an 8000-column matrix is far too slow here
+            dims = min(self.dims, sample.shape[0], sample.shape[1])
+            basis = sample @ rng.standard_normal((sample.shape[1], dims + 10), dtype=np.float32)
+            for _ in range(power_iterations):
+                basis, _ = np.linalg.qr(basis)
+                basis = sample @ (sample.T @ basis)
+            basis, _ = np.linalg.qr(basis)
+            _, _, vt = np.linalg.svd(basis.T @ sample, full_matrices=False)
+            components = np.zeros((self.dims, sample.shape[1]), dtype=np.float32)
+            components[:dims] = vt[:dims]
+
+            self.close()
+            self.mean, self.components = mean.astype(np.float32), components
+            self.resize(0)
+            self.resize(self.store.row_count)
+            for start in range(0, len(rows), chunk_size):
+                chunk_rows = rows[start:start + chunk_size]
+                self.codes[chunk_rows], self.scales[chunk_rows] = self.encode(gather_rows(matrix, chunk_rows))
+            self.update_norms(rows)
+            np.savez(self.model_path, mean=self.mean, components=self.components)
+            self.codes.tofile(self.codes_path)
+            self.scales.tofile(self.scales_path)
+            self.fitted_rows = len(rows)
+            with open(self.meta_path, "w") as meta_file:
+                json.dump({"generation": self.generation, "dims": self.dims, "quantization": self.quantization,
+                           "fitted_rows": self.fitted_rows}, meta_file)
+
+    def project(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        return (vectors - self.mean) @ self.components.T
+
+    def encode(self, vectors):
+        projected = self.project(vectors)
+        if self.quantization != "int8":
+            return projected.astype(self.code_dtype), np.ones(len(projected), dtype=np.float32)
+        scales = np.abs(projected).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(projected / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def decode(self, rows):
+        return self.codes[rows].astype(np.float32) * self.scales[rows, None]
+
+    def update_norms(self, rows):
+        for start in range(0, len(rows), 4096):
+            decoded = self.decode(rows[start:start + 4096])
+            self.norms[rows[start:start + 4096]] = np.einsum("ij,ij->i", decoded, decoded)
+
+    def add(self, row, features):
+        with self.lock:
+            self.sync()
+            if not self.fitted:
+                return
+            if row >= len(self.scales):
+                self.resize(max(row + 1, 2 * len(self.scales)))
+            codes, scales = self.encode(np.asarray(features)[None])
+            self.codes[row], self.scales[row] = codes[0], scales[0]
+            self.update_norms(np.array([row]))
+            self.write_row(row)
+
+    def write_row(self, row):
+        if self._codes_file is None:
+            self._codes_file = open(self.codes_path, "r+b")
+            self._scales_file = open(self.scales_path, "r+b")
+        row_bytes = self.dims * self.code_dtype.itemsize
+        scales_size = self._scales_file.seek(0, os.SEEK_END)
+        if scales_size < row * 4:
+            # Rows in between have no code yet
+            missing = row - scales_size // 4
+            self._scales_file.write(np.full(missing, -1, dtype=np.float32).tobytes())
+            self._codes_file.seek(scales_size // 4 * row_bytes)
+            self._codes_file.write(np.zeros((missing, self.dims), dtype=self.code_dtype).tobytes())
+        self._codes_file.seek(row * row_bytes)
+        self._codes_file.write(self.codes[row].tobytes())
+        self._scales_file.seek(row * 4)
+        self._scales_file.write(self.scales[row].tobytes())
+        self._codes_file.flush()
+        self._scales_file.flush()
+
+    def search(self, ref_mfcc, rows, top_k=None, exact=True, oversample=4, chunk_size=65536):
+        # Scores every row from its compact code, then re-ranks the best few exactly unless `exact` is off
+        rows = np.asarray(rows, dtype=np.int64)
+        with self.lock:
+            self.sync()
+            scored = self.score(ref_mfcc, rows, chunk_size) if self.fitted else None
+        if scored is None:
+            return rank_similarity(ref_mfcc, self.store.matrix, rows, top_k, squared_norms=self.store.squared_norms)
+        query, scores = scored
+        if not exact:
+            distances = np.sqrt(np.maximum(scores + np.dot(query, query), 0))
+            return select_top_k(np.arange(len(rows)), distances, top_k)
+        keep = None if top_k is None or top_k <= 0 else max(top_k * oversample, 100)
+        candidates, _ = select_top_k(np.arange(len(rows)), scores, keep)
+        return rerank(ref_mfcc, self.store, rows, candidates, top_k)
+
+    def score(self, ref_mfcc, rows, chunk_size):
+        # Squared distances to the decoded codes, without the query's own norm. Called with the lock held
+        if len(rows) and rows.max() >= len(self.scales):
+            self.resize(rows.max() + 1)
+        for row in rows[self.scales[rows] < 0]:
+            self.add(row, self.store.matrix[row])
+        query = self.project(np.asarray(ref_mfcc)[None])[0]
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), chunk_size):
+            chunk_rows = rows[start:start + chunk_size]
+            scores[start:start + len(chunk_rows)] = self.norms[chunk_rows] - 2 * (self.decode(chunk_rows) @ query)
+        return query, scores
+
+    def measure_agreement(self, rows, queries=20, top_k=50):
+        # Recall@k of the compact ranking, with and without re-ranking, against the full features
+        rows = np.asarray(rows, dtype=np.int64)
+        rng = np.random.default_rng(self.seed)
+        query_rows = rng.choice(rows, size=min(queries, len(rows)), replace=False)
+        matrix = self.store.matrix
+        compact_recall, reranked_recall = [], []
+        for query_row in query_rows:
+            ref = np.asarray(matrix[query_row])
+            exact, _ = rank_similarity(ref, matrix, rows, top_k, squared_norms=self.store.squared_norms)
+            compact, _ = self.search(ref, rows, top_k, exact=False)
+            reranked, _ = self.search(ref, rows, top_k)
+            compact_recall.append(len(set(exact) & set(compact)) / len(exact))
+            reranked_recall.append(len(set(exact) & set(reranked)) / len(exact))
+        return {"queries": len(query_rows), "top_k": top_k,
+                "compact_recall": float(np.mean(compact_recall)),
+                "reranked_recall": float(np.mean(reranked_recall)),
+                "bytes_per_row": self.dims * self.code_dtype.itemsize + 4,
+                "full_bytes_per_row": self.store.row_bytes}
@@ -0,0 +1,58 @@
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTreeWidget, QTreeWidgetItem, QFileDialog
+from Instrumentation import instrumentation
+
+class DebugPanel(QDialog):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("性能统计")
+        self.resize(700, 500)
+        self.layout = QVBoxLayout()
+        self.setLayout(self.layout)
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["阶段 / 计数器", "次数", "总计 (ms)", "平均 (ms)", "P95 (ms)", "最大 (ms)"])
+        self.layout.addWidget(self.tree)
+
+        buttons = QHBoxLayout()
+        self.refresh_button = QPushButton("刷新")
+        self.refresh_button.clicked.connect(lambda: self.show_stats(instrumentation.snapshot()))
+        buttons.addWidget(self.refresh_button)
+        self.reset_button = QPushButton("重置")
+        self.reset_button.clicked.connect(self.reset)
+        buttons.addWidget(self.reset_button)
+        self.export_json_button = QPushButton("导出 JSON")
+        self.export_json_button.clicked.connect(self.export_json)
+        buttons.addWidget(self.export_json_button)
+        self.export_trace_button = QPushButton("导出 Trace")
+        self.export_trace_button.clicked.connect(self.export_trace)
+        buttons.addWidget(self.export_trace_button)
+        self.layout.addLayout(buttons)
+
+        self.show_stats(instrumentation.snapshot())
+
+    def show_stats(self, stats):
+        self.tree.clear()
+        for name, stage in sorted(stats["stages"].items()):
+            item = QTreeWidgetItem([name, str(stage["count"])] + [f"{stage[key] * 1000:.2f}" for key in (
+                "total_seconds", "mean_seconds", "p95_seconds", "max_seconds")])
+            for bucket, count in stage["histogram_ms"].items():
+                item.addChild(QTreeWidgetItem([f"{bucket} ms", str(count)]))
+            self.tree.addTopLevelItem(item)
+        for name, value in sorted(stats["counters"].items()):
+            self.tree.addTopLevelItem(QTreeWidgetItem([name, str(value)]))
+        for column in range(self.tree.columnCount()):
+            self.tree.resizeColumnToContents(column)
+
+    def reset(self):
+        instrumentation.reset()
+        self.show_stats(instrumentation.snapshot())
+
+    def export_json(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出统计", "", "JSON 文件 (*.json)")
+        if file_path:
+            instrumentation.export_json(file_path)
+
+    def export_trace(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出 Trace", "", "Trace 文件 (*.json)")
+        if file_path:
+            instrumentation.export_trace(file_path)
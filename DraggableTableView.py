@@ -0,0 +1,17 @@
+from PyQt5.QtWidgets import QTableView
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QDrag
+
+class DraggableTableView(QTableView):
+    def mouseMoveEvent(self, event):
+        if event.buttons() == Qt.LeftButton:
+            self.startDrag(Qt.CopyAction)
+        super().mouseMoveEvent(event)
+
+    def startDrag(self, supportedActions):
+        index = self.currentIndex()
+        if index.isValid():
+            mimeData = self.model().mimeData([index])
+            drag = QDrag(self)
+            drag.setMimeData(mimeData)
+            drag.exec_(Qt.CopyAction | Qt.MoveAction)
@@ -0,0 +1,168 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from calculate_similarity import gather_rows
+from Instrumentation import instrumentation
+
+
+class DuplicateFinder:
+    # Clusters of near-identical files across feature stores. Random projections hashed into buckets (p-stable LSH)
+    # pick the candidate pairs, so only files that land together somewhere are ever compared
+    def __init__(self, stores, threshold=50.0, tables=32, hashes_per_table=8, bucket_width=4.0, max_bucket=256,
+                 neighbours=8, workers=os.cpu_count() or 1, seed=0, on_progress=None):
+        self.stores = list(stores)
+        self.threshold = threshold
+        self.tables = tables
+        self.hashes_per_table = hashes_per_table
+        # In units of the threshold, pairs within the threshold then share a single hash about 80% of the time
+        self.bucket_width = bucket_width * threshold
+        self.max_bucket = max_bucket
+        # Members of a larger bucket are only paired with this many neighbours along a projection
+        self.neighbours = neighbours
+        self.workers = max(1, workers)
+        self.seed = seed
+        self.on_progress = on_progress
+
+    def find(self, paths=None, chunk_size=1024):
+        # Returns clusters largest first, each a list of (path, distance to the cluster's first file)
+        wanted = None if paths is None else set(paths)
+        entries = []
+        for source, store in enumerate(self.stores):
+            with store.lock:
+                entries.extend((path, source, entry["row"]) for path, entry in store.entries.items()
+                               if wanted is None or path in wanted)
+        if len(entries) < 2:
+            return []
+        # Store by store in row order, so every chunk is read sequentially
+        entries.sort(key=lambda item: item[1:])
+        self.sources = np.array([source for _, source, _ in entries], dtype=np.int64)
+        self.rows = np.array([row for _, _, row in entries], dtype=np.int64)
+        with instrumentation.stage("duplicate_project", rows=len(entries)):
+            projected = self.project(chunk_size)
+        with instrumentation.stage("duplicate_candidates"):
+            pairs = self.candidate_pairs(projected)
+        with instrumentation.stage("duplicate_verify", pairs=len(pairs)):
+            pairs = self.verify(projected, pairs, chunk_size)
+        return self.clusters([path for path, _, _ in entries], pairs)
+
+    def read(self, positions):
+        # Features of the given entries, whichever store each one is in
+        positions = np.asarray(positions, dtype=np.int64)
+        sources = self.sources[positions]
+        if len(positions) and np.all(sources == sources[0]):
+            return gather_rows(self.stores[sources[0]].matrix, self.rows[positions])
+        features = np.empty((len(positions), self.stores[0].row_size), dtype=np.float32)
+        for source, store in enumerate(self.stores):
+            mask = sources == source
+            if mask.any():
+                features[mask] = gather_rows(store.matrix, self.rows[positions[mask]])
+        return features
+
+    def project(self, chunk_size):
+        # One sequential pass over the stores, chunks projected side by side
+        rng = np.random.default_rng(self.seed)
+        projection = rng.standard_normal((self.stores[0].row_size, self.tables * self.hashes_per_table),
+                                         dtype=np.float32)
+        count = len(self.rows)
+        projected = np.empty((count, projection.shape[1]), dtype=np.float32)
+        done = 0
+
+        def project_chunk(start):
+            stop = min(count, start + chunk_size)
+            projected[start:stop] = self.read(np.arange(start, stop)) @ projection
+            return stop - start
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for chunk_count in executor.map(project_chunk, range(0, count, chunk_size)):
+                done += chunk_count
+                self.report(done, count)
+        return projected
+
+    def candidate_pairs(self, projected):
+        rng = np.random.default_rng(self.seed + 1)
+        offsets = rng.uniform(0, self.bucket_width, projected.shape[1])
+        codes = np.floor((projected + offsets) / self.bucket_width).astype(np.int64)
+        # The hashes of a table are folded into one key, wrapping around on overflow is fine for bucketing
+        multipliers = rng.integers(1, 1 << 62, self.hashes_per_table, dtype=np.int64) | 1
+        count = len(projected)
+        found = np.empty(0, dtype=np.int64)
+        with np.errstate(over="ignore"):
+            for table in range(self.tables):
+                keys = codes[:, table * self.hashes_per_table:(table + 1) * self.hashes_per_table] @ multipliers
+                order = np.argsort(keys, kind="stable")
+                starts = np.flatnonzero(np.concatenate([[True], keys[order][1:] != keys[order][:-1], [True]]))
+                pairs = []
+                for start, stop in zip(starts[:-1], starts[1:]):
+                    if stop - start < 2:
+                        continue
+                    members = order[start:stop]
+                    if len(members) > self.max_bucket:
+                        # Silence and other degenerate audio pile into one bucket, there only close neighbours along
+                        # a projection are paired so the cost stays linear
+                        members = members[np.argsort(projected[members, table], kind="stable")]
+                        for shift in range(1, min(self.neighbours, len(members) - 1) + 1):
+                            pairs.append(np.stack([members[:-shift], members[shift:]], axis=1))
+                        continue
+                    first, second = np.triu_indices(len(members), 1)
+                    pairs.append(np.stack([members[first], members[second]], axis=1))
+                if pairs:
+                    pairs = np.sort(np.concatenate(pairs), axis=1)
+                    # Deduplicated table by table through a single int64 per pair, much faster than unique over rows
+                    found = np.union1d(found, pairs[:, 0] * count + pairs[:, 1])
+        return np.stack([found // count, found % count], axis=1)
+
+    def verify(self, projected, pairs, chunk_size):
+        # The projections already estimate every distance, only plausible pairs are read back in full
+        estimates = np.empty(len(pairs), dtype=np.float32)
+        for start in range(0, len(pairs), 65536):
+            difference = projected[pairs[start:start + 65536, 0]] - projected[pairs[start:start + 65536, 1]]
+            estimates[start:start + len(difference)] = np.sqrt(
+                np.einsum("ij,ij->i", difference, difference) / projected.shape[1])
+        pairs = pairs[estimates <= 2 * self.threshold]
+        distances = np.empty(len(pairs), dtype=np.float32)
+        done = 0
+
+        def verify_chunk(start):
+            chunk = pairs[start:start + chunk_size]
+            difference = self.read(chunk[:, 0]) - self.read(chunk[:, 1])
+            distances[start:start + len(chunk)] = np.sqrt(np.einsum("ij,ij->i", difference, difference))
+            return len(chunk)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for count in executor.map(verify_chunk, range(0, len(pairs), chunk_size)):
+                done += count
+                self.report(done, len(pairs))
+        instrumentation.count("duplicate_pairs_verified", len(pairs))
+        return pairs[distances <= self.threshold]
+
+    def clusters(self, paths, pairs):
+        parent = np.arange(len(paths))
+
+        def root(position):
+            while parent[position] != position:
+                parent[position] = parent[parent[position]]
+                position = parent[position]
+            return position
+
+        for first, second in pairs:
+            first, second = root(first), root(second)
+            if first != second:
+                parent[max(first, second)] = min(first, second)
+        groups = {}
+        for position in range(len(paths)):
+            groups.setdefault(root(position), []).append(position)
+        clusters = []
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            members.sort(key=lambda position: paths[position])
+            features = self.read(members)
+            difference = features - features[:1]
+            distances = np.sqrt(np.einsum("ij,ij->i", difference, difference))
+            clusters.append([(paths[position], float(distance)) for position, distance in zip(members, distances)])
+        clusters.sort(key=lambda cluster: (-len(cluster), max(distance for _, distance in cluster)))
+        return clusters
+
+    def report(self, value, total):
+        if self.on_progress:
+            self.on_progress(value, total)
@@ -0,0 +1,50 @@
+import csv
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QPushButton, QTreeWidget, QTreeWidgetItem, QFileDialog, \
+    QApplication, QLabel
+
+class DuplicatesDialog(QDialog):
+    def __init__(self, clusters, threshold, parent=None):
+        super().__init__(parent)
+        self.clusters = clusters
+        self.setWindowTitle("重复文件")
+        self.resize(900, 600)
+        self.layout = QVBoxLayout()
+        self.setLayout(self.layout)
+
+        duplicates = sum(len(cluster) - 1 for cluster in clusters)
+        self.layout.addWidget(QLabel(f"阈值 {threshold:g}: 共 {len(clusters)} 组, {duplicates} 个重复文件"))
+
+        self.tree = QTreeWidget()
+        self.tree.setHeaderLabels(["文件", "与组内第一个文件的距离"])
+        for number, cluster in enumerate(clusters, start=1):
+            group = QTreeWidgetItem([f"第 {number} 组 ({len(cluster)} 个文件)", ""])
+            for path, distance in cluster:
+                group.addChild(QTreeWidgetItem([path, f"{distance:.2f}"]))
+            self.tree.addTopLevelItem(group)
+        self.tree.expandAll()
+        self.tree.resizeColumnToContents(0)
+        self.layout.addWidget(self.tree)
+
+        buttons = QHBoxLayout()
+        self.copy_button = QPushButton("复制路径")
+        self.copy_button.clicked.connect(self.copy_selected_paths)
+        buttons.addWidget(self.copy_button)
+        self.export_button = QPushButton("导出 CSV")
+        self.export_button.clicked.connect(self.export_csv)
+        buttons.addWidget(self.export_button)
+        self.layout.addLayout(buttons)
+
+    def copy_selected_paths(self):
+        paths = [item.text(0) for item in self.tree.selectedItems() if item.parent() is not None]
+        if paths:
+            QApplication.clipboard().setText("\n".join(paths))
+
+    def export_csv(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出重复文件", "", "CSV 文件 (*.csv)")
+        if file_path:
+            with open(file_path, "w", encoding="utf-8", newline="") as output:
+                writer = csv.writer(output)
+                writer.writerow(["group", "path", "distance"])
+                for number, cluster in enumerate(self.clusters, start=1):
+                    for path, distance in cluster:
+                        writer.writerow([number, path, distance])
@@ -0,0 +1,104 @@
+import json
+import os
+import threading
+
+
+class FileEntries:
+    # Entries of indexed files by path, each carrying the signature (see file_signature) of the file it came from
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def is_current(self, path, signature):
+        entry = self.entries.get(path)
+        if entry is None:
+            return False
+        if entry.get("mtime") != signature["mtime"] or entry.get("size") != signature["size"]:
+            return False
+        return "hash" not in signature or entry.get("hash") == signature["hash"]
+
+    def prune(self, roots, seen_paths):
+        with self.lock:
+            prefixes = tuple(os.path.join(root, "") for root in roots)
+            stale = [path for path in self.entries if path.startswith(prefixes) and path not in seen_paths]
+            for path in stale:
+                self.remove(path)
+            return stale
+
+
+class EntryLog(FileEntries):
+    # Entries appended to a JSON lines index next to a data file. Index lines wait in memory until the next flush,
+    # the data they point at is on disk by then
+    def __init__(self, directory, data_name):
+        self.directory = directory
+        self.data_path = os.path.join(directory, data_name)
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.entries = {}
+        self._data_file = None
+        self._index_file = None
+        self._pending_index = []
+        # Writers can be the search worker and the background indexer at the same time
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def read_index(self):
+        # Every intact line as (path, entry), later lines override earlier ones
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as index_file:
+            for line in index_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                yield entry.pop("path"), entry
+
+    def append_index(self, path, entry):
+        self._pending_index.append(json.dumps(dict(entry, path=path)) + "\n")
+
+    def write_index(self, entries, index_path):
+        with open(index_path, "w", encoding="utf-8") as index_file:
+            for path, entry in entries.items():
+                index_file.write(json.dumps(dict(entry, path=path)) + "\n")
+
+    def discard_files(self):
+        with self.lock:
+            self._pending_index = []
+            self.close()
+            for path in (self.data_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.entries = {}
+
+    def close_files(self):
+        self.flush()
+        for name in ("_data_file", "_index_file"):
+            if getattr(self, name):
+                getattr(self, name).close()
+                setattr(self, name, None)
+
+    def flush(self):
+        with self.lock:
+            if self._data_file:
+                self._data_file.flush()
+            if self._pending_index:
+                if self._index_file is None:
+                    self._index_file = open(self.index_path, "a", encoding="utf-8")
+                self._index_file.write("".join(self._pending_index))
+                self._pending_index = []
+            if self._index_file:
+                self._index_file.flush()
+
+    def checkpoint(self):
+        # Makes everything stored so far survive a crash, not just a clean exit. The data is made durable before the
+        # index lines that point at it are written
+        with self.lock:
+            if self._data_file:
+                self._data_file.flush()
+                os.fsync(self._data_file.fileno())
+            self.flush()
+            if self._index_file:
+                os.fsync(self._index_file.fileno())
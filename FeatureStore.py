@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import numpy as np
+from EntryLog import EntryLog
+
+
+def file_signature(path, with_hash=False, sample_bytes=65536):
+    stat = os.stat(path)
+    signature = {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+    if with_hash:
+        # Hash only the head and tail of the file so large files stay cheap
+        digest = hashlib.blake2b(str(stat.st_size).encode(), digest_size=16)
+        with open(path, "rb") as audio_file:
+            digest.update(audio_file.read(sample_bytes))
+            if stat.st_size > 2 * sample_bytes:
+                audio_file.seek(-sample_bytes, os.SEEK_END)
+            digest.update(audio_file.read(sample_bytes))
+        signature["hash"] = digest.hexdigest()
+    return signature
+
+
+class FeatureStore(EntryLog):
+    def __init__(self, directory="feature_cache", shape=(20, 400), dtype=np.float32, params=None):
+        super().__init__(directory, "features.bin")
+        # Extraction settings the features were computed with, see extract_features.feature_params
+        self.params = dict(params or {})
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.row_size = int(np.prod(self.shape))
+        self.row_bytes = self.row_size * self.dtype.itemsize
+        self.free_rows = []
+        # Rows whose removal is not durable yet. Reused before then, a crash could leave the old path's entry
+        # pointing at another file's features
+        self.released_rows = []
+        self.row_count = 0
+        self.generation = 0
+        self._matrix = None
+        self._squared_norms = None
+        self.load()
+
+    def load(self):
+        self.close()
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        self.generation = meta.get("generation", 0)
+        if (meta.get("shape") != list(self.shape) or meta.get("dtype") != self.dtype.name
+                or meta.get("params", {}) != self.params):
+            # Features of a different layout cannot be reused, start over
+            self.clear()
+            return
+
+        self.row_count = 0
+        if os.path.exists(self.data_path):
+            size = os.path.getsize(self.data_path)
+            self.row_count = size // self.row_bytes
+            if size % self.row_bytes:
+                # A partially written row from an interrupted append
+                with open(self.data_path, "r+b") as data_file:
+                    data_file.truncate(self.row_count * self.row_bytes)
+
+        self.entries = {}
+        log_lines = 0
+        for path, entry in self.read_index():
+            log_lines += 1
+            if entry.get("row") is None or entry["row"] >= self.row_count:
+                self.entries.pop(path, None)
+            else:
+                self.entries[path] = entry
+
+        used_rows = {entry["row"] for entry in self.entries.values()}
+        self.free_rows = [row for row in range(self.row_count) if row not in used_rows]
+        self.released_rows = []
+        if log_lines > 2 * len(self.entries) + 1024:
+            self.compact_index()
+
+    def clear(self):
+        with self.lock:
+            self.discard_files()
+            self.free_rows = []
+            self.released_rows = []
+            self.row_count = 0
+            self.generation += 1
+            self.save_meta()
+
+    def save_meta(self):
+        meta = {"shape": list(self.shape), "dtype": self.dtype.name, "params": self.params,
+                "generation": self.generation}
+        with open(self.meta_path, "w") as meta_file:
+            json.dump(meta, meta_file)
+
+    def compact_index(self):
+        with self.lock:
+            self.close()
+            temp_path = self.index_path + ".tmp"
+            self.write_index(self.entries, temp_path)
+            os.replace(temp_path, self.index_path)
+
+    def checkpoint(self):
+        with self.lock:
+            super().checkpoint()
+            self.free_rows.extend(self.released_rows)
+            self.released_rows = []
+
+    def close(self):
+        self.close_files()
+        self._matrix = None
+        self._squared_norms = None
+
+    @property
+    def matrix(self):
+        if self.row_count == 0:
+            return np.empty((0, self.row_size), dtype=self.dtype)
+        with self.lock:
+            if self._matrix is None or self._matrix.shape[0] != self.row_count:
+                self.flush()
+                self._matrix = np.memmap(self.data_path, dtype=self.dtype, mode="r",
+                                         shape=(self.row_count, self.row_size))
+            return self._matrix
+
+    @property
+    def squared_norms(self):
+        with self.lock:
+            known = 0 if self._squared_norms is None else min(len(self._squared_norms), self.row_count)
+            if known != self.row_count or self._squared_norms is None:
+                # Only rows appended since the last call need their norms computed
+                matrix = self.matrix
+                norms = np.zeros(self.row_count, dtype=np.float32)
+                if known:
+                    norms[:known] = self._squared_norms[:known]
+                for start in range(known, self.row_count, 1024):
+                    chunk = np.asarray(matrix[start:start + 1024], dtype=np.float32)
+                    norms[start:start + len(chunk)] = np.einsum("ij,ij->i", chunk, chunk)
+                self._squared_norms = norms
+            return self._squared_norms
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, path):
+        return self.matrix[self.entries[path]["row"]].reshape(self.shape)
+
+    def __setitem__(self, path, features):
+        self.put(path, features)
+
+    def __delitem__(self, path):
+        self.remove(path)
+
+    def metadata(self, path):
+        entry = self.entries.get(path)
+        return entry if entry is not None and "duration" in entry else None
+
+    def row_of(self, path):
+        return self.entries[path]["row"]
+
+    def put(self, path, features, **info):
+        with self.lock:
+            data = np.ascontiguousarray(features, dtype=self.dtype).reshape(self.row_size)
+            entry = self.entries.get(path)
+            if entry is not None:
+                row = entry["row"]
+            elif self.free_rows:
+                row = self.free_rows.pop()
+            else:
+                row = self.row_count
+            self._write_row(row, data)
+            if self._squared_norms is not None and row < len(self._squared_norms):
+                self._squared_norms[row] = np.dot(data, data)
+            self.entries[path] = dict(info, row=row)
+            self.append_index(path, dict(info, row=row))
+            return row
+
+    def remove(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.released_rows.append(entry["row"])
+                self.append_index(path, {"row": None})
+
+    def _write_row(self, row, data):
+        if self._data_file is None:
+            mode = "r+b" if os.path.exists(self.data_path) else "w+b"
+            self._data_file = open(self.data_path, mode)
+        self._data_file.seek(row * self.row_bytes)
+        self._data_file.write(data.tobytes())
+        self._data_file.flush()
+        self.row_count = max(self.row_count, row + 1)
@@ -0,0 +1,144 @@
+import json
+import os
+import sqlite3
+import threading
+from itertools import repeat
+import numpy as np
+from fingerprint import LANDMARK_PARAMS, frames_to_seconds
+from EntryLog import FileEntries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE, info TEXT);
+CREATE TABLE IF NOT EXISTS landmarks (hash INTEGER, file INTEGER, time INTEGER,
+                                      PRIMARY KEY (hash, file, time)) WITHOUT ROWID;
+"""
+
+# Chance alignments of unrelated files rarely get this many votes on one time shift
+MIN_VOTES = 5
+
+
+class FingerprintStore(FileEntries):
+    # Landmark hashes of whole files in an inverted index on disk, hash -> (file, time). The table is clustered by
+    # hash, so a query reads only the postings of its own hashes however large the library grows
+    def __init__(self, directory="feature_cache", params=None):
+        self.directory = directory
+        self.params = dict(params or {})
+        self.database_path = os.path.join(directory, "fingerprints.sqlite")
+        self.entries = {}
+        # Path of each live file id, the few files a query votes for are looked up here
+        self.paths_by_id = {}
+        # Files deleted or replaced since their landmarks were last purged
+        self.removed = 0
+        self.connection = None
+        self.lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        self.close()
+        self.connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        meta = dict(self.connection.execute("SELECT key, value FROM meta"))
+        if (json.loads(meta.get("params", "null")) != self.params
+                or json.loads(meta.get("landmarks", "null")) != LANDMARK_PARAMS):
+            self.clear()
+            return
+        self.entries = {path: dict(json.loads(info), id=file_id)
+                        for file_id, path, info in self.connection.execute("SELECT id, path, info FROM files")}
+        self.paths_by_id = {entry["id"]: path for path, entry in self.entries.items()}
+        self.removed = int(meta.get("removed", 0))
+        # Landmarks of deleted files are skipped by queries, purge them once they outnumber the live files
+        if self.removed > max(len(self.entries), 100):
+            self.compact()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM landmarks")
+            self.connection.execute("DELETE FROM files")
+            self.connection.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                        [("params", json.dumps(self.params)),
+                                         ("landmarks", json.dumps(LANDMARK_PARAMS)), ("removed", "0")])
+            self.connection.commit()
+            self.entries = {}
+            self.paths_by_id = {}
+            self.removed = 0
+
+    def compact(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM landmarks WHERE file NOT IN (SELECT id FROM files)")
+            self.removed = 0
+            self.flush()
+
+    def close(self):
+        if self.connection is not None:
+            self.flush()
+            self.connection.close()
+            self.connection = None
+
+    def flush(self):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('removed', ?)", (str(self.removed),))
+            self.connection.commit()
+
+    def checkpoint(self):
+        self.flush()
+
+    def put(self, path, hashes, times, **info):
+        with self.lock:
+            self.remove(path)
+            # Ids are never reused, so the leftover landmarks of a removed file cannot be mistaken for these
+            file_id = self.connection.execute("INSERT INTO files (path, info) VALUES (?, ?)",
+                                              (path, json.dumps(info))).lastrowid
+            self.connection.executemany("INSERT OR IGNORE INTO landmarks VALUES (?, ?, ?)",
+                                        zip(np.asarray(hashes).tolist(), repeat(file_id),
+                                            np.asarray(times).tolist()))
+            self.entries[path] = dict(info, id=file_id)
+            self.paths_by_id[file_id] = path
+
+    def remove(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is not None:
+                self.connection.execute("DELETE FROM files WHERE id = ?", (entry["id"],))
+                del self.paths_by_id[entry["id"]]
+                self.removed += 1
+
+    def match(self, hashes, times, paths=None, top_k=None, min_votes=MIN_VOTES):
+        # Returns (path, votes, offset in seconds) of the files that contain the query, most votes first. Every
+        # query hash votes for the time shift to each place it occurs, a copy of the query piles its votes on one.
+        # The work follows the postings of the query's hashes, without paths every file in the store is searched
+        allowed = None if paths is None else set(paths)
+        with self.lock:
+            if not self.entries or not len(hashes):
+                return []
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS query (hash INTEGER, time INTEGER)")
+            self.connection.execute("DELETE FROM query")
+            self.connection.executemany("INSERT INTO query VALUES (?, ?)",
+                                        zip(np.asarray(hashes).tolist(), np.asarray(times).tolist()))
+            found = np.array(self.connection.execute(
+                "SELECT landmarks.file, landmarks.time - query.time FROM query "
+                "JOIN landmarks ON landmarks.hash = query.hash").fetchall(), dtype=np.int64).reshape(-1, 2)
+        if not len(found):
+            return []
+        keys, counts = np.unique(found[:, 0] << 32 | (found[:, 1] + (1 << 31)), return_counts=True)
+        # A copy cut between two frames splits its votes over neighbouring shifts, so those count together
+        votes = counts.copy()
+        for step in (-1, 1):
+            positions = np.minimum(np.searchsorted(keys, keys + step), len(keys) - 1)
+            neighbours = keys[positions] == keys + step
+            votes[neighbours] += counts[positions[neighbours]]
+        file_ids = keys >> 32
+        order = np.lexsort((-votes, file_ids))
+        best = order[np.r_[True, file_ids[order][1:] != file_ids[order][:-1]]]
+        best = best[votes[best] >= min_votes]
+        # Only the files that got enough votes are checked, landmarks of deleted files are still in the table
+        with self.lock:
+            files = {file_id: self.paths_by_id[file_id] for file_id in file_ids[best].tolist()
+                     if file_id in self.paths_by_id and (allowed is None or self.paths_by_id[file_id] in allowed)}
+        best = best[np.isin(file_ids[best], np.fromiter(files, dtype=np.int64, count=len(files)))]
+        best = best[np.argsort(-votes[best], kind="stable")][:top_k]
+        return [(files[int(file_ids[position])], int(votes[position]),
+                 float(frames_to_seconds((keys[position] & 0xffffffff) - (1 << 31)))) for position in best]
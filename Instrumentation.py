@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bucket edges in milliseconds, the last bucket takes everything slower
+BUCKET_EDGES_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class StageStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = [0] * (len(BUCKET_EDGES_MS) + 1)
+        self.recent = deque(maxlen=1024)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+        milliseconds = seconds * 1000
+        bucket = next((index for index, edge in enumerate(BUCKET_EDGES_MS) if milliseconds <= edge),
+                      len(BUCKET_EDGES_MS))
+        self.buckets[bucket] += 1
+        self.recent.append(seconds)
+
+    def summary(self):
+        recent = sorted(self.recent)
+
+        def percentile(fraction):
+            return recent[min(len(recent) - 1, int(fraction * len(recent)))] if recent else 0.0
+
+        labels = [f"<={edge}" for edge in BUCKET_EDGES_MS] + [f">{BUCKET_EDGES_MS[-1]}"]
+        return {"count": self.count, "total_seconds": self.total,
+                "mean_seconds": self.total / self.count if self.count else 0.0,
+                "p50_seconds": percentile(0.5), "p95_seconds": percentile(0.95), "max_seconds": self.maximum,
+                "histogram_ms": {label: count for label, count in zip(labels, self.buckets) if count}}
+
+
+class Instrumentation:
+    # Stage timings, counters and a bounded trace of events, shared by the GUI and the worker threads
+    def __init__(self, max_events=100000):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.events = deque(maxlen=max_events)
+
+    def reset(self):
+        with self.lock:
+            self.origin = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.events.clear()
+
+    @contextmanager
+    def stage(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, start, **args)
+
+    def record(self, name, seconds, start=None, thread="", **args):
+        # Stages timed in another process are recorded here, ending now
+        if start is None:
+            start = time.perf_counter() - seconds
+        event = {"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": seconds * 1e6,
+                 "pid": os.getpid(), "tid": thread or threading.current_thread().name}
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.stages.setdefault(name, StageStats()).add(seconds)
+            self.events.append(event)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return {"stages": {name: stats.summary() for name, stats in self.stages.items()},
+                    "counters": dict(self.counters)}
+
+    def export_json(self, path):
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump(self.snapshot(), output, indent=2)
+
+    def export_trace(self, path):
+        # Chrome trace-event format, loads in chrome://tracing and Perfetto
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as output:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, output)
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,330 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from extract_features import extract_with_metadata, extract_batch_with_metadata, prepare_extraction
+from calculate_similarity import rank_similarity, rank_similarity_batch, select_top_k
+from FeatureStore import file_signature
+from LibraryScanner import LibraryScanner, AUDIO_EXTENSIONS
+from Instrumentation import instrumentation
+
+
+class LibraryIndexer:
+    def __init__(self, paths, cache, verify_hash=False, workers=1, ann_index=None, compact_index=None,
+                 extensions=AUDIO_EXTENSIONS, on_progress=None, on_error=None, checkpoint_interval=10,
+                 checkpoint_files=500, segment_store=None, batch_size=1, signature_index=None, fingerprint_store=None,
+                 excluded_paths=()):
+        self.paths = paths
+        # Directories under the paths that are indexed elsewhere, such as the root of a nested shard
+        self.excluded_paths = list(excluded_paths)
+        self.cache = cache
+        self.scanner = LibraryScanner(cache.directory, extensions)
+        self.verify_hash = verify_hash
+        self.workers = max(1, workers)
+        self.ann_index = ann_index
+        self.compact_index = compact_index
+        # Coarse signatures that narrow an exact search down to a short list
+        self.signature_index = signature_index
+        # Derived indexes that follow the store row by row
+        self.row_indexes = [index for index in (ann_index, compact_index, signature_index) if index is not None]
+        # Whole-file frames for segment search, filled from the same decode as the fixed-size features
+        self.segment_store = segment_store
+        # Landmark hashes of whole files for exact-copy lookup, from the same decode as well
+        self.fingerprint_store = fingerprint_store
+        # Stores that keep one entry per file next to the cache
+        self.file_stores = [store for store in (segment_store, fingerprint_store) if store is not None]
+        # Files extracted together, their MFCCs come from one vectorized call (see mfcc_batch)
+        self.batch_size = max(1, batch_size)
+        self.on_progress = on_progress
+        self.on_error = on_error
+        # Extracted features are made durable every so often, an interrupted scan resumes from there
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_files = checkpoint_files
+        self.cancelled = threading.Event()
+        self.indexed_paths = []
+        self.processed_files = 0
+        self.total_files = 0
+
+    def update(self):
+        # Brings the cache up to date with the library and returns the indexed files in scan order
+        self.indexed_paths = []
+        audio_files = self.list_audio_files()
+        self.total_files = len(audio_files)
+        self.processed_files = 0
+        self.signatures = {}
+        self.unsaved_files = 0
+        self.last_checkpoint = time.monotonic()
+        pending = []
+        for audio_path in audio_files:
+            if self.cancelled.is_set():
+                break
+            try:
+                signature = file_signature(audio_path, self.verify_hash)
+                if self.is_current(audio_path, signature):
+                    instrumentation.count("cache_hits")
+                    self.add_indexed(audio_path)
+                    continue
+                instrumentation.count("cache_misses")
+                self.signatures[audio_path] = signature
+                pending.append(audio_path)
+            except Exception as e:
+                self.report_error(f"Error processing {audio_path}: {e}")
+
+        if self.workers > 1 and len(pending) > 1:
+            self.extract_parallel(pending)
+        else:
+            for batch in self.batches(pending, self.batch_size):
+                if self.cancelled.is_set():
+                    break
+                self.store_batch(batch, self.extract_batch(batch))
+
+        self.prune_missing(audio_files)
+        self.checkpoint()
+        return self.indexed_paths
+
+    def cancel(self):
+        # Safe from any thread, the scan stops after the files already being extracted
+        self.cancelled.set()
+
+    def is_current(self, audio_path, signature):
+        return self.cache.is_current(audio_path, signature) and all(
+            store.is_current(audio_path, signature) for store in self.file_stores)
+
+    def extract(self, audio_path):
+        return extract_with_metadata(audio_path, **self.extraction_options())
+
+    def extract_batch(self, audio_paths):
+        return extract_batch_with_metadata(audio_paths, **self.extraction_options())
+
+    def extraction_options(self):
+        return dict(self.cache.params, with_frames=self.segment_store is not None,
+                    with_landmarks=self.fingerprint_store is not None)
+
+    @staticmethod
+    def batches(audio_paths, batch_size):
+        return [audio_paths[start:start + batch_size] for start in range(0, len(audio_paths), batch_size)]
+
+    def frame_rate(self, metadata):
+        # Frames are computed at the configured rate, or at the file's own when features keep the native rate
+        return self.cache.params.get("sample_rate") or metadata["sample_rate"]
+
+    def checkpoint(self):
+        with instrumentation.stage("checkpoint"):
+            self.cache.checkpoint()
+            for store in self.file_stores:
+                store.checkpoint()
+        self.unsaved_files = 0
+        self.last_checkpoint = time.monotonic()
+
+    def list_audio_files(self, paths=None):
+        with instrumentation.stage("list_files"):
+            return self.scanner.list_audio_files(paths or self.paths, self.excluded_paths)
+
+    def find_changes(self):
+        # Prunes deleted files and returns the ones that need extracting, without extracting them
+        audio_files = self.list_audio_files()
+        changed = []
+        for audio_path in audio_files:
+            try:
+                if not self.is_current(audio_path, file_signature(audio_path, self.verify_hash)):
+                    changed.append(audio_path)
+            except OSError:
+                continue
+        self.prune_missing(audio_files)
+        return changed
+
+    def prune_missing(self, audio_files):
+        # Drop entries for files that were deleted since the last scan, from every store
+        seen_paths = set(audio_files)
+        self.cache.prune(self.paths, seen_paths)
+        for store in self.file_stores:
+            store.prune(self.paths, seen_paths)
+
+    def prune_directory(self, path):
+        # A deleted directory only reports itself, so drop everything cached under it
+        self.cache.prune([path], set())
+        for store in self.file_stores:
+            store.prune([path], set())
+
+    def index_file(self, audio_path):
+        if not os.path.exists(audio_path):
+            self.cache.remove(audio_path)
+            for store in self.file_stores:
+                store.remove(audio_path)
+            return False
+        signature = file_signature(audio_path, self.verify_hash)
+        if self.is_current(audio_path, signature):
+            return False
+        lib_mfcc, metadata, timings, frames, landmarks = self.extract(audio_path)
+        self.record_extraction(timings)
+        row = self.cache.put(audio_path, lib_mfcc, **metadata, **signature)
+        self.add_to_indexes(row, lib_mfcc)
+        if frames is not None:
+            self.segment_store.put(audio_path, frames, self.frame_rate(metadata), **signature)
+        if landmarks is not None:
+            self.fingerprint_store.put(audio_path, *landmarks, **signature)
+        return True
+
+    def extract_parallel(self, pending):
+        prepare_extraction()
+        # Batches shrink so that a small scan still keeps every worker busy
+        batch_size = min(self.batch_size, -(-len(pending) // self.workers))
+        queue = list(reversed(self.batches(pending, batch_size)))
+        while queue:
+            suspects = self.run_pool(queue, self.workers)
+            # A worker died without raising, so retry each in-flight file alone to find the culprit
+            for audio_path in [audio_path for batch in suspects for audio_path in batch]:
+                if self.cancelled.is_set():
+                    break
+                if self.run_pool([[audio_path]], 1):
+                    self.report_error(f"Error processing {audio_path}: extraction process crashed")
+
+    def run_pool(self, queue, workers):
+        in_flight = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            try:
+                while queue or in_flight:
+                    if self.cancelled.is_set():
+                        queue.clear()
+                    while queue and len(in_flight) < workers * 2:
+                        batch = queue.pop()
+                        in_flight[executor.submit(extract_batch_with_metadata, batch,
+                                                  **self.extraction_options())] = batch
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if isinstance(future.exception(), BrokenProcessPool):
+                            raise future.exception()
+                        batch = in_flight.pop(future)
+                        try:
+                            outcomes = future.result()
+                        except Exception as e:
+                            outcomes = [e] * len(batch)
+                        self.store_batch(batch, outcomes)
+            except BrokenProcessPool:
+                return list(in_flight.values())
+        return []
+
+    def store_batch(self, audio_paths, outcomes):
+        for audio_path, outcome in zip(audio_paths, outcomes):
+            try:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                self.store_features(audio_path, *outcome)
+            except Exception as e:
+                self.report_error(f"Error processing {audio_path}: {e}")
+
+    def store_features(self, audio_path, lib_mfcc, metadata, timings, frames=None, landmarks=None):
+        self.record_extraction(timings)
+        signature = self.signatures.pop(audio_path)
+        with instrumentation.stage("cache_write"):
+            row = self.cache.put(audio_path, lib_mfcc, **metadata, **signature)
+            if frames is not None:
+                self.segment_store.put(audio_path, frames, self.frame_rate(metadata), **signature)
+            if landmarks is not None:
+                self.fingerprint_store.put(audio_path, *landmarks, **signature)
+        self.add_to_indexes(row, lib_mfcc)
+        self.add_indexed(audio_path)
+        self.unsaved_files += 1
+        if (self.unsaved_files >= self.checkpoint_files
+                or time.monotonic() - self.last_checkpoint >= self.checkpoint_interval):
+            self.checkpoint()
+
+    @staticmethod
+    def record_extraction(timings):
+        instrumentation.record("decode", timings["decode"], thread="extract")
+        instrumentation.record("mfcc", timings["mfcc"], thread="extract")
+        instrumentation.count("decoded_bytes", timings["decoded_bytes"])
+        if "landmarks" in timings:
+            instrumentation.record("landmarks", timings["landmarks"], thread="extract")
+
+    def add_to_indexes(self, row, lib_mfcc):
+        for index in self.row_indexes:
+            index.add(row, lib_mfcc)
+
+    def add_indexed(self, audio_path):
+        self.indexed_paths.append(audio_path)
+        self.advance()
+
+    def report_error(self, message):
+        if self.on_error:
+            self.on_error(message)
+        self.advance()
+
+    def advance(self):
+        self.processed_files += 1
+        if self.on_progress:
+            self.on_progress(self.processed_files, self.total_files)
+
+    def uses_approximate_search(self, row_count, approx_min_rows=20000):
+        if self.signature_index is not None and row_count > self.signature_index.candidates:
+            return True
+        return (self.compact_index is not None or self.ann_index is not None) and row_count >= approx_min_rows
+
+    def rank(self, ref_mfcc, audio_paths, top_k=None, n_probe=8, approx_min_rows=20000):
+        if not audio_paths:
+            return []
+        rows = [self.cache.row_of(audio_path) for audio_path in audio_paths]
+        # Small libraries are scanned exactly, the approximate indexes only pay off on large ones
+        if self.compact_index is not None and len(rows) >= approx_min_rows:
+            if self.compact_index.needs_fitting(approx_min_rows):
+                self.compact_index.fit()
+            with instrumentation.stage("rank", method="compact", rows=len(rows)):
+                positions, distances = self.compact_index.search(ref_mfcc, rows, top_k)
+        elif self.ann_index is not None and len(rows) >= approx_min_rows:
+            if self.ann_index.needs_training(approx_min_rows):
+                self.ann_index.train()
+            with instrumentation.stage("rank", method="ivf", rows=len(rows)):
+                positions, distances = self.ann_index.search(ref_mfcc, rows, top_k, n_probe)
+        elif self.signature_index is not None and len(rows) > self.signature_index.candidates:
+            with instrumentation.stage("rank", method="coarse", rows=len(rows)):
+                positions, distances = self.signature_index.search(ref_mfcc, rows, top_k)
+        else:
+            with instrumentation.stage("rank", method="exact", rows=len(rows)):
+                positions, distances = rank_similarity(ref_mfcc, self.cache.matrix, rows, top_k,
+                                                       squared_norms=self.cache.squared_norms)
+            instrumentation.count("feature_bytes_read", len(rows) * self.cache.row_bytes)
+        return self.to_results(audio_paths, positions, distances)
+
+    def rank_many(self, ref_mfccs, audio_paths, top_k=None):
+        # One pass over the library serves every reference
+        if not audio_paths:
+            return [[] for _ in ref_mfccs]
+        rows = [self.cache.row_of(audio_path) for audio_path in audio_paths]
+        ranked = rank_similarity_batch(np.stack(ref_mfccs), self.cache.matrix, rows, top_k,
+                                       squared_norms=self.cache.squared_norms)
+        return [self.to_results(audio_paths, positions, distances) for positions, distances in ranked]
+
+    @staticmethod
+    def to_results(audio_paths, positions, distances):
+        return [(os.path.basename(audio_paths[position]), audio_paths[position], float(distance))
+                for position, distance in zip(positions, distances)]
+
+
+class RunningRanking:
+    # Exact top-k over a library that is still being scanned, fed with the files indexed so far
+    def __init__(self, cache, ref_mfcc, top_k=None):
+        self.cache = cache
+        self.ref_mfcc = ref_mfcc
+        self.top_k = top_k
+        self.paths = []
+        self.distances = np.empty(0, dtype=np.float32)
+
+    def push(self, audio_paths, cache=None):
+        # Files of a sharded library come from several stores, each batch is ranked against its own
+        if not audio_paths:
+            return
+        cache = self.cache if cache is None else cache
+        rows = [cache.row_of(audio_path) for audio_path in audio_paths]
+        with instrumentation.stage("partial_rank", rows=len(rows)):
+            positions, distances = rank_similarity(self.ref_mfcc, cache.matrix, rows, self.top_k,
+                                                   squared_norms=cache.squared_norms)
+        instrumentation.count("feature_bytes_read", len(rows) * cache.row_bytes)
+        paths = self.paths + [audio_paths[position] for position in positions]
+        keep, self.distances = select_top_k(np.arange(len(paths)), np.concatenate([self.distances, distances]),
+                                            self.top_k)
+        self.paths = [paths[position] for position in keep]
+
+    def results(self):
+        return LibraryIndexer.to_results(self.paths, range(len(self.paths)), self.distances)
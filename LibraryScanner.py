@@ -0,0 +1,125 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".flac", ".aiff", ".aif")
+
+
+def normalize_extensions(extensions):
+    return tuple(sorted({("." + extension.lstrip(".")).lower() for extension in extensions}))
+
+
+def is_audio_file(path, extensions=AUDIO_EXTENSIONS):
+    return path.lower().endswith(extensions)
+
+
+class LibraryScanner:
+    # Lists audio files with one scandir pass per directory, skipping directories whose mtime is unchanged
+    def __init__(self, cache_directory=None, extensions=AUDIO_EXTENSIONS, workers=8, settle_time=2.0):
+        self.extensions = normalize_extensions(extensions)
+        self.workers = max(1, workers)
+        self.settle_time = settle_time
+        self.cache_path = os.path.join(cache_directory, "listing_cache.json") if cache_directory else None
+        self.listings = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        # The cached listings only hold matching files, so they are useless for other extensions
+        if data.get("extensions") == list(self.extensions):
+            self.listings = data.get("directories", {})
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            data = {"extensions": list(self.extensions), "directories": dict(self.listings)}
+        # Scanners of the same shard can save at the same time, each writes its own temporary file
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(self.cache_path),
+                                         prefix="listing_cache.", suffix=".tmp", delete=False) as cache_file:
+            json.dump(data, cache_file, ensure_ascii=False)
+        os.replace(cache_file.name, self.cache_path)
+
+    def list_audio_files(self, paths, excluded=()):
+        # Roots and their subdirectories are listed side by side, which hides the latency of slow disks. Excluded
+        # directories are left out with everything under them
+        excluded = {os.path.normpath(path) for path in excluded}
+        listed = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.list_directory, path): path for path in paths if os.path.isdir(path)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    directory = pending.pop(future)
+                    listing = future.result()
+                    if listing is None:
+                        continue
+                    listed[directory] = listing
+                    for name in listing["dirs"]:
+                        subdirectory = os.path.join(directory, name)
+                        if os.path.normpath(subdirectory) in excluded:
+                            continue
+                        pending[executor.submit(self.list_directory, subdirectory)] = subdirectory
+
+        self.forget_unlisted(paths, listed)
+        self.save()
+        audio_files = []
+        for path in paths:
+            self.collect(path, listed, audio_files)
+        return audio_files
+
+    def collect(self, directory, listed, audio_files):
+        listing = listed.get(directory)
+        if listing is None:
+            return
+        audio_files.extend(os.path.join(directory, name) for name in listing["files"])
+        for name in listing["dirs"]:
+            self.collect(os.path.join(directory, name), listed, audio_files)
+
+    def list_directory(self, directory):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.listings.get(directory)
+        if cached is not None and cached["mtime"] == mtime:
+            return cached
+        files, dirs = [], []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        # Like os.walk, linked directories are not followed, a link back up would loop forever
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.name)
+                        elif entry.is_file() and is_audio_file(entry.name, self.extensions):
+                            files.append(entry.name)
+                    except OSError:
+                        continue
+        except OSError:
+            return None
+        listing = {"mtime": mtime, "files": sorted(files), "dirs": sorted(dirs)}
+        # A directory changed within the mtime resolution could change again unnoticed, so list it next time too
+        if time.time_ns() - mtime < self.settle_time * 1e9:
+            listing["mtime"] = None
+        with self.lock:
+            self.listings[directory] = listing
+        return listing
+
+    def forget_unlisted(self, paths, listed):
+        roots = tuple(os.path.join(path, "") for path in paths)
+        with self.lock:
+            for directory in list(self.listings):
+                if directory not in listed and (directory in paths or directory.startswith(roots)):
+                    del self.listings[directory]
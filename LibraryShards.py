@@ -0,0 +1,394 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from heapq import merge
+from itertools import islice
+from FeatureStore import FeatureStore
+from SegmentStore import SegmentStore
+from AnnIndex import IVFIndex
+from CompactIndex import CompactIndex
+from SignatureIndex import SignatureIndex
+from FingerprintStore import FingerprintStore
+from LibraryIndexer import LibraryIndexer
+from LibraryScanner import AUDIO_EXTENSIONS, normalize_extensions
+from Instrumentation import instrumentation
+
+# What the single shared store kept at the top of the cache directory, moved into the shards once
+LEGACY_FILES = ("features.bin", "index.jsonl", "meta.json", "listing_cache.json", "ivf_centroids.npy",
+                "ivf_assignments.i32", "ivf_meta.json", "compact_model.npz", "compact_codes.bin", "compact_scales.f32",
+                "compact_meta.json")
+
+
+class Shard:
+    # One library root with its own store and derived indexes, nothing in it is shared with another root
+    def __init__(self, root, directory, params=None, shape=(20, 400), ann=False, embedding_mode="full",
+                 embedding_dims=256, segments=False, coarse=False, signature_segments=4, coarse_candidates=200,
+                 fingerprints=False):
+        self.root = root
+        self.directory = directory
+        self.store = FeatureStore(directory, shape=shape, params=params)
+        self.ann_index = None
+        self.compact_index = None
+        self.segment_store = None
+        self.signature_index = None
+        self.fingerprint_store = None
+        self.configure(ann, embedding_mode, embedding_dims, segments, coarse, signature_segments, coarse_candidates,
+                       fingerprints)
+        with open(os.path.join(directory, "root.json"), "w", encoding="utf-8") as root_file:
+            json.dump({"root": root}, root_file, ensure_ascii=False)
+
+    def configure(self, ann=False, embedding_mode="full", embedding_dims=256, segments=False, coarse=False,
+                  signature_segments=4, coarse_candidates=200, fingerprints=False):
+        if ann and self.ann_index is None:
+            self.ann_index = IVFIndex(self.store)
+        elif not ann and self.ann_index is not None:
+            self.ann_index.close()
+            self.ann_index = None
+        if self.compact_index is not None and (self.compact_index.quantization != embedding_mode
+                                               or self.compact_index.dims != embedding_dims):
+            self.compact_index.close()
+            self.compact_index = None
+        if embedding_mode != "full" and self.compact_index is None:
+            self.compact_index = CompactIndex(self.store, dims=embedding_dims, quantization=embedding_mode)
+        if segments and self.segment_store is None:
+            self.segment_store = SegmentStore(os.path.join(self.directory, "segments"), params=self.store.params)
+        elif not segments and self.segment_store is not None:
+            self.segment_store.close()
+            self.segment_store = None
+        if self.signature_index is not None and (not coarse or self.signature_index.segments != signature_segments):
+            self.signature_index.close()
+            self.signature_index = None
+        if coarse and self.signature_index is None:
+            self.signature_index = SignatureIndex(self.store, signature_segments, coarse_candidates)
+        elif coarse:
+            self.signature_index.candidates = coarse_candidates
+        if fingerprints and self.fingerprint_store is None:
+            self.fingerprint_store = FingerprintStore(self.directory, params=self.store.params)
+        elif not fingerprints and self.fingerprint_store is not None:
+            self.fingerprint_store.close()
+            self.fingerprint_store = None
+
+    def set_params(self, params):
+        # Features from other decode settings cannot be compared with new ones, so the shard starts over
+        if self.store.params == params:
+            return False
+        self.store.params = dict(params)
+        self.clear()
+        if self.segment_store is not None:
+            self.segment_store.close()
+            self.segment_store = SegmentStore(os.path.join(self.directory, "segments"), params=params)
+        if self.fingerprint_store is not None:
+            self.fingerprint_store.close()
+            self.fingerprint_store = FingerprintStore(self.directory, params=params)
+        return True
+
+    def owns(self, path):
+        return path == self.root or path.startswith(os.path.join(self.root, ""))
+
+    def file_stores(self):
+        return [store for store in (self.segment_store, self.fingerprint_store) if store is not None]
+
+    def clear(self):
+        self.store.clear()
+        for store in self.file_stores():
+            store.clear()
+
+    def flush(self):
+        self.store.flush()
+        for store in self.file_stores():
+            store.flush()
+
+    def checkpoint(self):
+        self.store.checkpoint()
+        for store in self.file_stores():
+            store.checkpoint()
+
+    def close(self):
+        self.store.close()
+        for index in (self.ann_index, self.compact_index, self.segment_store, self.signature_index,
+                      self.fingerprint_store):
+            if index is not None:
+                index.close()
+
+
+class LibraryShards:
+    # The library as one shard per configured root under <directory>/shards, opened side by side
+    def __init__(self, directory="feature_cache", params=None, shape=(20, 400), workers=8, **options):
+        # options are the Shard.configure arguments, the same for every shard
+        self.directory = directory
+        self.params = dict(params or {})
+        self.shape = tuple(shape)
+        self.options = options
+        self.workers = max(1, workers)
+        self.shards = {}
+        self.lock = threading.RLock()
+
+    def shard_directory(self, root):
+        key = hashlib.sha1(os.path.normpath(root).encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, "shards", key)
+
+    def load(self, roots):
+        # Opens the shards of the given roots side by side, shards already open are kept as they are
+        roots = list(dict.fromkeys(roots))
+        with self.lock:
+            for root in [root for root in self.shards if root not in roots]:
+                self.shards.pop(root).close()
+            missing = [root for root in roots if root not in self.shards]
+            if missing:
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(missing))) as executor:
+                    opened = dict(zip(missing, executor.map(self.open_shard, missing)))
+                self.shards = {root: self.shards.get(root) or opened[root] for root in roots}
+            self.migrate()
+
+    def sync(self, roots):
+        # Like load, but the data of roots that left the library is deleted, every other shard is left alone
+        for root in [root for root in self.shards if root not in roots]:
+            self.remove(root)
+        self.load(roots)
+
+    def open_shard(self, root):
+        with instrumentation.stage("shard_load", root=root):
+            return Shard(root, self.shard_directory(root), self.params, self.shape, **self.options)
+
+    def remove(self, root):
+        with self.lock:
+            shard = self.shards.pop(root, None)
+        if shard is not None:
+            shard.close()
+            shutil.rmtree(shard.directory, ignore_errors=True)
+
+    def rebuild(self, root):
+        with self.lock:
+            if root in self.shards:
+                self.shards[root].clear()
+
+    def configure(self, params, **options):
+        # Returns whether the decode settings changed, in which case every shard was cleared
+        self.options = options
+        changed = self.params != params
+        self.params = dict(params)
+        for shard in self:
+            shard.set_params(self.params)
+            shard.configure(**self.options)
+        return changed
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.shards.values()))
+
+    def __len__(self):
+        return len(self.shards)
+
+    def file_count(self):
+        return sum(len(shard.store) for shard in self)
+
+    def shard_for(self, path):
+        # The innermost root wins when roots are nested
+        owners = [shard for shard in self if shard.owns(path)]
+        return max(owners, key=lambda shard: len(shard.root)) if owners else None
+
+    def metadata(self, path):
+        shard = self.shard_for(path)
+        return shard.store.metadata(path) if shard is not None else None
+
+    def clear(self):
+        for shard in self:
+            shard.clear()
+
+    def flush(self):
+        for shard in self:
+            shard.flush()
+
+    def checkpoint(self):
+        for shard in self:
+            shard.checkpoint()
+
+    def close(self):
+        for shard in self:
+            shard.close()
+
+    def migrate(self):
+        # Spreads a cache written before sharding over the shards, entries outside every root are dropped
+        if not os.path.exists(os.path.join(self.directory, "features.bin")):
+            return
+        legacy = FeatureStore(self.directory, shape=self.shape, params=self.params)
+        for path in list(legacy.entries):
+            shard = self.shard_for(path)
+            if shard is not None and path not in shard.store:
+                entry = dict(legacy.entries[path])
+                entry.pop("row")
+                shard.store.put(path, legacy[path], **entry)
+        legacy.close()
+        segments_directory = os.path.join(self.directory, "segments")
+        if os.path.exists(os.path.join(segments_directory, "frames.bin")):
+            legacy_segments = SegmentStore(segments_directory, params=self.params)
+            matrix = legacy_segments.matrix
+            for path, entry in list(legacy_segments.entries.items()):
+                shard = self.shard_for(path)
+                if shard is not None and shard.segment_store is not None and path not in shard.segment_store:
+                    info = {key: value for key, value in entry.items() if key not in ("start", "frames", "sample_rate")}
+                    frames = matrix[entry["start"]:entry["start"] + entry["frames"]].T
+                    shard.segment_store.put(path, frames, entry["sample_rate"], **info)
+            legacy_segments.close()
+        self.flush()
+        for name in LEGACY_FILES:
+            if os.path.exists(os.path.join(self.directory, name)):
+                os.remove(os.path.join(self.directory, name))
+        shutil.rmtree(segments_directory, ignore_errors=True)
+
+
+class ShardedIndexer:
+    # One LibraryIndexer per shard behind the LibraryIndexer interface, queries fan out and their results merge
+    def __init__(self, library, verify_hash=False, workers=1, extensions=AUDIO_EXTENSIONS, on_progress=None,
+                 on_error=None, batch_size=1, **kwargs):
+        self.library = library
+        self.extensions = normalize_extensions(extensions)
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.cancelled = threading.Event()
+        self.indexers = []
+        shards = list(library)
+        for shard in shards:
+            # Files under a nested root belong to that root's shard only, the outer one does not scan them
+            nested = [other.root for other in shards if other is not shard and shard.owns(other.root)]
+            indexer = LibraryIndexer([shard.root], shard.store, verify_hash=verify_hash, workers=workers,
+                                     ann_index=shard.ann_index, compact_index=shard.compact_index,
+                                     extensions=extensions, on_progress=self.report_progress, on_error=on_error,
+                                     segment_store=shard.segment_store, batch_size=batch_size,
+                                     signature_index=shard.signature_index,
+                                     fingerprint_store=shard.fingerprint_store, excluded_paths=nested,
+                                     **kwargs)
+            indexer.cancelled = self.cancelled
+            self.indexers.append(indexer)
+        self.indexed_paths = []
+
+    @property
+    def paths(self):
+        return [indexer.paths[0] for indexer in self.indexers]
+
+    @property
+    def processed_files(self):
+        return sum(indexer.processed_files for indexer in self.indexers)
+
+    @property
+    def total_files(self):
+        return sum(indexer.total_files for indexer in self.indexers)
+
+    def update(self):
+        # Shards are indexed one after another, each already keeps every extraction worker busy
+        self.indexed_paths = []
+        for indexer in self.indexers:
+            if self.cancelled.is_set():
+                break
+            self.indexed_paths.extend(indexer.update())
+        return self.indexed_paths
+
+    def report_progress(self, _processed_files, _total_files):
+        if self.on_progress:
+            self.on_progress(self.processed_files, self.total_files)
+
+    def report_error(self, message):
+        if self.on_error:
+            self.on_error(message)
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def indexer_for(self, path):
+        owners = [indexer for indexer in self.indexers
+                  if path == indexer.paths[0] or path.startswith(os.path.join(indexer.paths[0], ""))]
+        return max(owners, key=lambda indexer: len(indexer.paths[0])) if owners else None
+
+    def split(self, audio_paths):
+        groups = {}
+        for audio_path in audio_paths:
+            indexer = self.indexer_for(audio_path)
+            if indexer is not None:
+                groups.setdefault(id(indexer), (indexer, []))[1].append(audio_path)
+        return list(groups.values())
+
+    @staticmethod
+    def map(function, groups):
+        if len(groups) < 2:
+            return [function(indexer, paths) for indexer, paths in groups]
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            return list(executor.map(lambda group: function(*group), groups))
+
+    def list_audio_files(self, paths=None):
+        if paths is None:
+            return [audio_path for indexer in self.indexers for audio_path in indexer.list_audio_files()]
+        audio_files = []
+        for path in paths:
+            indexer = self.indexer_for(path)
+            if indexer is not None:
+                audio_files.extend(indexer.list_audio_files([path]))
+        return audio_files
+
+    def find_changes(self):
+        return [audio_path for indexer in self.indexers for audio_path in indexer.find_changes()]
+
+    def index_file(self, audio_path):
+        indexer = self.indexer_for(audio_path)
+        return indexer.index_file(audio_path) if indexer is not None else False
+
+    def prune_directory(self, path):
+        indexer = self.indexer_for(path)
+        if indexer is not None:
+            indexer.prune_directory(path)
+
+    def checkpoint(self):
+        for indexer in self.indexers:
+            indexer.checkpoint()
+
+    def flush(self):
+        for indexer in self.indexers:
+            indexer.cache.flush()
+            for store in indexer.file_stores:
+                store.flush()
+
+    def uses_approximate_search(self, row_count, approx_min_rows=20000):
+        return any(indexer.uses_approximate_search(row_count, approx_min_rows) for indexer in self.indexers)
+
+    def rank(self, ref_mfcc, audio_paths, top_k=None, n_probe=8, approx_min_rows=20000):
+        # Each shard decides between exact and approximate search by its own size
+        results = self.map(lambda indexer, paths: indexer.rank(ref_mfcc, paths, top_k, n_probe, approx_min_rows),
+                           self.split(audio_paths))
+        return merge_results(results, top_k)
+
+    def rank_many(self, ref_mfccs, audio_paths, top_k=None):
+        per_shard = self.map(lambda indexer, paths: indexer.rank_many(ref_mfccs, paths, top_k),
+                             self.split(audio_paths))
+        return [merge_results([results[position] for results in per_shard], top_k)
+                for position in range(len(ref_mfccs))]
+
+    def search_segments(self, ref_frames, audio_paths, top_k=None):
+        results = self.map(lambda indexer, paths: indexer.segment_store.search(ref_frames, paths, top_k),
+                           [group for group in self.split(audio_paths) if group[0].segment_store is not None])
+        return merge_results(results, top_k, key=lambda match: match[1])
+
+    def match_fingerprint(self, hashes, times, audio_paths=None, top_k=None):
+        # Without audio paths every fingerprinted file is searched, which costs nothing per file
+        groups = self.split(audio_paths) if audio_paths is not None else [(indexer, None) for indexer in self.indexers]
+        results = self.map(lambda indexer, paths: indexer.fingerprint_store.match(hashes, times, paths, top_k),
+                           [group for group in groups if group[0].fingerprint_store is not None])
+        return merge_results(results, top_k, key=lambda match: -match[1])
+
+
+def merge_results(result_lists, top_k=None, key=lambda result: result[2]):
+    # Every list is already sorted closest first
+    merged = merge(*result_lists, key=key)
+    return list(islice(merged, top_k)) if top_k else list(merged)
+
+
+def combine_reports(reports, keys):
+    # Every shard is measured on its own queries, the given rates are averaged over all of them
+    if not reports:
+        return None
+    queries = sum(report["queries"] for report in reports)
+    combined = dict(reports[0], queries=queries)
+    for key in keys:
+        combined[key] = sum(report[key] * report["queries"] for report in reports) / max(queries, 1)
+    return combined
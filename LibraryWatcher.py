@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+from LibraryShards import ShardedIndexer
+from LibraryScanner import AUDIO_EXTENSIONS, is_audio_file
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    # Without watchdog the library is polled instead of watched
+    FileSystemEventHandler = object
+    Observer = None
+
+
+class LibraryEventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "moved", "deleted", "closed"):
+            return
+        # Directory modifications only mean their contents changed, and those files report themselves
+        if event.is_directory and event.event_type == "modified":
+            return
+        for path in (event.src_path, getattr(event, "dest_path", "")):
+            if path and (event.is_directory or is_audio_file(path, self.watcher.indexer.extensions)):
+                self.watcher.enqueue(path)
+
+
+class LibraryWatcher(QObject):
+    state_changed = pyqtSignal(str)
+    queue_changed = pyqtSignal(int)
+    error = pyqtSignal(str)
+
+    def __init__(self, library, verify_hash=False, poll_interval=60, settle_time=2.0, extensions=AUDIO_EXTENSIONS,
+                 batch_size=1):
+        super().__init__()
+        # Every change is routed to the shard of the root it happened under
+        self.indexer = ShardedIndexer(library, verify_hash=verify_hash, extensions=extensions,
+                                      batch_size=batch_size, on_error=self.error.emit)
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.queue = OrderedDict()
+        self.queue_lock = threading.Lock()
+        self.paused = threading.Event()
+        self.stopped = threading.Event()
+        self.observer = None
+        self.state = "空闲"
+
+    @pyqtSlot()
+    def start(self):
+        self.process_timer = QTimer(self)
+        self.process_timer.timeout.connect(self.process_queue)
+        self.process_timer.start(500)
+        if Observer is not None:
+            self.observer = Observer()
+            handler = LibraryEventHandler(self)
+            for path in self.indexer.paths:
+                if os.path.isdir(path):
+                    self.observer.schedule(handler, path, recursive=True)
+            self.observer.start()
+        else:
+            self.poll_timer = QTimer(self)
+            self.poll_timer.timeout.connect(self.poll)
+            self.poll_timer.start(self.poll_interval * 1000)
+        # Catch up with whatever changed while the application was closed
+        self.poll()
+
+    def stop(self):
+        self.stopped.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+            self.observer = None
+
+    def pause(self):
+        self.paused.set()
+        self.set_state("已暂停")
+
+    def resume(self):
+        self.paused.clear()
+        self.set_state("空闲")
+
+    def set_state(self, state):
+        if state != self.state:
+            self.state = state
+            self.state_changed.emit(state)
+
+    def enqueue(self, path):
+        with self.queue_lock:
+            # Re-queue at the back so a file still being copied settles before it is read
+            self.queue.pop(path, None)
+            self.queue[path] = time.monotonic()
+            depth = len(self.queue)
+        self.queue_changed.emit(depth)
+
+    def poll(self):
+        if self.paused.is_set() or self.stopped.is_set():
+            return
+        self.set_state("扫描中")
+        try:
+            for audio_path in self.indexer.find_changes():
+                self.enqueue(audio_path)
+        except Exception as e:
+            self.error.emit(f"Error scanning library: {e}")
+        self.set_state("空闲")
+
+    def next_ready(self):
+        with self.queue_lock:
+            if not self.queue:
+                return None
+            path, queued_at = next(iter(self.queue.items()))
+            if time.monotonic() - queued_at < self.settle_time:
+                return None
+            del self.queue[path]
+            depth = len(self.queue)
+        self.queue_changed.emit(depth)
+        return path
+
+    def process_queue(self):
+        while not self.paused.is_set() and not self.stopped.is_set():
+            path = self.next_ready()
+            if path is None:
+                break
+            self.set_state("索引中")
+            try:
+                if os.path.isdir(path):
+                    for audio_path in self.indexer.list_audio_files([path]):
+                        self.enqueue(audio_path)
+                elif is_audio_file(path, self.indexer.extensions):
+                    self.indexer.index_file(path)
+                elif not os.path.exists(path):
+                    self.indexer.prune_directory(path)
+            except Exception as e:
+                self.error.emit(f"Error processing {path}: {e}")
+        self.indexer.flush()
+        if not self.paused.is_set():
+            self.set_state("空闲")
@@ -0,0 +1,34 @@
+from PyQt5.QtWidgets import QStyledItemDelegate, QStyleOptionButton, QStyle, QApplication
+from PyQt5.QtCore import QEvent, Qt, pyqtSignal
+
+class PlayButtonDelegate(QStyledItemDelegate):
+    # Paints a push button per row instead of creating a real widget for every result
+    clicked = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pressed_row = None
+
+    def paint(self, painter, option, index):
+        button = QStyleOptionButton()
+        button.rect = option.rect.adjusted(2, 2, -2, -2)
+        button.text = index.data(Qt.DisplayRole)
+        button.state = QStyle.State_Enabled if option.state & QStyle.State_Enabled else QStyle.State_None
+        if self.pressed_row == index.row():
+            button.state |= QStyle.State_Sunken
+        else:
+            button.state |= QStyle.State_Raised
+        style = option.widget.style() if option.widget else QApplication.style()
+        style.drawControl(QStyle.CE_PushButton, button, painter, option.widget)
+
+    def editorEvent(self, event, model, option, index):
+        if event.type() == QEvent.MouseButtonPress and event.button() == Qt.LeftButton:
+            self.pressed_row = index.row()
+            return True
+        if event.type() == QEvent.MouseButtonRelease and event.button() == Qt.LeftButton:
+            clicked = self.pressed_row == index.row() and option.rect.contains(event.pos())
+            self.pressed_row = None
+            if clicked:
+                self.clicked.emit(index.row())
+            return True
+        return super().editorEvent(event, model, option, index)
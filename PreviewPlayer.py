@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PreviewPlayer:
+    # Plays and seeks from decoded PCM kept in memory, so auditioning results never waits on the disk
+    def __init__(self, cache_bytes=256 * 1024 * 1024, preload_workers=1, frequency=44100, sample_width=2,
+                 channels=2):
+        self.cache_bytes = cache_bytes
+        self.cache = OrderedDict()
+        self.cached_bytes = 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=preload_workers)
+        # Audio is decoded straight into the format the mixer is opened with on first playback
+        self.frequency = frequency
+        self.sample_width = sample_width
+        self.channels = channels
+        self.frame_bytes = self.sample_width * self.channels
+        self.channel = None
+        self.sound = None
+        self.path = None
+        self.offset = 0
+        self.started_at = 0
+
+    def open_mixer(self):
+        import pygame  # Deferred until something is played, the mixer is slow to start
+        if self.channel is None:
+            # No format changes allowed, SDL converts to the device so the cached buffers stay valid
+            pygame.mixer.init(frequency=self.frequency, size=-8 * self.sample_width, channels=self.channels,
+                              allowedchanges=0)
+            self.channel = pygame.mixer.Channel(0)
+        return pygame
+
+    def decode(self, path):
+        from pydub import AudioSegment
+        audio = AudioSegment.from_file(path)
+        # Converted once to the mixer format so playback needs no further work
+        audio = audio.set_frame_rate(self.frequency).set_channels(self.channels).set_sample_width(self.sample_width)
+        return audio.raw_data
+
+    def load(self, path):
+        with self.lock:
+            data = self.cache.get(path)
+            if data is not None:
+                self.cache.move_to_end(path)
+                return data
+            future = self.pending.get(path)
+        # A preload already in flight is closer to done than a fresh decode
+        data = future.result() if future is not None else self.decode(path)
+        self.store(path, data)
+        return data
+
+    def store(self, path, data):
+        with self.lock:
+            self.pending.pop(path, None)
+            if path in self.cache or len(data) > self.cache_bytes:
+                return
+            self.cache[path] = data
+            self.cached_bytes += len(data)
+            while self.cached_bytes > self.cache_bytes:
+                _, evicted = self.cache.popitem(last=False)
+                self.cached_bytes -= len(evicted)
+
+    def preload(self, paths):
+        for path in paths:
+            with self.lock:
+                if path in self.cache or path in self.pending:
+                    continue
+                future = self.pending[path] = self.executor.submit(self.decode, path)
+            future.add_done_callback(lambda done, path=path: self.finish_preload(path, done))
+
+    def finish_preload(self, path, future):
+        # Preloads still queued at shutdown are cancelled, and asking a cancelled future for its exception raises
+        if future.cancelled() or future.exception() is not None:
+            with self.lock:
+                self.pending.pop(path, None)
+            return
+        self.store(path, future.result())
+
+    def play(self, path, position=0):
+        data = self.load(path)
+        pygame = self.open_mixer()
+        start = min(int(position * self.frequency), len(data) // self.frame_bytes) * self.frame_bytes
+        self.channel.stop()
+        self.sound = pygame.mixer.Sound(buffer=memoryview(data)[start:])
+        self.channel.play(self.sound)
+        self.path = path
+        self.offset = start / self.frame_bytes / self.frequency
+        self.started_at = time.monotonic()
+
+    def seek(self, position):
+        if self.path is not None:
+            self.play(self.path, position)
+
+    def stop(self):
+        if self.channel is not None:
+            self.channel.stop()
+        self.sound = None
+        self.path = None
+
+    def is_playing(self):
+        return self.path is not None and self.channel.get_busy()
+
+    def position(self):
+        if self.path is None:
+            return 0
+        return self.offset + time.monotonic() - self.started_at
+
+    def shutdown(self):
+        self.stop()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,265 @@
+import argparse
+import base64
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from extract_features import feature_params
+from LibraryShards import LibraryShards, ShardedIndexer
+from LibraryScanner import AUDIO_EXTENSIONS
+from Instrumentation import instrumentation
+
+DEFAULT_PORT = 8765
+
+
+class QueryBatcher:
+    # Queries that arrive within `window` seconds of each other are ranked in one pass over the library
+    def __init__(self, indexer, window=0.01, max_batch=64, n_probe=8, approx_min_rows=20000):
+        self.indexer = indexer
+        self.window = window
+        self.max_batch = max_batch
+        self.n_probe = n_probe
+        self.approx_min_rows = approx_min_rows
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="query-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, ref_mfcc, top_k=None):
+        future = Future()
+        self.requests.put((np.asarray(ref_mfcc, dtype=np.float32), top_k, future))
+        return future
+
+    def stop(self):
+        self.requests.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            batch = [request]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+            self.process(batch)
+
+    def process(self, batch):
+        try:
+            audio_paths = self.indexer.library_paths()
+            # One top-k serves the whole batch, each request is cut back to its own
+            top_ks = [top_k for _, top_k, _ in batch]
+            top_k = None if any(not top_k for top_k in top_ks) else max(top_ks)
+            with instrumentation.stage("server_batch", queries=len(batch), rows=len(audio_paths)):
+                if self.indexer.uses_approximate_search(len(audio_paths), self.approx_min_rows):
+                    # Approximate search reads little per query, a shared pass would not save anything
+                    results = [self.indexer.rank(ref, audio_paths, top_k, self.n_probe, self.approx_min_rows)
+                               for ref, _, _ in batch]
+                else:
+                    results = self.indexer.rank_many([ref for ref, _, _ in batch], audio_paths, top_k)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        instrumentation.count("server_queries", len(batch))
+        for (_, request_top_k, future), matches in zip(batch, results):
+            future.set_result(matches[:request_top_k] if request_top_k else matches)
+
+
+class ServerIndexer(ShardedIndexer):
+    # Keeps the library indexed in the background while the server answers queries from the cache
+    def __init__(self, library, poll_interval=60, **kwargs):
+        super().__init__(library, **kwargs)
+        self.poll_interval = poll_interval
+        self.rescan = threading.Event()
+        self.stopped = threading.Event()
+        self.indexing = False
+        self.thread = threading.Thread(target=self.run, name="library-indexer", daemon=True)
+
+    def library_paths(self):
+        audio_paths = []
+        for indexer in self.indexers:
+            root = os.path.join(indexer.paths[0], "")
+            with indexer.cache.lock:
+                audio_paths.extend(path for path in indexer.cache.entries if path.startswith(root))
+        return audio_paths
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.indexing = True
+            try:
+                self.update()
+                self.flush()
+            except Exception as e:
+                self.report_error(f"Error processing {', '.join(self.paths)}: {e}")
+            self.indexing = False
+            self.rescan.wait(self.poll_interval)
+            self.rescan.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.cancel()
+        self.rescan.set()
+        self.thread.join()
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/status":
+            self.send_json(self.server.status())
+        elif self.path == "/stats":
+            self.send_json(instrumentation.snapshot())
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError:
+            self.send_json({"error": "invalid JSON"}, 400)
+            return
+        if self.path == "/query":
+            try:
+                ref_mfcc = decode_features(body["features"], self.server.indexer.library.shape)
+            except (KeyError, ValueError) as e:
+                self.send_json({"error": f"invalid features: {e}"}, 400)
+                return
+            try:
+                matches = self.server.batcher.submit(ref_mfcc, body.get("top_k")).result()
+            except Exception as e:
+                self.send_json({"error": str(e)}, 500)
+                return
+            self.send_json({"results": matches})
+        elif self.path == "/update":
+            self.server.indexer.rescan.set()
+            self.send_json(self.server.status())
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, indexer, batch_window=0.01, max_batch=64, n_probe=8, verbose=False):
+        super().__init__(address, QueryRequestHandler)
+        self.indexer = indexer
+        self.batcher = QueryBatcher(indexer, batch_window, max_batch, n_probe)
+        self.verbose = verbose
+
+    def status(self):
+        library = self.indexer.library
+        return {"files": library.file_count(), "shape": list(library.shape), "params": library.params,
+                "indexing": self.indexer.indexing, "processed_files": self.indexer.processed_files,
+                "total_files": self.indexer.total_files, "paths": self.indexer.paths}
+
+    def server_close(self):
+        self.batcher.stop()
+        super().server_close()
+
+
+class QueryClient:
+    # Talks to a QueryServer, results come back in the same form as a local search
+    def __init__(self, url, timeout=600):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read() or b"{}").get("error", str(e)))
+
+    def status(self):
+        return self.request("/status")
+
+    def update(self):
+        return self.request("/update", {})
+
+    def query(self, ref_mfcc, top_k=None):
+        matches = self.request("/query", {"features": encode_features(ref_mfcc), "top_k": top_k})["results"]
+        return [(file, path, distance) for file, path, distance in matches]
+
+
+def encode_features(features):
+    return base64.b64encode(np.ascontiguousarray(features, dtype="<f4").tobytes()).decode("ascii")
+
+
+def decode_features(text, shape):
+    return np.frombuffer(base64.b64decode(text), dtype="<f4").reshape(shape)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在本机提供音频库相似度查询服务, 多个窗口和脚本共用一份索引")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--cache-dir", default="feature_cache", help="特征缓存目录")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址, 默认只接受本机连接")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="监听端口")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="特征提取进程数")
+    parser.add_argument("--batch-window", type=float, default=10, help="合并并发查询的等待时间 (毫秒)")
+    parser.add_argument("--max-batch", type=int, default=64, help="一次合并的最大查询数")
+    parser.add_argument("--verbose", action="store_true", help="输出每个请求的日志")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as file:
+            config = json.load(file)
+    library = LibraryShards(args.cache_dir, params=feature_params(config), ann=config.get("ann_enabled", False),
+                            embedding_mode=config.get("embedding_mode", "full"),
+                            embedding_dims=config.get("embedding_dims", 256), workers=args.workers,
+                            coarse=config.get("coarse_search", False),
+                            signature_segments=config.get("signature_segments", 4),
+                            coarse_candidates=config.get("coarse_candidates", 200))
+    library.sync(config.get("audio_library_paths", []))
+    indexer = ServerIndexer(library, poll_interval=config.get("watch_poll_interval", 60),
+                            verify_hash=config.get("verify_content_hash", False), workers=args.workers,
+                            extensions=config.get("audio_extensions", AUDIO_EXTENSIONS),
+                            batch_size=config.get("extraction_batch_size", 16),
+                            on_error=lambda message: print(message, file=sys.stderr))
+    server = QueryServer((args.host, args.port), indexer, args.batch_window / 1000, args.max_batch,
+                         config.get("ann_nprobe", 8), args.verbose)
+    indexer.thread.start()
+    print(f"查询服务已启动: http://{args.host}:{server.server_address[1]} ({library.file_count()} 个文件)", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        indexer.stop()
+        library.close()
+
+
+if __name__ == "__main__":
+    main()
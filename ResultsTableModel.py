@@ -0,0 +1,93 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, QMimeData, Qt, QUrl
+
+class ResultsTableModel(QAbstractTableModel):
+    HEADERS = ["文件", "路径", "相似度", "位置", "播放"]
+    OFFSET_COLUMN = 3
+    PLAY_COLUMN = 4
+
+    def __init__(self, parent=None, metadata_lookup=None):
+        super().__init__(parent)
+        self.metadata_lookup = metadata_lookup
+        self.results = []
+        self.playing_path = None
+
+    def set_results(self, results):
+        # A reset costs the same for ten rows or a million, the view only asks for what it shows
+        self.beginResetModel()
+        self.results = list(results)
+        self.endResetModel()
+
+    def path_at(self, row):
+        return self.results[row][1]
+
+    def offset_at(self, row):
+        # Segment search results carry the time the reference was found at, whole-file results start at 0
+        result = self.results[row]
+        return result[3] if len(result) > 3 else 0
+
+    def set_playing(self, path):
+        self.playing_path = path
+        if self.results:
+            self.dataChanged.emit(self.index(0, self.PLAY_COLUMN),
+                                  self.index(len(self.results) - 1, self.PLAY_COLUMN), [Qt.DisplayRole])
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.results)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return None
+        file, path, similarity = self.results[index.row()][:3]
+        column = index.column()
+        if column == 0:
+            if role == Qt.ToolTipRole and self.metadata_lookup is not None:
+                return self.describe(path) or file
+            return file
+        if column == 1:
+            return path
+        if column == 2:
+            return str(similarity)
+        if column == self.OFFSET_COLUMN:
+            if len(self.results[index.row()]) < 4:
+                return ""
+            minutes, seconds = divmod(self.offset_at(index.row()), 60)
+            return f"{int(minutes):02}:{seconds:05.2f}"
+        return "暂停" if path == self.playing_path else "播放"
+
+    def describe(self, path):
+        metadata = self.metadata_lookup(path)
+        if not metadata:
+            return None
+        minutes, seconds = divmod(int(metadata["duration"]), 60)
+        return (f"时长: {minutes:02}:{seconds:02}  采样率: {metadata['sample_rate']} Hz  "
+                f"声道: {metadata['channels']}  格式: {metadata['format']}  大小: {metadata.get('size', 0) // 1024} KB")
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        if column == self.PLAY_COLUMN:
+            return
+        self.layoutAboutToBeChanged.emit()
+        self.results.sort(key=lambda result: result[column] if column < len(result) else 0,
+                          reverse=order == Qt.DescendingOrder)
+        self.layoutChanged.emit()
+
+    def mimeTypes(self):
+        return ["text/uri-list"]
+
+    def mimeData(self, indexes):
+        mime_data = QMimeData()
+        rows = sorted({index.row() for index in indexes})
+        mime_data.setUrls([QUrl.fromLocalFile(self.path_at(row)) for row in rows])
+        return mime_data
@@ -0,0 +1,152 @@
+import json
+import os
+import numpy as np
+from calculate_similarity import select_top_k
+from extract_features import HOP_LENGTH
+from EntryLog import EntryLog
+
+
+class SegmentStore(EntryLog):
+    # Frame-level MFCCs of whole files, appended one file after another so a library scan is one pass over one file
+    def __init__(self, directory=os.path.join("feature_cache", "segments"), n_mfcc=20, dtype=np.float32,
+                 params=None):
+        super().__init__(directory, "frames.bin")
+        self.params = dict(params or {})
+        self.n_mfcc = n_mfcc
+        self.dtype = np.dtype(dtype)
+        self.frame_bytes = n_mfcc * self.dtype.itemsize
+        self.frame_count = 0
+        self._matrix = None
+        self.load()
+
+    def load(self):
+        self.close()
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        if (meta.get("n_mfcc") != self.n_mfcc or meta.get("dtype") != self.dtype.name
+                or meta.get("params", {}) != self.params):
+            self.clear()
+            return
+        self.frame_count = os.path.getsize(self.data_path) // self.frame_bytes if os.path.exists(self.data_path) else 0
+        self.entries = {}
+        for path, entry in self.read_index():
+            if entry.get("start") is None or entry["start"] + entry["frames"] > self.frame_count:
+                self.entries.pop(path, None)
+            else:
+                self.entries[path] = entry
+        live_frames = sum(entry["frames"] for entry in self.entries.values())
+        # Replaced and deleted files leave their frames behind, rewrite once they outweigh the live ones
+        if self.frame_count > 2 * live_frames + (1 << 20):
+            self.compact()
+
+    def clear(self):
+        with self.lock:
+            self.discard_files()
+            self.frame_count = 0
+            with open(self.meta_path, "w") as meta_file:
+                json.dump({"n_mfcc": self.n_mfcc, "dtype": self.dtype.name, "params": self.params}, meta_file)
+
+    def compact(self):
+        with self.lock:
+            self.close()
+            matrix = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self.frame_count, self.n_mfcc))
+            entries = {}
+            start = 0
+            with open(self.data_path + ".tmp", "wb") as data_file:
+                for path, entry in sorted(self.entries.items(), key=lambda item: item[1]["start"]):
+                    data_file.write(matrix[entry["start"]:entry["start"] + entry["frames"]].tobytes())
+                    entries[path] = dict(entry, start=start)
+                    start += entry["frames"]
+            del matrix
+            self.write_index(entries, self.index_path + ".tmp")
+            os.replace(self.data_path + ".tmp", self.data_path)
+            os.replace(self.index_path + ".tmp", self.index_path)
+            self.entries = entries
+            self.frame_count = start
+
+    def close(self):
+        self.close_files()
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        with self.lock:
+            if self.frame_count == 0:
+                return np.empty((0, self.n_mfcc), dtype=self.dtype)
+            if self._matrix is None or self._matrix.shape[0] != self.frame_count:
+                self.flush()
+                self._matrix = np.memmap(self.data_path, dtype=self.dtype, mode="r",
+                                         shape=(self.frame_count, self.n_mfcc))
+            return self._matrix
+
+    def put(self, path, frames, sample_rate, **info):
+        # frames is (n_mfcc, count) as librosa returns it, stored frame-major
+        data = np.ascontiguousarray(np.asarray(frames, dtype=self.dtype).T)
+        with self.lock:
+            if self._data_file is None:
+                self._data_file = open(self.data_path, "ab")
+            self._data_file.write(data.tobytes())
+            entry = dict(info, start=self.frame_count, frames=len(data), sample_rate=sample_rate)
+            self.frame_count += len(data)
+            self.entries[path] = entry
+            self.append_index(path, entry)
+
+    def remove(self, path):
+        with self.lock:
+            if self.entries.pop(path, None) is not None:
+                self.append_index(path, {"start": None})
+
+    def search(self, ref_frames, paths=None, top_k=None, chunk_frames=1 << 16):
+        # Returns (path, distance, offset in seconds) of the best window of each file, closest first
+        ref = np.asarray(ref_frames, dtype=np.float64).T
+        length = len(ref)
+        with self.lock:
+            entries = [(path, self.entries[path]) for path in (self.entries if paths is None else paths)
+                       if path in self.entries]
+        entries = [(path, entry) for path, entry in entries if entry["frames"] >= length > 0]
+        if not entries:
+            return []
+        entries.sort(key=lambda item: item[1]["start"])
+        matrix = self.matrix
+        best_distances = np.empty(len(entries))
+        best_offsets = np.empty(len(entries), dtype=np.int64)
+        # Neighbouring files are matched in one sweep, windows that straddle two files are simply never read
+        span_start = 0
+        for index in range(1, len(entries) + 1):
+            if index < len(entries) and entries[index][1]["start"] == (
+                    entries[index - 1][1]["start"] + entries[index - 1][1]["frames"]):
+                continue
+            first = entries[span_start][1]["start"]
+            last = entries[index - 1][1]["start"] + entries[index - 1][1]["frames"]
+            distances = sliding_distances(matrix, first, last, ref, chunk_frames)
+            for position in range(span_start, index):
+                entry = entries[position][1]
+                window = distances[entry["start"] - first:entry["start"] - first + entry["frames"] - length + 1]
+                best_offsets[position] = np.argmin(window)
+                best_distances[position] = window[best_offsets[position]]
+            span_start = index
+        positions, distances = select_top_k(np.arange(len(entries)), np.sqrt(np.maximum(best_distances, 0)), top_k)
+        return [(entries[position][0], float(distance),
+                 float(best_offsets[position] * HOP_LENGTH / entries[position][1]["sample_rate"]))
+                for position, distance in zip(positions, distances)]
+
+
+def sliding_distances(matrix, first, last, ref, chunk_frames):
+    # Squared distance between ref and every window of matrix[first:last], as |window|^2 - 2 window.ref + |ref|^2,
+    # with the cross term for all coefficients from one FFT per chunk (overlap-save)
+    length = len(ref)
+    count = last - first - length + 1
+    distances = np.empty(count)
+    ref_energy = np.sum(ref * ref)
+    size = 1 << int(np.ceil(np.log2(chunk_frames + length - 1)))
+    kernel = np.fft.rfft(ref[::-1], n=size, axis=0)
+    for start in range(0, count, chunk_frames):
+        stop = min(count, start + chunk_frames)
+        block = np.asarray(matrix[first + start:first + stop + length - 1], dtype=np.float64)
+        cross = np.fft.irfft((np.fft.rfft(block, n=size, axis=0) * kernel).sum(axis=1), n=size)
+        energy = np.concatenate([[0.0], np.cumsum(np.einsum("ij,ij->i", block, block))])
+        distances[start:stop] = (energy[length:length + stop - start] - energy[:stop - start]
+                                 - 2 * cross[length - 1:length - 1 + stop - start] + ref_energy)
+    return distances
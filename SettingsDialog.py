@@ -1,4 +1,6 @@
-from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QListWidget, QFileDialog, QRadioButton, QLabel, QButtonGroup
+import os
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QPushButton, QListWidget, QFileDialog, QRadioButton, QLabel, QButtonGroup, QCheckBox, QSpinBox, QComboBox, QLineEdit
+from LibraryScanner import AUDIO_EXTENSIONS, normalize_extensions
 
 class SettingsDialog(QDialog):
     def __init__(self, parent=None):
@@ -18,6 +20,12 @@ class SettingsDialog(QDialog):
         self.remove_button.clicked.connect(self.remove_selected_path)
         self.layout.addWidget(self.remove_button)
 
+        # Each path has its own index, rebuilding one leaves the others as they are
+        self.rebuild_paths = set()
+        self.rebuild_button = QPushButton("重建选定路径的索引")
+        self.rebuild_button.clicked.connect(self.rebuild_selected_path)
+        self.layout.addWidget(self.rebuild_button)
+
         self.import_button = QPushButton("导入设置")
         self.import_button.clicked.connect(parent.import_settings)
         self.layout.addWidget(self.import_button)
@@ -38,12 +46,107 @@ class SettingsDialog(QDialog):
         self.layout.addWidget(self.medium_refresh_rate)
         self.layout.addWidget(self.high_refresh_rate)
 
+        self.verify_hash_checkbox = QCheckBox("校验文件内容哈希 (更可靠但更慢)")
+        self.verify_hash_checkbox.setChecked(parent.verify_content_hash)
+        self.layout.addWidget(self.verify_hash_checkbox)
+
+        self.layout.addWidget(QLabel("特征提取进程数:"))
+        self.workers_spinbox = QSpinBox()
+        self.workers_spinbox.setRange(1, max(1, os.cpu_count() or 1) * 2)
+        self.workers_spinbox.setValue(parent.extraction_workers)
+        self.layout.addWidget(self.workers_spinbox)
+
+        self.layout.addWidget(QLabel("最多显示结果数 (0 表示全部):"))
+        self.max_results_spinbox = QSpinBox()
+        self.max_results_spinbox.setRange(0, 1000000)
+        self.max_results_spinbox.setValue(parent.max_results)
+        self.layout.addWidget(self.max_results_spinbox)
+
+        self.ann_checkbox = QCheckBox("使用近似索引加速大型音频库搜索")
+        self.ann_checkbox.setChecked(parent.ann_enabled)
+        self.layout.addWidget(self.ann_checkbox)
+
+        self.layout.addWidget(QLabel("近似索引探测桶数 (越大越准确, 越小越快):"))
+        self.nprobe_spinbox = QSpinBox()
+        self.nprobe_spinbox.setRange(1, 4096)
+        self.nprobe_spinbox.setValue(parent.ann_nprobe)
+        self.layout.addWidget(self.nprobe_spinbox)
+
+        self.layout.addWidget(QLabel("特征存储方式:"))
+        self.embedding_mode_combo = QComboBox()
+        self.embedding_mode_combo.addItem("完整特征", "full")
+        self.embedding_mode_combo.addItem("压缩特征 (int8, 最省内存)", "int8")
+        self.embedding_mode_combo.addItem("压缩特征 (float16)", "float16")
+        self.embedding_mode_combo.setCurrentIndex(max(0, self.embedding_mode_combo.findData(parent.embedding_mode)))
+        self.layout.addWidget(self.embedding_mode_combo)
+
+        self.coarse_checkbox = QCheckBox("两阶段搜索 (先用低分辨率特征筛选候选, 再用完整特征精确排序)")
+        self.coarse_checkbox.setChecked(parent.coarse_search)
+        self.layout.addWidget(self.coarse_checkbox)
+
+        self.layout.addWidget(QLabel("筛选特征的时间分辨率 (段数越多越准确, 越少越快):"))
+        self.signature_segments_combo = QComboBox()
+        for segments in (1, 2, 4, 8, 16):
+            self.signature_segments_combo.addItem(f"{segments} 段", segments)
+        self.signature_segments_combo.setCurrentIndex(
+            max(0, self.signature_segments_combo.findData(parent.signature_segments)))
+        self.layout.addWidget(self.signature_segments_combo)
+
+        self.layout.addWidget(QLabel("精确排序的候选数 (越大越准确, 越小越快):"))
+        self.coarse_candidates_spinbox = QSpinBox()
+        self.coarse_candidates_spinbox.setRange(10, 1000000)
+        self.coarse_candidates_spinbox.setValue(parent.coarse_candidates)
+        self.layout.addWidget(self.coarse_candidates_spinbox)
+
+        self.layout.addWidget(QLabel("特征采样率 (修改后将重新索引音频库):"))
+        self.sample_rate_combo = QComboBox()
+        self.sample_rate_combo.addItem("保持原始采样率", 0)
+        for sample_rate in (16000, 22050, 44100, 48000):
+            self.sample_rate_combo.addItem(f"{sample_rate} Hz", sample_rate)
+        self.sample_rate_combo.setCurrentIndex(max(0, self.sample_rate_combo.findData(parent.feature_sample_rate)))
+        self.layout.addWidget(self.sample_rate_combo)
+
+        self.normalize_checkbox = QCheckBox("提取特征前将音量归一化")
+        self.normalize_checkbox.setChecked(parent.normalize_audio)
+        self.layout.addWidget(self.normalize_checkbox)
+
+        self.layout.addWidget(QLabel("每批一起计算特征的文件数 (短音效较多时可加快索引):"))
+        self.batch_size_spinbox = QSpinBox()
+        self.batch_size_spinbox.setRange(1, 256)
+        self.batch_size_spinbox.setValue(parent.extraction_batch_size)
+        self.layout.addWidget(self.batch_size_spinbox)
+
+        self.layout.addWidget(QLabel("搜索模式:"))
+        self.search_mode_combo = QComboBox()
+        self.search_mode_combo.addItem("整个文件", "whole")
+        self.search_mode_combo.addItem("片段定位 (在长音频中查找参考音频出现的位置)", "segment")
+        self.search_mode_combo.addItem("指纹精确匹配 (查找包含参考音频原样副本的文件)", "fingerprint")
+        self.search_mode_combo.setCurrentIndex(max(0, self.search_mode_combo.findData(parent.search_mode)))
+        self.layout.addWidget(self.search_mode_combo)
+        self.search_mode_note = QLabel("使用查询服务时只能搜索整个文件, 片段定位和指纹匹配需要在本窗口中加载音频库")
+        self.search_mode_note.setWordWrap(True)
+        self.layout.addWidget(self.search_mode_note)
+
+        self.layout.addWidget(QLabel("音频文件格式 (用逗号分隔, 不区分大小写):"))
+        self.extensions_edit = QLineEdit(", ".join(parent.audio_extensions))
+        self.layout.addWidget(self.extensions_edit)
+
+        self.layout.addWidget(QLabel("查询服务地址 (例如 http://127.0.0.1:8765, 留空则在本窗口中加载音频库):"))
+        self.query_server_edit = QLineEdit(parent.query_server_url)
+        self.query_server_edit.textChanged.connect(self.update_search_modes)
+        self.layout.addWidget(self.query_server_edit)
+
+        self.background_indexing_checkbox = QCheckBox("空闲时在后台自动索引音频库变化")
+        self.background_indexing_checkbox.setChecked(parent.background_indexing)
+        self.layout.addWidget(self.background_indexing_checkbox)
+
         self.save_button = QPushButton("保存")
         self.save_button.clicked.connect(self.accept)
         self.layout.addWidget(self.save_button)
 
         self.load_paths()
         self.load_refresh_rate()
+        self.update_search_modes()
 
     def load_paths(self):
         self.audio_library_paths_list.clear()
@@ -59,6 +162,21 @@ class SettingsDialog(QDialog):
         for item in self.audio_library_paths_list.selectedItems():
             self.audio_library_paths_list.takeItem(self.audio_library_paths_list.row(item))
 
+    def rebuild_selected_path(self):
+        for item in self.audio_library_paths_list.selectedItems():
+            self.rebuild_paths.add(item.text())
+            item.setToolTip("保存后重建索引")
+
+    def update_search_modes(self):
+        # The query server only ranks whole files, the other modes need this window's own library
+        remote = bool(self.query_server_edit.text().strip())
+        for index in range(self.search_mode_combo.count()):
+            if self.search_mode_combo.itemData(index) != "whole":
+                self.search_mode_combo.model().item(index).setEnabled(not remote)
+        if remote and self.search_mode_combo.currentData() != "whole":
+            self.search_mode_combo.setCurrentIndex(self.search_mode_combo.findData("whole"))
+        self.search_mode_note.setVisible(remote)
+
     def load_refresh_rate(self):
         refresh_rate = self.parent().refresh_rate
         if refresh_rate == 1000:
@@ -74,4 +192,8 @@ class SettingsDialog(QDialog):
         elif self.medium_refresh_rate.isChecked():
             return 100
         else:
-            return 1
\ No newline at end of file
+            return 1
+
+    def get_audio_extensions(self):
+        extensions = [extension.strip() for extension in self.extensions_edit.text().split(",") if extension.strip()]
+        return list(normalize_extensions(extensions)) if extensions else list(AUDIO_EXTENSIONS)
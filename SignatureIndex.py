@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import numpy as np
+from calculate_similarity import rank_similarity, rerank, gather_rows, select_top_k
+from Instrumentation import instrumentation
+
+
+class SignatureIndex:
+    # Per-coefficient mean and standard deviation of every time segment of the store rows, a few hundred bytes per
+    # file. Scaled by the square root of the segment length, the distance between two signatures never exceeds the
+    # distance between the full features, so the signatures prune the library before the exact comparison
+    def __init__(self, store, segments=4, candidates=200):
+        self.store = store
+        self.segments = max(1, min(segments, store.shape[1]))
+        self.candidates = candidates
+        self.dims = store.shape[0] * 2 * self.segments
+        self.signatures_path = os.path.join(store.directory, "signatures.f32")
+        self.meta_path = os.path.join(store.directory, "signature_meta.json")
+        # Frame ranges of the segments
+        edges = np.linspace(0, store.shape[1], self.segments + 1).round().astype(int)
+        self.ranges = list(zip(edges[:-1], edges[1:]))
+        self.generation = None
+        self._signatures_file = None
+        self.signatures = np.empty((0, self.dims), dtype=np.float32)
+        # Queries fill missing rows while the indexer adds new ones
+        self.lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r") as meta_file:
+                meta = json.load(meta_file)
+        if meta.get("generation") != self.store.generation or meta.get("segments") != self.segments:
+            self.reset()
+            return
+        self.generation = self.store.generation
+        self.resize(self.store.row_count)
+        if os.path.exists(self.signatures_path):
+            signatures = np.fromfile(self.signatures_path, dtype=np.float32)
+            count = min(len(signatures) // self.dims, len(self.signatures))
+            self.signatures[:count] = signatures[:count * self.dims].reshape(count, self.dims)
+
+    def reset(self):
+        self.close()
+        for path in (self.signatures_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.generation = self.store.generation
+        self.resize(0)
+        with open(self.meta_path, "w") as meta_file:
+            json.dump({"generation": self.generation, "segments": self.segments}, meta_file)
+
+    def close(self):
+        if self._signatures_file:
+            self._signatures_file.close()
+            self._signatures_file = None
+
+    def sync(self):
+        if self.generation != self.store.generation:
+            self.reset()
+
+    def resize(self, row_count):
+        # NaN marks a row with no signature yet
+        signatures = np.full((row_count, self.dims), np.nan, dtype=np.float32)
+        count = min(row_count, len(self.signatures))
+        signatures[:count] = self.signatures[:count]
+        self.signatures = signatures
+
+    def compute(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), *self.store.shape)
+        parts = []
+        for start, stop in self.ranges:
+            segment = vectors[:, :, start:stop]
+            scale = np.sqrt(stop - start)
+            parts.append(segment.mean(axis=2) * scale)
+            parts.append(segment.std(axis=2) * scale)
+        return np.concatenate(parts, axis=1)
+
+    def add(self, row, features):
+        with self.lock:
+            self.sync()
+            if row >= len(self.signatures):
+                self.resize(max(row + 1, 2 * len(self.signatures)))
+            self.signatures[row] = self.compute(np.asarray(features)[None])[0]
+            self.write_rows(row, row + 1)
+
+    def fill(self, rows, chunk_size=1024):
+        # Rows stored before the index existed get their signatures on first use
+        with self.lock:
+            if len(rows) and rows.max() >= len(self.signatures):
+                self.resize(rows.max() + 1)
+            missing = np.sort(rows[np.isnan(self.signatures[rows, 0])])
+            if not len(missing):
+                return
+            matrix = self.store.matrix
+            for start in range(0, len(missing), chunk_size):
+                chunk = missing[start:start + chunk_size]
+                self.signatures[chunk] = self.compute(gather_rows(matrix, chunk))
+            self.write_rows(0, len(self.signatures))
+
+    def write_rows(self, start, stop):
+        if self._signatures_file is None:
+            mode = "r+b" if os.path.exists(self.signatures_path) else "w+b"
+            self._signatures_file = open(self.signatures_path, mode)
+        self._signatures_file.seek(start * self.dims * 4)
+        self._signatures_file.write(self.signatures[start:stop].tobytes())
+        self._signatures_file.flush()
+
+    def lower_bounds(self, ref_mfcc, rows, chunk_size=65536):
+        query = self.compute(np.asarray(ref_mfcc)[None])[0]
+        distances = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), chunk_size):
+            difference = self.signatures[rows[start:start + chunk_size]] - query
+            distances[start:start + len(difference)] = np.sqrt(np.einsum("ij,ij->i", difference, difference))
+        return distances
+
+    def search(self, ref_mfcc, rows, top_k=None, candidates=None):
+        # The lower bounds pick the short list, which is then ranked exactly
+        with self.lock:
+            self.sync()
+        rows = np.asarray(rows, dtype=np.int64)
+        self.fill(rows)
+        keep = max(candidates or self.candidates, top_k or 0)
+        with instrumentation.stage("coarse_rank", rows=len(rows)):
+            bounds = self.lower_bounds(ref_mfcc, rows)
+            shortlist, _ = select_top_k(np.arange(len(rows)), bounds, keep)
+        instrumentation.count("coarse_candidates", len(shortlist))
+        return rerank(ref_mfcc, self.store, rows, shortlist, top_k)
+
+    def measure_recall(self, rows, queries=20, top_k=50):
+        # Recall@k of the pruned search against an exhaustive one. A query is also proven exact when its k-th
+        # distance is no larger than the smallest bound left outside the short list
+        rows = np.asarray(rows, dtype=np.int64)
+        self.fill(rows)
+        rng = np.random.default_rng(0)
+        query_rows = rng.choice(rows, size=min(queries, len(rows)), replace=False)
+        matrix = self.store.matrix
+        recall, proven = [], []
+        keep = max(self.candidates, top_k)
+        for query_row in query_rows:
+            ref = np.asarray(matrix[query_row])
+            exact, _ = rank_similarity(ref, matrix, rows, top_k, squared_norms=self.store.squared_norms)
+            pruned, distances = self.search(ref, rows, top_k)
+            recall.append(len(set(exact) & set(pruned)) / len(exact))
+            bounds = np.sort(self.lower_bounds(ref, rows))
+            proven.append(keep >= len(rows) or (len(distances) > 0 and distances[-1] <= bounds[keep]))
+        return {"queries": len(query_rows), "top_k": top_k, "candidates": self.candidates,
+                "segments": self.segments, "recall": float(np.mean(recall)), "proven": float(np.mean(proven)),
+                "bytes_per_row": self.dims * 4, "full_bytes_per_row": self.store.row_bytes}
@@ -0,0 +1,21 @@
+from PyQt5.QtCore import QObject, pyqtSignal
+
+class TaskWorker(QObject):
+    # Runs a single callable on a QThread and hands back its result
+    finished = pyqtSignal(object)
+    progress = pyqtSignal(int, int)  # For tasks that report progress, emitting is safe from the worker thread
+    error = pyqtSignal(str)
+
+    def __init__(self, task, *args, **kwargs):
+        super().__init__()
+        self.task = task
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            result = self.task(*self.args, **self.kwargs)
+        except Exception as e:
+            self.error.emit(f"错误: {e}")
+            result = None
+        self.finished.emit(result)
@@ -0,0 +1,135 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from extract_features import extract_features, feature_params
+from LibraryShards import LibraryShards, ShardedIndexer
+from LibraryScanner import AUDIO_EXTENSIONS
+
+REFERENCE_EXTENSIONS = ('.wav', '.mp3')
+
+
+def find_references(inputs):
+    references = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                references.extend(os.path.join(root, file) for file in sorted(files)
+                                  if file.lower().endswith(REFERENCE_EXTENSIONS))
+        else:
+            references.append(path)
+    return references
+
+
+def extract_references(references, workers, params):
+    extracted, errors = [], []
+    if workers > 1 and len(references) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(extract_features, path, **params) for path in references]
+            outcomes = [(path, future) for path, future in zip(references, futures)]
+            for path, future in outcomes:
+                try:
+                    extracted.append((path, future.result()))
+                except Exception as e:
+                    errors.append(f"Error processing {path}: {e}")
+    else:
+        for path in references:
+            try:
+                extracted.append((path, extract_features(path, **params)))
+            except Exception as e:
+                errors.append(f"Error processing {path}: {e}")
+    return extracted, errors
+
+
+def run_queries(indexer, extracted, audio_paths, top_k, batch_size, query_workers=0, n_probe=8):
+    if query_workers:
+        # Approximate search touches little data per query, so queries run side by side
+        with ThreadPoolExecutor(max_workers=query_workers) as executor:
+            return list(executor.map(lambda item: indexer.rank(item[1], audio_paths, top_k, n_probe, 0), extracted))
+    results = []
+    for start in range(0, len(extracted), batch_size):
+        batch = [mfcc for _, mfcc in extracted[start:start + batch_size]]
+        results.extend(indexer.rank_many(batch, audio_paths, top_k))
+    return results
+
+
+def write_output(output, output_format, extracted, results, errors):
+    if output_format == "csv":
+        writer = csv.writer(output)
+        writer.writerow(["reference", "rank", "file", "path", "distance"])
+        for (reference, _), matches in zip(extracted, results):
+            for rank, (file, path, distance) in enumerate(matches, start=1):
+                writer.writerow([reference, rank, file, path, distance])
+    else:
+        report = {
+            "results": [{"reference": reference,
+                         "matches": [{"file": file, "path": path, "distance": distance}
+                                     for file, path, distance in matches]}
+                        for (reference, _), matches in zip(extracted, results)],
+            "errors": errors
+        }
+        json.dump(report, output, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量查找参考音频在音频库中的最佳匹配 (无界面)")
+    parser.add_argument("references", nargs="+", help="参考音频文件或目录")
+    parser.add_argument("--library", action="append", help="音频库路径, 可重复; 默认读取配置文件中的路径")
+    parser.add_argument("--config", default="config.json", help="配置文件路径")
+    parser.add_argument("--cache-dir", default="feature_cache", help="特征缓存目录")
+    parser.add_argument("--top-k", type=int, default=10, help="每个参考音频输出的匹配数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="并行进程/线程数")
+    parser.add_argument("--batch-size", type=int, default=256, help="每次扫描音频库时同时比较的参考音频数")
+    parser.add_argument("--ann", action="store_true", help="使用近似索引")
+    parser.add_argument("--nprobe", type=int, default=8, help="近似索引探测桶数")
+    parser.add_argument("--compact", choices=["int8", "float16"], help="使用压缩特征搜索")
+    parser.add_argument("--coarse", action="store_true", help="两阶段搜索: 先用低分辨率特征筛选候选再精确排序")
+    parser.add_argument("--candidates", type=int, help="两阶段搜索精确排序的候选数, 默认读取配置文件")
+    parser.add_argument("--format", choices=["json", "csv"], default="json", help="输出格式")
+    parser.add_argument("--output", help="输出文件, 默认为标准输出")
+    args = parser.parse_args(argv)
+
+    config = {}
+    if os.path.exists(args.config):
+        with open(args.config, "r") as file:
+            config = json.load(file)
+    library_paths = args.library or config.get("audio_library_paths", [])
+    if not library_paths:
+        parser.error("没有音频库路径, 请使用 --library 或在配置文件中设置")
+
+    params = feature_params(config)
+    library = LibraryShards(args.cache_dir, params=params, ann=args.ann, embedding_mode=args.compact or "full",
+                            embedding_dims=config.get("embedding_dims", 256), workers=args.workers,
+                            coarse=args.coarse, signature_segments=config.get("signature_segments", 4),
+                            coarse_candidates=args.candidates or config.get("coarse_candidates", 200))
+    library.load(library_paths)
+    indexer = ShardedIndexer(library, verify_hash=config.get("verify_content_hash", False), workers=args.workers,
+                             extensions=config.get("audio_extensions", AUDIO_EXTENSIONS),
+                             batch_size=config.get("extraction_batch_size", 16),
+                             on_error=lambda message: print(message, file=sys.stderr))
+    audio_paths = indexer.update()
+    library.flush()
+    for shard in library:
+        if shard.ann_index is not None and shard.ann_index.needs_training(1):
+            shard.ann_index.train()
+        if shard.compact_index is not None and shard.compact_index.needs_fitting(1):
+            shard.compact_index.fit()
+
+    extracted, errors = extract_references(find_references(args.references), args.workers, params)
+    for message in errors:
+        print(message, file=sys.stderr)
+    approximate = args.ann or args.compact or args.coarse
+    results = run_queries(indexer, extracted, audio_paths, args.top_k, args.batch_size,
+                          query_workers=args.workers if approximate else 0, n_probe=args.nprobe)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as output:
+            write_output(output, args.format, extracted, results, errors)
+    else:
+        write_output(sys.stdout, args.format, extracted, results, errors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from synthetic_library import generate_library
+
+
+def measure(function, repeat=1):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, {"seconds": min(timings), "mean_seconds": sum(timings) / len(timings), "repeat": repeat}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def bench_extract(paths, sample, batch_size):
+    from extract_features import extract_features, extract_batch_with_metadata, prepare_extraction
+    chosen = paths[:sample]
+    prepare_extraction()
+    _, timing = measure(lambda: [extract_features(path) for path in chosen])
+    _, batch_timing = measure(lambda: [extract_batch_with_metadata(chosen[start:start + batch_size])
+                                       for start in range(0, len(chosen), batch_size)])
+    timing["files"] = len(chosen)
+    timing["files_per_second"] = len(chosen) / timing["seconds"] if timing["seconds"] else None
+    timing.update(batch_size=batch_size, batch_seconds=batch_timing["seconds"],
+                  batch_files_per_second=len(chosen) / batch_timing["seconds"] if batch_timing["seconds"] else None)
+    return timing
+
+
+def bench_similarity(paths, pairs):
+    from calculate_similarity import calculate_similarity
+    from extract_features import extract_features
+    features = [extract_features(path) for path in paths[:10]]
+    _, timing = measure(lambda: [calculate_similarity(features[0], features[index % len(features)])
+                                 for index in range(pairs)])
+    timing["pairs"] = pairs
+    return timing
+
+
+def open_library(library, cache_dir):
+    from extract_features import feature_params
+    from LibraryShards import LibraryShards
+    shards = LibraryShards(cache_dir, params=feature_params({}))
+    shards.load([library])
+    return shards
+
+
+def bench_index(library, cache_dir, workers, batch_size):
+    from LibraryShards import ShardedIndexer
+    shards = open_library(library, cache_dir)
+    indexer = ShardedIndexer(shards, workers=workers, batch_size=batch_size)
+    audio_paths, timing = measure(indexer.update)
+    shards.flush()
+    timing["files"] = len(audio_paths)
+    timing["files_per_second"] = len(audio_paths) / timing["seconds"] if timing["seconds"] else None
+    shards.close()
+    return timing
+
+
+def bench_cache_load(library, cache_dir, repeat):
+    def load():
+        shards = open_library(library, cache_dir)
+        count = shards.file_count()
+        shards.close()
+        return count
+
+    count, timing = measure(load, repeat)
+    timing["entries"] = count
+    return timing
+
+
+def bench_query(library, cache_dir, queries, top_k, workers):
+    # A full search as the GUI runs it: rescan against a warm cache, then rank
+    from AudioProcessor import AudioProcessor
+    shards = open_library(library, cache_dir)
+    cache = shards.shard_for(library).store
+    rows = [entry["row"] for entry in cache.entries.values()][:queries]
+    timings = []
+    for row in rows:
+        processor = AudioProcessor(shards, np.asarray(cache.matrix[row]), workers=workers, top_k=top_k)
+        _, timing = measure(processor.run)
+        timings.append(timing["seconds"])
+    shards.close()
+    return {"seconds": min(timings), "mean_seconds": sum(timings) / len(timings), "queries": len(timings)}
+
+
+def bench_ranking(library, cache_dir, queries, top_k, repeat):
+    from LibraryShards import ShardedIndexer
+    shards = open_library(library, cache_dir)
+    cache = shards.shard_for(library).store
+    indexer = ShardedIndexer(shards)
+    audio_paths = list(cache.entries)
+    refs = [np.asarray(cache.matrix[cache.row_of(path)]) for path in audio_paths[:queries]]
+    _, single = measure(lambda: [indexer.rank(ref, audio_paths, top_k) for ref in refs], repeat)
+    _, batch = measure(lambda: indexer.rank_many(refs, audio_paths, top_k), repeat)
+    shards.close()
+    return {"rows": len(audio_paths), "queries": len(refs),
+            "single_seconds": single["seconds"], "batch_seconds": batch["seconds"],
+            "single_queries_per_second": len(refs) / single["seconds"] if single["seconds"] else None}
+
+
+def bench_render(rows, repeat):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtWidgets import QApplication
+    from DraggableTableView import DraggableTableView
+    from ResultsTableModel import ResultsTableModel
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    model = ResultsTableModel()
+    view = DraggableTableView()
+    view.setModel(model)
+    view.resize(1000, 600)
+    view.show()
+    results = [(f"sample{index:06}.wav", f"/library/sample{index:06}.wav", float(index)) for index in range(rows)]
+
+    def render():
+        model.set_results(results)
+        app.processEvents()
+
+    _, timing = measure(render, repeat)
+    _, sort_timing = measure(lambda: (model.sort(2), app.processEvents()), repeat)
+    timing.update(rows=rows, sort_seconds=sort_timing["seconds"])
+    view.close()
+    return timing
+
+
+def bench_startup(work_dir, library, repeat):
+    # The GUI is started in a fresh process each time, in the work directory so it finds the benchmark cache
+    with open(os.path.join(work_dir, "config.json"), "w") as config_file:
+        json.dump({"audio_library_paths": [library], "background_indexing": False}, config_file)
+    environment = dict(os.environ, AUDIOMANAGER_STARTUP_PROFILE="1", QT_QPA_PLATFORM="offscreen")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "AudioManagerMain.py")
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, script], cwd=work_dir, env=environment, capture_output=True,
+                                text=True, timeout=300).stdout
+        runs.extend(json.loads(line) for line in output.splitlines() if line.startswith("{"))
+    if not runs:
+        return {"error": "no startup report"}
+    timing = {key: min(run[key] for run in runs) for key in runs[0]}
+    timing["repeat"] = len(runs)
+    return timing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="在合成音频库上测量各处理阶段的性能, 输出 JSON")
+    parser.add_argument("--files", type=int, default=500, help="合成音频库文件数")
+    parser.add_argument("--durations", default="1:0.4,5:0.4,30:0.2", help="时长分布 (秒:权重)")
+    parser.add_argument("--sample-rates", default="22050:0.5,44100:0.5", help="采样率分布")
+    parser.add_argument("--formats", default="wav", help="格式分布 (非 wav 需要 ffmpeg)")
+    parser.add_argument("--channels", default="1:0.5,2:0.5", help="声道数分布")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--library", help="合成音频库目录, 默认使用临时目录; 已存在的文件会被复用")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="特征提取进程数")
+    parser.add_argument("--batch-size", type=int, default=16, help="每批一起计算特征的文件数")
+    parser.add_argument("--queries", type=int, default=10, help="查询次数")
+    parser.add_argument("--top-k", type=int, default=1000, help="每次查询保留的结果数")
+    parser.add_argument("--render-rows", type=int, default=200000, help="结果表渲染的行数")
+    parser.add_argument("--repeat", type=int, default=3, help="可重复阶段的重复次数, 取最小值")
+    parser.add_argument("--stages",
+                        default="extract,similarity,cold_index,warm_index,cache_load,startup,query,ranking,render",
+                        help="要运行的阶段, 逗号分隔")
+    parser.add_argument("--output", help="结果 JSON 文件, 默认为标准输出")
+    args = parser.parse_args(argv)
+    stages = set(args.stages.split(","))
+
+    work_dir = tempfile.mkdtemp(prefix="audiomanager-bench-")
+    library = args.library or os.path.join(work_dir, "library")
+    cache_dir = os.path.join(work_dir, "feature_cache")
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+        "stages": {}
+    }
+    try:
+        paths, report["stages"]["generate"] = measure(lambda: generate_library(
+            library, args.files, args.durations, args.sample_rates, args.formats, args.channels, seed=args.seed))
+        results = report["stages"]
+        if "extract" in stages:
+            results["extract"] = bench_extract(paths, min(len(paths), 50), args.batch_size)
+        if "similarity" in stages:
+            results["similarity"] = bench_similarity(paths, 1000)
+        # The later stages all need the index built by the cold run
+        if stages & {"cold_index", "warm_index", "cache_load", "startup", "query", "ranking"}:
+            results["cold_index"] = bench_index(library, cache_dir, args.workers, args.batch_size)
+        if "warm_index" in stages:
+            results["warm_index"] = bench_index(library, cache_dir, args.workers, args.batch_size)
+        if "cache_load" in stages:
+            results["cache_load"] = bench_cache_load(library, cache_dir, args.repeat)
+        if "startup" in stages:
+            results["startup"] = bench_startup(work_dir, library, args.repeat)
+        if "query" in stages:
+            results["query"] = bench_query(library, cache_dir, args.queries, args.top_k, args.workers)
+        if "ranking" in stages:
+            results["ranking"] = bench_ranking(library, cache_dir, args.queries, args.top_k, args.repeat)
+        if "render" in stages:
+            results["render"] = bench_render(args.render_rows, args.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
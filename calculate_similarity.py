@@ -1,5 +1,93 @@
-from scipy.spatial.distance import euclidean
+import numpy as np
+from Instrumentation import instrumentation
 
 def calculate_similarity(mfcc1, mfcc2):
+    # scipy takes longer to import than the rest of the application, so only load it when needed
+    from scipy.spatial.distance import euclidean
     dist = euclidean(mfcc1.flatten(), mfcc2.flatten())
     return dist
+
+def rank_similarity(ref_mfcc, features, rows=None, top_k=None, chunk_size=1024, squared_norms=None):
+    # Returns (positions, distances) of the top_k closest rows, closest first.
+    # Positions index into `rows` when given, otherwise into `features`.
+    ref = np.asarray(ref_mfcc, dtype=np.float32).reshape(-1)
+    if rows is None:
+        rows = np.arange(features.shape[0])
+    rows = np.asarray(rows, dtype=np.int64)
+    # Visit rows in storage order so a memory-mapped matrix is read sequentially
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    scores = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        chunk_rows = sorted_rows[start:start + chunk_size]
+        chunk = gather_rows(features, chunk_rows)
+        # |a - b|^2 without the constant |a|^2 term, which does not change the order
+        if squared_norms is None:
+            norms = np.einsum("ij,ij->i", chunk, chunk)
+        else:
+            norms = squared_norms[chunk_rows]
+        scores[start:start + len(chunk_rows)] = norms - 2 * (chunk @ ref)
+    positions, _ = select_top_k(order, scores, top_k)
+    # Recompute the kept distances exactly, the expanded form loses precision for close matches
+    return select_top_k(positions, exact_distances(ref, features, rows[positions], chunk_size))
+
+def rerank(ref_mfcc, store, rows, candidates, top_k=None):
+    # Last step of the approximate searches: only the short list (positions into rows) is read back from the
+    # full-resolution store. Returns (positions into rows, distances) like rank_similarity
+    positions, distances = rank_similarity(ref_mfcc, store.matrix, rows[candidates], top_k)
+    instrumentation.count("feature_bytes_read", len(candidates) * store.row_bytes)
+    return candidates[positions], distances
+
+def exact_distances(ref_mfcc, features, rows, chunk_size=1024):
+    ref = np.asarray(ref_mfcc, dtype=np.float32).reshape(-1)
+    distances = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        diff = gather_rows(features, rows[start:start + chunk_size]) - ref
+        distances[start:start + len(diff)] = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+    return distances
+
+def gather_rows(features, rows):
+    if len(rows) and rows[-1] - rows[0] == len(rows) - 1 and np.all(np.diff(rows) == 1):
+        chunk = features[rows[0]:rows[-1] + 1]
+    else:
+        chunk = features[rows]
+    return np.asarray(chunk, dtype=np.float32).reshape(len(rows), -1)
+
+def select_top_k(positions, distances, top_k=None):
+    if top_k is not None and 0 < top_k < len(distances):
+        best = np.argpartition(distances, top_k - 1)[:top_k]
+    else:
+        best = np.arange(len(distances))
+    best = best[np.argsort(distances[best], kind="stable")]
+    return positions[best], distances[best]
+
+def rank_similarity_batch(ref_mfccs, features, rows=None, top_k=None, chunk_size=1024, squared_norms=None):
+    # Ranks many references in a single pass over the library, keeping a running top-k per reference.
+    # Returns one (positions, distances) pair per reference.
+    refs = np.asarray(ref_mfccs, dtype=np.float32).reshape(len(ref_mfccs), -1)
+    if rows is None:
+        rows = np.arange(features.shape[0])
+    rows = np.asarray(rows, dtype=np.int64)
+    if top_k is None or top_k <= 0 or top_k > len(rows):
+        top_k = len(rows)
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    best_positions = np.empty((len(refs), 0), dtype=np.int64)
+    best_scores = np.empty((len(refs), 0), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        chunk_rows = sorted_rows[start:start + chunk_size]
+        chunk = gather_rows(features, chunk_rows)
+        if squared_norms is None:
+            norms = np.einsum("ij,ij->i", chunk, chunk)
+        else:
+            norms = squared_norms[chunk_rows]
+        scores = np.concatenate([best_scores, norms[None, :] - 2 * (refs @ chunk.T)], axis=1)
+        positions = np.concatenate([best_positions, np.broadcast_to(order[start:start + len(chunk_rows)],
+                                                                    (len(refs), len(chunk_rows)))], axis=1)
+        if scores.shape[1] > top_k:
+            keep = np.argpartition(scores, top_k - 1, axis=1)[:, :top_k]
+            scores = np.take_along_axis(scores, keep, 1)
+            positions = np.take_along_axis(positions, keep, 1)
+        best_scores, best_positions = scores, positions
+    return [select_top_k(positions, exact_distances(ref, features, rows[positions], chunk_size))
+            for ref, positions in zip(refs, best_positions)]
@@ -1,18 +1,204 @@
-import librosa
+import io
+import os
+import time
+import wave
 import numpy as np
-from pydub import AudioSegment
+from fingerprint import landmark_hashes
 
-def extract_features(file_path, n_mfcc=20, max_pad_len=400):
-    audio = AudioSegment.from_file(file_path)
-    y = np.array(audio.get_array_of_samples(), dtype=np.float32)  # Convert to float32
-    sr = audio.frame_rate
+HOP_LENGTH = 512
+N_FFT = 2048
+
+# Features are computed from mono audio at this rate unless the library asks otherwise
+SAMPLE_RATE = 22050
+
+def feature_params(config):
+    # The decode settings that change the features, stored with the cache so a change starts it over
+    return {"sample_rate": config.get("feature_sample_rate", SAMPLE_RATE),
+            "normalize": config.get("normalize_audio", True)}
+
+def extract_features(file_path, n_mfcc=20, max_pad_len=400, bounded=True, timings=None, sample_rate=SAMPLE_RATE,
+                     normalize=True):
+    # Only the samples that feed the first max_pad_len frames are decoded
+    max_samples = samples_for_frames(max_pad_len) if bounded else None
+    return fit_frames(extract_frames(file_path, n_mfcc, max_samples, timings, sample_rate, normalize), max_pad_len)
+
+def extract_frames(file_path, n_mfcc=20, max_samples=None, timings=None, sample_rate=SAMPLE_RATE, normalize=True):
+    start = time.perf_counter()
+    y, sr, decoded_bytes = decode_audio(file_path, max_samples, sample_rate, normalize)
+    decoded = time.perf_counter()
+    import librosa  # Deferred, it pulls in scipy and numba
     mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc)
 
+    if timings is not None:
+        # Filled in for the caller, extraction usually runs in another process
+        timings.update(decode=decoded - start, mfcc=time.perf_counter() - decoded, decoded_bytes=decoded_bytes)
+    return mfccs
+
+def decode_audio(file_path, max_samples=None, sample_rate=SAMPLE_RATE, normalize=True):
+    # Mono float samples at sample_rate (the file's own rate if None), full scale or peak at 1.0. The peak is that of
+    # the decoded samples, so the fixed-size features always scale by the peak of the frames they cover and whole-file
+    # frames and landmarks by the peak of the whole file
+    audio = load_audio(file_path, max_samples, sample_rate)
+    samples = np.array(audio.get_array_of_samples(), dtype=np.float32).reshape(-1, audio.channels)
+    y = samples.mean(axis=1) / float(1 << (8 * audio.sample_width - 1))
+    sr = audio.frame_rate
+    if sample_rate and sr != sample_rate:
+        import librosa
+        y = librosa.resample(y, orig_sr=sr, target_sr=sample_rate)
+        sr = sample_rate
+    if max_samples is not None:
+        y = y[:max_samples]
+    if normalize and len(y):
+        peak = np.max(np.abs(y))
+        if peak > 0:
+            y = y / peak
+    return np.ascontiguousarray(y, dtype=np.float32), sr, len(audio.raw_data)
+
+def fit_frames(mfccs, max_pad_len):
     # Pad or truncate MFCC features to have the same shape
     if mfccs.shape[1] < max_pad_len:
         pad_width = max_pad_len - mfccs.shape[1]
         mfccs = np.pad(mfccs, pad_width=((0, 0), (0, pad_width)), mode='constant')
     else:
         mfccs = mfccs[:, :max_pad_len]
+    return mfccs
+
+def mfcc_batch(signals, sr, n_mfcc=20, length=None):
+    # MFCCs of many clips from one STFT and mel projection over a zero-padded (clips, samples) array.
+    # Frames past a clip's end are left at 0, the same as fit_frames pads the MFCCs of a single clip
+    import librosa
+    import scipy.fft
+    length = length or max(len(y) for y in signals)
+    batch = np.zeros((len(signals), length), dtype=np.float32)
+    for index, y in enumerate(signals):
+        batch[index, :min(len(y), length)] = y[:length]
+    mel = librosa.feature.melspectrogram(y=batch, sr=sr)
+    log_mel = np.zeros_like(mel)
+    for index, y in enumerate(signals):
+        # power_to_db clips relative to the loudest frame, which must be the clip's own
+        frames = 1 + min(len(y), length) // HOP_LENGTH
+        log_mel[index, :, :frames] = librosa.power_to_db(mel[index, :, :frames])
+    mfccs = scipy.fft.dct(log_mel, axis=-2, type=2, norm="ortho")[..., :n_mfcc, :]
+    for index, y in enumerate(signals):
+        mfccs[index, :, 1 + min(len(y), length) // HOP_LENGTH:] = 0
+    return mfccs
+
+def extract_with_metadata(file_path, n_mfcc=20, max_pad_len=400, with_frames=False, sample_rate=SAMPLE_RATE,
+                          normalize=True, with_landmarks=False):
+    timings = {}
+    # The fixed-size features always come from the bounded decode, the same as for a reference, so a file reads
+    # the same whichever search mode indexed it
+    features = extract_features(file_path, n_mfcc, max_pad_len, timings=timings, sample_rate=sample_rate,
+                                normalize=normalize)
+    frames = landmarks = None
+    if with_frames or with_landmarks:
+        # One full decode serves both whole-file forms
+        start = time.perf_counter()
+        y, sr, decoded_bytes = decode_audio(file_path, None, sample_rate, normalize)
+        decoded = time.perf_counter()
+        timings["decode"] += decoded - start
+        timings["decoded_bytes"] += decoded_bytes
+        if with_frames:
+            import librosa
+            frames = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=n_mfcc)
+            timings["mfcc"] += time.perf_counter() - decoded
+        if with_landmarks:
+            start = time.perf_counter()
+            landmarks = landmark_hashes(y, sr)
+            timings["landmarks"] = time.perf_counter() - start
+    return features, audio_metadata(file_path), timings, frames, landmarks
+
+def extract_landmarks(file_path, sample_rate=SAMPLE_RATE, normalize=True):
+    # Landmarks of a whole reference, matched against the library's fingerprints
+    y, sr, _ = decode_audio(file_path, None, sample_rate, normalize)
+    return landmark_hashes(y, sr)
+
+def extract_batch_with_metadata(file_paths, n_mfcc=20, max_pad_len=400, with_frames=False, sample_rate=SAMPLE_RATE,
+                                normalize=True, with_landmarks=False):
+    # One result per file, or the exception that file raised. Clips sharing a rate go through mfcc_batch together,
+    # whole-file frames and landmarks differ in length and are extracted one by one
+    if with_frames or with_landmarks or len(file_paths) == 1:
+        outcomes = []
+        for file_path in file_paths:
+            try:
+                outcomes.append(extract_with_metadata(file_path, n_mfcc, max_pad_len, with_frames, sample_rate,
+                                                      normalize, with_landmarks))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+    max_samples = samples_for_frames(max_pad_len)
+    outcomes = [None] * len(file_paths)
+    decoded = {}
+    for position, file_path in enumerate(file_paths):
+        try:
+            start = time.perf_counter()
+            y, sr, decoded_bytes = decode_audio(file_path, max_samples, sample_rate, normalize)
+            timings = {"decode": time.perf_counter() - start, "decoded_bytes": decoded_bytes}
+            decoded.setdefault(sr, []).append((position, y, audio_metadata(file_path), timings))
+        except Exception as e:
+            outcomes[position] = e
+    for sr, clips in decoded.items():
+        start = time.perf_counter()
+        try:
+            # Padded to the longest clip only, short one-shots would otherwise pay for the whole budget
+            mfccs = mfcc_batch([y for _, y, _, _ in clips], sr, n_mfcc)
+        except Exception as e:
+            for position, _, _, _ in clips:
+                outcomes[position] = e
+            continue
+        # The batch is timed as a whole, each clip is charged its share
+        share = (time.perf_counter() - start) / len(clips)
+        for (position, _, metadata, timings), features in zip(clips, mfccs):
+            timings["mfcc"] = share
+            outcomes[position] = (fit_frames(features, max_pad_len), metadata, timings, None, None)
+    return outcomes
+
+def audio_metadata(file_path):
+    # Read from the header only, the audio itself is not decoded
+    metadata = {"format": os.path.splitext(file_path)[1].lstrip(".").lower()}
+    try:
+        with wave.open(file_path, "rb") as wav_file:
+            sample_rate = wav_file.getframerate()
+            metadata.update(duration=wav_file.getnframes() / sample_rate, sample_rate=sample_rate,
+                            channels=wav_file.getnchannels())
+    except (wave.Error, EOFError):
+        from pydub.utils import mediainfo
+        info = mediainfo(file_path)
+        metadata.update(duration=float(info.get("duration") or 0), sample_rate=int(info.get("sample_rate") or 0),
+                        channels=int(info.get("channels") or 0))
+    return metadata
+
+def prepare_extraction():
+    # Loads librosa and everything mfcc touches, so forked extraction workers inherit it instead of importing it each
+    import librosa
+    librosa.feature.mfcc(y=np.zeros(N_FFT, dtype=np.float32), sr=22050)
+
+def samples_for_frames(frames):
+    # Frames are centred on multiples of the hop, so the last one reaches half a window further
+    return (frames - 1) * HOP_LENGTH + N_FFT // 2
 
-    return mfccs
\ No newline at end of file
+def load_audio(file_path, max_samples=None, sample_rate=None, chunk_frames=65536):
+    # max_samples counts mono samples at sample_rate, the file is read up to the frame that covers them
+    from pydub import AudioSegment
+    if max_samples is None:
+        return AudioSegment.from_file(file_path)
+    try:
+        with wave.open(file_path, "rb") as wav_file:
+            frame_size = wav_file.getnchannels() * wav_file.getsampwidth()
+            rate = wav_file.getframerate()
+            needed = -(-max_samples * rate // sample_rate) if sample_rate else max_samples
+            remaining = min(needed, wav_file.getnframes())
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as bounded_file:
+                bounded_file.setparams(wav_file.getparams())
+                while remaining > 0:
+                    frames = wav_file.readframes(min(chunk_frames, remaining))
+                    if not frames:
+                        break
+                    bounded_file.writeframes(frames)
+                    remaining -= len(frames) // frame_size
+        return AudioSegment(data=buffer.getvalue())
+    except (wave.Error, EOFError):
+        # Compressed and extensible formats go through ffmpeg, limited to the duration the
+        # sample budget covers at the target rate, or at the lowest common rate for native-rate features
+        return AudioSegment.from_file(file_path, duration=max_samples / (sample_rate or 8000))
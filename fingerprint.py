@@ -0,0 +1,68 @@
+import numpy as np
+
+# Landmarks are taken from a fixed-rate spectrogram, whatever rate the MFCCs use
+FINGERPRINT_RATE = 11025
+FINGERPRINT_N_FFT = 1024
+FINGERPRINT_HOP = 256
+# The top bin is dropped so a frequency fits in 9 bits
+FREQUENCY_BINS = FINGERPRINT_N_FFT // 2
+# A peak is the loudest point within this many bins and frames around it
+PEAK_NEIGHBOURHOOD = (21, 11)
+# Peaks quieter than the loudest one by more than this are noise
+DYNAMIC_RANGE = 60
+# At most this many peaks per second, the strongest ones
+PEAKS_PER_SECOND = 30
+# Each anchor peak is paired with the next few peaks up to MAX_DELTA frames later, 6 bits
+FAN_OUT = 5
+MAX_DELTA = 63
+
+# Stored with the fingerprints, hashes from other settings never match
+LANDMARK_PARAMS = {"rate": FINGERPRINT_RATE, "n_fft": FINGERPRINT_N_FFT, "hop": FINGERPRINT_HOP,
+                   "neighbourhood": list(PEAK_NEIGHBOURHOOD), "dynamic_range": DYNAMIC_RANGE,
+                   "peaks_per_second": PEAKS_PER_SECOND, "fan_out": FAN_OUT, "max_delta": MAX_DELTA}
+
+
+def landmark_hashes(y, sr):
+    # Returns (hashes, times) of the landmarks of a clip. A landmark is a pair of spectral peaks, its hash packs the
+    # frequency of both and the frames between them, its time is the anchor's frame
+    import librosa
+    from scipy.ndimage import maximum_filter
+    y = np.asarray(y, dtype=np.float32)
+    if sr != FINGERPRINT_RATE and len(y):
+        y = librosa.resample(y, orig_sr=sr, target_sr=FINGERPRINT_RATE)
+    if len(y) < FINGERPRINT_N_FFT:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    spectrum = np.abs(librosa.stft(y, n_fft=FINGERPRINT_N_FFT, hop_length=FINGERPRINT_HOP))[:FREQUENCY_BINS]
+    level = 20 * np.log10(spectrum + 1e-10)
+    peaks = (level == maximum_filter(level, size=PEAK_NEIGHBOURHOOD)) & (level > level.max() - DYNAMIC_RANGE)
+    frequencies, frames = np.nonzero(peaks)
+
+    # The strongest peaks of every second, so a loud passage cannot crowd out a quiet one
+    frames_per_second = FINGERPRINT_RATE // FINGERPRINT_HOP
+    seconds = frames // frames_per_second
+    order = np.lexsort((-level[frequencies, frames], seconds))
+    kept = order[np.arange(len(order)) - np.searchsorted(seconds[order], seconds[order]) < PEAKS_PER_SECOND]
+    order = kept[np.lexsort((frequencies[kept], frames[kept]))]
+    frequencies, frames = frequencies[order], frames[order]
+
+    # Peaks are in time order, so the targets of an anchor are among the peaks right after it
+    anchors, targets = [], []
+    for shift in range(1, 3 * FAN_OUT + 1):
+        anchor = np.arange(len(frames) - shift)
+        delta = frames[anchor + shift] - frames[anchor]
+        paired = (delta >= 1) & (delta <= MAX_DELTA)
+        anchors.append(anchor[paired])
+        targets.append(anchor[paired] + shift)
+    anchors, targets = np.concatenate(anchors), np.concatenate(targets)
+    order = np.lexsort((targets, anchors))
+    anchors, targets = anchors[order], targets[order]
+    nearest = np.arange(len(anchors)) - np.searchsorted(anchors, anchors) < FAN_OUT
+    anchors, targets = anchors[nearest], targets[nearest]
+
+    hashes = (frequencies[anchors].astype(np.int64) << 15 | frequencies[targets].astype(np.int64) << 6
+              | (frames[targets] - frames[anchors]))
+    return hashes, frames[anchors].astype(np.int64)
+
+
+def frames_to_seconds(frames):
+    return frames * FINGERPRINT_HOP / FINGERPRINT_RATE
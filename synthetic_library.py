@@ -0,0 +1,85 @@
+import argparse
+import os
+import wave
+import numpy as np
+
+
+def parse_mix(text, cast=float):
+    # "1:0.5,30:0.5" -> [(1.0, 0.5), (30.0, 0.5)], a value without weight gets weight 1
+    mix = []
+    for item in text.split(","):
+        value, _, weight = item.partition(":")
+        mix.append((cast(value), float(weight or 1)))
+    return mix
+
+
+def choose(rng, mix, count):
+    values = [value for value, _ in mix]
+    weights = np.array([weight for _, weight in mix], dtype=np.float64)
+    return [values[index] for index in rng.choice(len(values), size=count, p=weights / weights.sum())]
+
+
+def synthesize(rng, duration, sample_rate, channels):
+    # A few decaying partials over noise, different enough per file for the ranking to be meaningful
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    signal = 0.05 * rng.standard_normal(len(t))
+    for _ in range(rng.integers(1, 5)):
+        frequency = rng.uniform(60, 4000)
+        signal += rng.uniform(0.1, 0.5) * np.sin(2 * np.pi * frequency * t) * np.exp(-t * rng.uniform(0, 3))
+    signal /= max(1.0, np.abs(signal).max())
+    samples = (signal * 32767).astype(np.int16)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+
+def write_file(path, samples, sample_rate, audio_format):
+    if audio_format == "wav":
+        with wave.open(path, "wb") as wav_file:
+            wav_file.setnchannels(samples.shape[1])
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            wav_file.writeframes(samples.tobytes())
+        return
+    # Compressed formats need ffmpeg through pydub
+    from pydub import AudioSegment
+    AudioSegment(samples.tobytes(), frame_rate=sample_rate, sample_width=2,
+                 channels=samples.shape[1]).export(path, format=audio_format)
+
+
+def generate_library(directory, count, durations="2", sample_rates="22050", formats="wav", channels="1",
+                     files_per_directory=200, seed=0):
+    rng = np.random.default_rng(seed)
+    duration_list = choose(rng, parse_mix(durations), count)
+    rate_list = choose(rng, parse_mix(sample_rates, int), count)
+    format_list = choose(rng, parse_mix(formats, str), count)
+    channel_list = choose(rng, parse_mix(channels, int), count)
+    paths = []
+    for index in range(count):
+        subdirectory = os.path.join(directory, f"dir{index // files_per_directory:04}")
+        os.makedirs(subdirectory, exist_ok=True)
+        path = os.path.join(subdirectory, f"sample{index:06}.{format_list[index]}")
+        if not os.path.exists(path):
+            # Seeded per file so a partially generated library is completed with the same content
+            samples = synthesize(np.random.default_rng([seed, index]), duration_list[index], rate_list[index],
+                                 channel_list[index])
+            write_file(path, samples, rate_list[index], format_list[index])
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="生成用于性能测试的合成音频库")
+    parser.add_argument("directory", help="输出目录")
+    parser.add_argument("--files", type=int, default=1000, help="文件数")
+    parser.add_argument("--durations", default="2", help="时长分布 (秒:权重), 例如 1:0.5,30:0.5")
+    parser.add_argument("--sample-rates", default="22050", help="采样率分布, 例如 22050:0.5,44100:0.5")
+    parser.add_argument("--formats", default="wav", help="格式分布, 例如 wav:0.8,mp3:0.2 (非 wav 需要 ffmpeg)")
+    parser.add_argument("--channels", default="1", help="声道数分布, 例如 1:0.5,2:0.5")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args(argv)
+    paths = generate_library(args.directory, args.files, args.durations, args.sample_rates, args.formats,
+                             args.channels, seed=args.seed)
+    print(f"{len(paths)} files in {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
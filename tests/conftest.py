@@ -0,0 +1,58 @@
+import os
+import sys
+import wave
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SAMPLE_RATE = 22050
+
+
+def write_wav(path, y, sample_rate=SAMPLE_RATE):
+    samples = (np.clip(y, -1, 1) * 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+def tone_bursts(seed, duration, sample_rate=SAMPLE_RATE, bursts=30):
+    # Short gliding tones over low noise, enough spectral peaks for the fingerprints
+    rng = np.random.default_rng(seed)
+    y = 0.02 * rng.standard_normal(int(duration * sample_rate))
+    for _ in range(bursts):
+        length = int(rng.integers(sample_rate // 20, sample_rate // 3))
+        start = int(rng.integers(0, len(y) - length))
+        t = np.arange(length) / sample_rate
+        frequency = rng.uniform(100, 5000)
+        glide = rng.uniform(-500, 500)
+        burst = np.sin(2 * np.pi * (frequency + glide * t) * t) * np.hanning(length)
+        y[start:start + length] += rng.uniform(0.1, 0.4) * burst
+    return (y / np.abs(y).max()).astype(np.float32)
+
+
+def excerpt(library, tmp_path, name, start, stop, gain=1.0):
+    # A piece of a library file saved as a reference of its own
+    from extract_features import decode_audio
+    y, _, _ = decode_audio(os.path.join(library, name), normalize=False)
+    path = tmp_path / "reference.wav"
+    write_wav(path, gain * y[int(start * SAMPLE_RATE):int(stop * SAMPLE_RATE)])
+    return str(path)
+
+
+@pytest.fixture
+def library(tmp_path):
+    # Files longer than the fixed-size features, with the loudest part after the frames those features cover, and
+    # short ones that are padded
+    directory = tmp_path / "library"
+    directory.mkdir()
+    for index in range(4):
+        y = tone_bursts(index, 14)
+        y[:-3 * SAMPLE_RATE] *= 0.3
+        write_wav(directory / f"long{index}.wav", y)
+    for index in range(3):
+        write_wav(directory / f"short{index}.wav", tone_bursts(10 + index, 1.5, bursts=6))
+    return str(directory)
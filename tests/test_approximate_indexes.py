@@ -0,0 +1,42 @@
+import threading
+import numpy as np
+import pytest
+from FeatureStore import FeatureStore
+from AnnIndex import IVFIndex
+from CompactIndex import CompactIndex
+
+
+def build(kind, store):
+    if kind == "compact":
+        return CompactIndex(store, dims=16), "fit", "scales"
+    return IVFIndex(store, projection_dim=16), "train", "assignments"
+
+
+@pytest.mark.parametrize("kind", ["compact", "ivf"])
+def test_rows_added_while_the_index_is_refitted_are_kept(tmp_path, kind):
+    store = FeatureStore(str(tmp_path), shape=(8, 16))
+    rng = np.random.default_rng(0)
+    for position in range(300):
+        store.put(f"/library/{position}.wav", rng.normal(size=(8, 16)).astype(np.float32))
+    index, refit, marks = build(kind, store)
+    getattr(index, refit)()
+    added, errors = [], []
+
+    def add_rows():
+        # The watcher adds rows one by one while a search refits the index
+        try:
+            for position in range(300, 700):
+                features = rng.normal(size=(8, 16)).astype(np.float32)
+                row = store.put(f"/library/{position}.wav", features)
+                index.add(row, features)
+                added.append(row)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=add_rows)
+    thread.start()
+    while thread.is_alive():
+        getattr(index, refit)()
+    thread.join()
+    assert errors == []
+    assert np.all(getattr(index, marks)[added] >= 0)
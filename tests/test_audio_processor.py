@@ -0,0 +1,59 @@
+import os
+import pytest
+from extract_features import extract_features, feature_params
+from LibraryShards import LibraryShards
+from AudioProcessor import AudioProcessor
+
+
+@pytest.fixture
+def shards(library, tmp_path):
+    shards = LibraryShards(str(tmp_path / "cache"), params=feature_params({}), workers=1)
+    shards.load([library])
+    yield shards
+    shards.close()
+
+
+def run(processor):
+    finished = []
+    processor.finished.connect(finished.append)
+    processor.run()
+    return finished
+
+
+def test_search_ranks_the_reference_first(library, shards):
+    reference = os.path.join(library, "long1.wav")
+    finished = run(AudioProcessor(shards, extract_features(reference, **shards.params)))
+    assert len(finished) == 1
+    assert finished[0][0][1] == reference
+    assert finished[0][0][2] == pytest.approx(0, abs=1e-2)
+
+
+def test_failed_search_still_finishes(library, shards):
+    processor = AudioProcessor(shards, extract_features(os.path.join(library, "long1.wav"), **shards.params))
+
+    def update():
+        raise OSError("disk gone")
+
+    processor.indexer.update = update
+    assert run(processor) == [[]]
+    assert processor.failure == "Error processing search: disk gone"
+
+
+def test_approximate_search_skips_the_exact_partial_ranking(library, tmp_path, monkeypatch):
+    shards = LibraryShards(str(tmp_path / "coarse"), params=feature_params({}), workers=1, coarse=True,
+                           coarse_candidates=2)
+    shards.load([library])
+    reference = os.path.join(library, "long1.wav")
+    ref_mfcc = extract_features(reference, **shards.params)
+    try:
+        run(AudioProcessor(shards, ref_mfcc))
+        pushed = []
+        monkeypatch.setattr("LibraryIndexer.RunningRanking.push",
+                            lambda ranking, paths, cache=None: pushed.append(paths))
+        processor = AudioProcessor(shards, ref_mfcc, update_interval=0)
+        finished = run(processor)
+    finally:
+        shards.close()
+    assert processor.ranking is None
+    assert pushed == []
+    assert finished[0][0][1] == reference
@@ -0,0 +1,31 @@
+import numpy as np
+from FeatureStore import FeatureStore
+from DuplicateFinder import DuplicateFinder
+
+
+def fill_store(directory, rows):
+    store = FeatureStore(str(directory), shape=(4, 8))
+    for index, row in enumerate(rows):
+        store.put(f"/library/{index:05d}.wav", row)
+    store.flush()
+    return store
+
+
+def test_near_duplicates_are_clustered(tmp_path):
+    rng = np.random.default_rng(0)
+    rows = rng.normal(0, 100, (200, 32)).astype(np.float32)
+    rows[150] = rows[3] + 0.1
+    clusters = DuplicateFinder([fill_store(tmp_path, rows)], threshold=5.0, workers=1).find()
+    assert [[path for path, _ in cluster] for cluster in clusters] == [["/library/00003.wav", "/library/00150.wav"]]
+
+
+def test_degenerate_bucket_pairs_stay_linear(tmp_path):
+    # Silent files all hash alike, the bucket is paired with a few neighbours each and not all-against-all
+    count = 3000
+    finder = DuplicateFinder([fill_store(tmp_path, np.zeros((count, 32), dtype=np.float32))], threshold=1.0,
+                             max_bucket=64, workers=1)
+    pairs = finder.candidate_pairs(np.zeros((count, finder.tables * finder.hashes_per_table), dtype=np.float32))
+    assert len(pairs) <= count * finder.neighbours
+    assert len(np.unique(pairs, axis=0)) == len(pairs)
+    clusters = finder.find()
+    assert len(clusters) == 1 and len(clusters[0]) == count
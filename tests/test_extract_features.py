@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pytest
+from extract_features import (extract_features, extract_with_metadata, extract_batch_with_metadata, feature_params,
+                              mfcc_batch)
+from FeatureStore import FeatureStore
+from SegmentStore import SegmentStore
+from FingerprintStore import FingerprintStore
+from LibraryIndexer import LibraryIndexer
+
+
+def index_library(library, directory, mode, batch_size=1):
+    cache = FeatureStore(str(directory), params=feature_params({}))
+    stores = {}
+    if mode == "segment":
+        stores["segment_store"] = SegmentStore(str(directory / "segments"), params=cache.params)
+    elif mode == "fingerprint":
+        stores["fingerprint_store"] = FingerprintStore(str(directory), params=cache.params)
+    indexer = LibraryIndexer([library], cache, batch_size=batch_size, **stores)
+    return indexer, indexer.update()
+
+
+@pytest.mark.parametrize("mode, batch_size", [("whole", 1), ("whole", 4), ("segment", 1), ("fingerprint", 1)])
+def test_library_file_matches_itself_whatever_mode_indexed_it(library, tmp_path, mode, batch_size):
+    # References are always extracted the whole-file way, the cache is shared by every search mode
+    indexer, paths = index_library(library, tmp_path / "cache", mode, batch_size)
+    assert len(paths) == 7
+    for path in paths:
+        results = indexer.rank(extract_features(path, **indexer.cache.params), paths, top_k=1)
+        assert results[0][1] == path
+        assert results[0][2] == pytest.approx(0, abs=1e-2)
+
+
+@pytest.mark.parametrize("normalize", [True, False])
+def test_every_extraction_path_stores_the_same_rows(library, normalize):
+    paths = sorted(os.path.join(library, name) for name in os.listdir(library))
+    expected = [extract_features(path, normalize=normalize) for path in paths]
+    for options in ({}, {"with_frames": True}, {"with_landmarks": True}):
+        outcomes = [extract_with_metadata(path, normalize=normalize, **options) for path in paths]
+        for features, outcome in zip(expected, outcomes):
+            np.testing.assert_array_equal(outcome[0], features)
+    # Clips decoded together go through one vectorized MFCC, which may differ in the last float bits
+    for features, outcome in zip(expected, extract_batch_with_metadata(paths, normalize=normalize)):
+        np.testing.assert_allclose(outcome[0], features, rtol=1e-4, atol=1e-3)
+
+
+def test_mfcc_batch_matches_one_clip_at_a_time():
+    import librosa
+    from conftest import tone_bursts
+    clips = [tone_bursts(seed, duration) for seed, duration in ((0, 0.5), (1, 1.0), (2, 2.5))]
+    batch = mfcc_batch(clips, 22050)
+    for clip, features in zip(clips, batch):
+        single = librosa.feature.mfcc(y=clip, sr=22050)
+        np.testing.assert_allclose(features[:, :single.shape[1]], single, rtol=1e-3, atol=1e-2)
+        assert not features[:, single.shape[1]:].any()
@@ -0,0 +1,90 @@
+import numpy as np
+from FeatureStore import FeatureStore
+
+
+def features(value):
+    return np.full((2, 3), value, dtype=np.float32)
+
+
+def crash(store):
+    # Whatever is still waiting in memory is lost, what reached the files stays
+    store._pending_index = []
+    store._data_file.close()
+    store._data_file = None
+
+
+def test_removed_row_is_not_reused_before_the_removal_is_durable(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3))
+    store.put("/library/a.wav", features(1))
+    store.put("/library/b.wav", features(2))
+    store.checkpoint()
+    store.remove("/library/a.wav")
+    store.put("/library/c.wav", features(3))
+    crash(store)
+    reopened = FeatureStore(str(tmp_path), shape=(2, 3))
+    assert sorted(reopened.entries) == ["/library/a.wav", "/library/b.wav"]
+    np.testing.assert_array_equal(reopened["/library/a.wav"], features(1))
+
+
+def test_removed_row_is_reused_after_a_checkpoint(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3))
+    row = store.put("/library/a.wav", features(1))
+    store.remove("/library/a.wav")
+    store.checkpoint()
+    assert store.put("/library/b.wav", features(2)) == row
+    assert store.row_count == 1
+
+
+def test_round_trip(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3), params={"sample_rate": 22050})
+    store.put("/library/a.wav", features(1), mtime=5, size=10)
+    store.put("/library/b.wav", features(2), mtime=6, size=11)
+    store.put("/library/a.wav", features(3), mtime=7, size=12, duration=1.5)
+    store.close()
+    reopened = FeatureStore(str(tmp_path), shape=(2, 3), params={"sample_rate": 22050})
+    assert len(reopened) == 2
+    np.testing.assert_array_equal(reopened["/library/a.wav"], features(3))
+    np.testing.assert_array_equal(reopened["/library/b.wav"], features(2))
+    assert reopened.is_current("/library/a.wav", {"mtime": 7, "size": 12})
+    assert not reopened.is_current("/library/a.wav", {"mtime": 5, "size": 10})
+    assert reopened.metadata("/library/a.wav")["duration"] == 1.5
+    assert reopened.prune(["/library"], {"/library/b.wav"}) == ["/library/a.wav"]
+
+
+def test_other_settings_start_over(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3), params={"sample_rate": 22050})
+    store.put("/library/a.wav", features(1))
+    store.close()
+    reopened = FeatureStore(str(tmp_path), shape=(2, 3), params={"sample_rate": 16000})
+    assert len(reopened) == 0
+    assert reopened.generation == store.generation + 1
+
+
+def test_interrupted_writes_are_dropped_on_load(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3))
+    store.put("/library/a.wav", features(1))
+    store.put("/library/b.wav", features(2))
+    store.checkpoint()
+    store.close()
+    # Half a row appended and half an index line written when the process died
+    with open(store.data_path, "ab") as data_file:
+        data_file.write(b"\0" * 7)
+    with open(store.index_path, "a", encoding="utf-8") as index_file:
+        index_file.write('{"path": "/library/c.wav", "ro')
+    reopened = FeatureStore(str(tmp_path), shape=(2, 3))
+    assert sorted(reopened.entries) == ["/library/a.wav", "/library/b.wav"]
+    assert reopened.row_count == 2
+    np.testing.assert_array_equal(reopened["/library/b.wav"], features(2))
+
+
+def test_index_lines_pointing_past_the_data_are_dropped(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(2, 3))
+    store.put("/library/a.wav", features(1))
+    store.put("/library/b.wav", features(2))
+    store.close()
+    # The index line made it to disk, the row it points at did not
+    with open(store.data_path, "r+b") as data_file:
+        data_file.truncate(store.row_bytes)
+    reopened = FeatureStore(str(tmp_path), shape=(2, 3))
+    assert list(reopened.entries) == ["/library/a.wav"]
+    assert reopened.free_rows == []
@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pytest
+from conftest import SAMPLE_RATE, excerpt, write_wav
+from extract_features import extract_landmarks, feature_params
+from FeatureStore import FeatureStore
+from FingerprintStore import FingerprintStore
+from LibraryIndexer import LibraryIndexer
+
+
+@pytest.fixture
+def fingerprint_store(library, tmp_path):
+    cache = FeatureStore(str(tmp_path / "cache"), params=feature_params({}))
+    fingerprint_store = FingerprintStore(str(tmp_path / "cache"), params=cache.params)
+    LibraryIndexer([library], cache, fingerprint_store=fingerprint_store).update()
+    return fingerprint_store
+
+
+def test_fingerprint_search_finds_the_offset_of_a_quieter_excerpt(library, tmp_path, fingerprint_store):
+    reference = excerpt(library, tmp_path, "long2.wav", 4.0, 7.5, gain=0.5)
+    hashes, times = extract_landmarks(reference, **fingerprint_store.params)
+    matches = fingerprint_store.match(hashes, times, top_k=3)
+    assert [path for path, _, _ in matches] == [os.path.join(library, "long2.wav")]
+    assert matches[0][2] == pytest.approx(4.0, abs=0.03)
+
+
+def test_fingerprint_search_ignores_unrelated_audio(library, tmp_path, fingerprint_store):
+    rng = np.random.default_rng(99)
+    path = tmp_path / "noise.wav"
+    write_wav(path, 0.3 * rng.standard_normal(3 * SAMPLE_RATE))
+    hashes, times = extract_landmarks(str(path), **fingerprint_store.params)
+    assert fingerprint_store.match(hashes, times) == []
+
+
+def test_fingerprints_of_deleted_files_are_not_matched(library, tmp_path, fingerprint_store):
+    target = os.path.join(library, "long3.wav")
+    hashes, times = extract_landmarks(target, **fingerprint_store.params)
+    assert fingerprint_store.match(hashes, times, top_k=1)[0][0] == target
+    fingerprint_store.remove(target)
+    fingerprint_store.close()
+    reopened = FingerprintStore(fingerprint_store.directory, params=fingerprint_store.params)
+    assert target not in reopened
+    assert reopened.match(hashes, times) == []
+
+
+
+def test_fingerprint_search_is_limited_to_the_given_paths(library, tmp_path, fingerprint_store):
+    target = os.path.join(library, "long0.wav")
+    hashes, times = extract_landmarks(target, **fingerprint_store.params)
+    assert fingerprint_store.match(hashes, times, [target], top_k=1)[0][0] == target
+    others = [path for path in fingerprint_store.entries if path != target]
+    assert fingerprint_store.match(hashes, times, others) == []
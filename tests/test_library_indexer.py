@@ -0,0 +1,20 @@
+import os
+from extract_features import feature_params
+from FeatureStore import FeatureStore
+from SegmentStore import SegmentStore
+from FingerprintStore import FingerprintStore
+from LibraryIndexer import LibraryIndexer
+
+
+def test_find_changes_prunes_deleted_files_from_every_store(library, tmp_path):
+    cache = FeatureStore(str(tmp_path / "cache"), params=feature_params({}))
+    segment_store = SegmentStore(str(tmp_path / "cache" / "segments"), params=cache.params)
+    fingerprint_store = FingerprintStore(str(tmp_path / "cache"), params=cache.params)
+    indexer = LibraryIndexer([library], cache, segment_store=segment_store, fingerprint_store=fingerprint_store)
+    indexer.update()
+    deleted = os.path.join(library, "short0.wav")
+    os.remove(deleted)
+    assert indexer.find_changes() == []
+    for store in (cache, segment_store, fingerprint_store):
+        assert deleted not in store
+        assert len(store) == 6
@@ -0,0 +1,42 @@
+import json
+import os
+import threading
+from LibraryScanner import LibraryScanner
+
+
+def test_scanners_of_one_directory_save_at_the_same_time(library, tmp_path):
+    errors = []
+
+    def scan():
+        scanner = LibraryScanner(str(tmp_path), settle_time=0)
+        try:
+            for _ in range(50):
+                scanner.list_audio_files([library])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=scan) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    with open(tmp_path / "listing_cache.json", encoding="utf-8") as cache_file:
+        assert library in json.load(cache_file)["directories"]
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
+
+
+def test_unchanged_directories_are_listed_from_the_cache(library, tmp_path):
+    first = LibraryScanner(str(tmp_path), settle_time=0).list_audio_files([library])
+    assert len(first) == 7
+    assert LibraryScanner(str(tmp_path), settle_time=0).list_audio_files([library]) == first
+
+
+def test_directory_links_are_not_followed(library, tmp_path):
+    subdirectory = os.path.join(library, "d")
+    os.mkdir(subdirectory)
+    os.symlink(os.path.join(library, "long0.wav"), os.path.join(subdirectory, "linked.wav"))
+    os.symlink("..", os.path.join(subdirectory, "up"))
+    audio_files = LibraryScanner(str(tmp_path), settle_time=0).list_audio_files([library])
+    assert len(audio_files) == 8
+    assert os.path.join(subdirectory, "linked.wav") in audio_files
@@ -0,0 +1,26 @@
+import os
+import shutil
+from extract_features import extract_features, feature_params
+from LibraryShards import LibraryShards, ShardedIndexer
+
+
+def test_nested_root_files_are_indexed_once(library, tmp_path):
+    outer = str(tmp_path / "outer")
+    inner = os.path.join(outer, "inner")
+    os.makedirs(inner)
+    shutil.copy(os.path.join(library, "long0.wav"), os.path.join(outer, "a.wav"))
+    shutil.copy(os.path.join(library, "long1.wav"), os.path.join(inner, "b.wav"))
+    shards = LibraryShards(str(tmp_path / "cache"), params=feature_params({}), workers=1)
+    try:
+        # Indexed as one root first, the outer shard then hands the nested files over
+        shards.load([outer])
+        assert len(ShardedIndexer(shards).update()) == 2
+        shards.load([outer, inner])
+        indexer = ShardedIndexer(shards)
+        paths = indexer.update()
+        assert sorted(paths) == sorted([os.path.join(outer, "a.wav"), os.path.join(inner, "b.wav")])
+        assert shards.file_count() == 2
+        ranked = indexer.rank(extract_features(os.path.join(inner, "b.wav"), **shards.params), paths)
+        assert [path for _, path, _ in ranked].count(os.path.join(inner, "b.wav")) == 1
+    finally:
+        shards.close()
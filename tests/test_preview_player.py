@@ -0,0 +1,24 @@
+import logging
+import threading
+from PreviewPlayer import PreviewPlayer
+
+
+def test_shutdown_with_queued_preloads(caplog):
+    player = PreviewPlayer()
+    release = threading.Event()
+
+    def decode(path):
+        release.wait(5)
+        return b"\0" * 4
+
+    player.decode = decode
+    paths = [f"/library/{index}.wav" for index in range(5)]
+    with caplog.at_level(logging.ERROR, logger="concurrent.futures"):
+        player.preload(paths)
+        player.shutdown()
+        release.set()
+        player.executor.shutdown(wait=True)
+    assert not [record for record in caplog.records if record.name == "concurrent.futures"]
+    assert player.pending == {}
+    # The one decode already running when the rest were cancelled still lands in the cache
+    assert list(player.cache) == paths[:1]
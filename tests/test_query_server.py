@@ -0,0 +1,41 @@
+import os
+import threading
+from extract_features import feature_params
+from LibraryShards import LibraryShards
+from QueryServer import ServerIndexer
+
+
+def test_server_indexer_reports_failures_and_keeps_running(library, tmp_path):
+    broken = os.path.join(library, "broken.wav")
+    with open(broken, "wb") as broken_file:
+        broken_file.write(b"not audio at all")
+    shards = LibraryShards(str(tmp_path / "cache"), params=feature_params({}), workers=1)
+    shards.load([library])
+    errors = []
+    scanned = threading.Event()
+    indexer = ServerIndexer(shards, poll_interval=0.05, on_error=errors.append)
+    shard_indexer = indexer.indexers[0]
+    prune_missing = shard_indexer.prune_missing
+
+    def fail_once(audio_files):
+        # An error outside the per-file handling, the thread has to survive it and scan again
+        shard_indexer.prune_missing = prune_missing
+        raise OSError("disk gone")
+
+    def flush():
+        # Only reached by a scan that went through
+        ServerIndexer.flush(indexer)
+        scanned.set()
+
+    shard_indexer.prune_missing = fail_once
+    indexer.flush = flush
+    indexer.thread.start()
+    try:
+        assert scanned.wait(60)
+        assert indexer.thread.is_alive()
+    finally:
+        indexer.stop()
+        shards.close()
+    assert any(message.startswith(f"Error processing {broken}:") for message in errors)
+    assert f"Error processing {library}: disk gone" in errors
+    assert len(indexer.library_paths()) == 7
@@ -0,0 +1,23 @@
+import os
+import pytest
+from conftest import excerpt
+from extract_features import extract_frames, feature_params
+from FeatureStore import FeatureStore
+from SegmentStore import SegmentStore
+from LibraryIndexer import LibraryIndexer
+
+
+@pytest.fixture
+def segment_store(library, tmp_path):
+    cache = FeatureStore(str(tmp_path / "cache"), params=feature_params({}))
+    segment_store = SegmentStore(str(tmp_path / "cache" / "segments"), params=cache.params)
+    LibraryIndexer([library], cache, segment_store=segment_store).update()
+    return segment_store
+
+
+def test_segment_search_finds_the_offset_of_an_excerpt(library, tmp_path, segment_store):
+    reference = excerpt(library, tmp_path, "long1.wav", 11.5, 13.5)
+    matches = segment_store.search(extract_frames(reference, **segment_store.params), top_k=3)
+    path, _, offset = matches[0]
+    assert path == os.path.join(library, "long1.wav")
+    assert offset == pytest.approx(11.5, abs=0.03)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+from FeatureStore import FeatureStore
+from SignatureIndex import SignatureIndex
+from calculate_similarity import exact_distances, rank_similarity
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FeatureStore(str(tmp_path), shape=(20, 40))
+    rng = np.random.default_rng(0)
+    # Rows drift over time like MFCCs do, with some near copies of each other
+    base = np.cumsum(rng.normal(0, 1, (500, 20, 40)), axis=2).astype(np.float32)
+    base[250:] = base[:250] + rng.normal(0, 0.5, (250, 20, 40))
+    for index, features in enumerate(base):
+        store.put(f"/library/{index}.wav", features)
+    store.flush()
+    return store
+
+
+@pytest.mark.parametrize("segments", [1, 4, 40])
+def test_lower_bound_never_exceeds_the_exact_distance(store, segments):
+    index = SignatureIndex(store, segments)
+    rows = np.arange(store.row_count)
+    index.fill(rows)
+    for query_row in (0, 17, 260):
+        ref = np.asarray(store.matrix[query_row]).reshape(store.shape)
+        bounds = index.lower_bounds(ref, rows)
+        exact = exact_distances(ref, store.matrix, rows)
+        assert np.all(bounds <= exact * (1 + 1e-5) + 1e-3)
+
+
+def test_pruned_search_returns_the_exact_ranking_when_proven(store):
+    index = SignatureIndex(store, segments=8, candidates=50)
+    rows = np.arange(store.row_count)
+    ref = np.asarray(store.matrix[3]).reshape(store.shape)
+    positions, distances = index.search(ref, rows, top_k=5)
+    exact_positions, exact = rank_similarity(ref, store.matrix, rows, 5)
+    assert list(positions) == list(exact_positions)
+    np.testing.assert_allclose(distances, exact, rtol=1e-5)